@@ -1,4 +1,6 @@
 import os
+import time
+_import_started = time.perf_counter()
 from flask import Flask
 from flask_sqlalchemy import SQLAlchemy
 from flask_bcrypt import Bcrypt
@@ -20,10 +22,34 @@ else:
 
 # Optional: silence warning
 app.config['SQLALCHEMY_TRACK_MODIFICATIONS'] = False
+
+# Every gunicorn worker has its own pool: one connection for the request it is serving and
+# one for the background "for you" refresh, plus a little overflow. With the Procfile's
+# 3 workers that is at most 3 * (2 + 2) = 12 connections; raise DB_POOL_SIZE with --threads.
+if not app.config['SQLALCHEMY_DATABASE_URI'].startswith('sqlite'):
+    app.config['SQLALCHEMY_ENGINE_OPTIONS'] = {
+        'pool_size': int(os.environ.get('DB_POOL_SIZE', 2)),
+        'max_overflow': int(os.environ.get('DB_MAX_OVERFLOW', 2)),
+        'pool_timeout': 10,
+        'pool_recycle': 280,
+        'pool_pre_ping': True,
+    }
 db = SQLAlchemy(app)
 bcrypt = Bcrypt(app)
 login_manager = LoginManager(app)
 login_manager.login_view = 'login'
 
-from Main import routes
+from Main import routes, commands
+from Main.metrics import metrics
+
+# How long importing the app (Flask, SQLAlchemy, forms, routes) took; see Main/warmup.py
+IMPORT_SECONDS = time.perf_counter() - _import_started
+metrics.observe('app_import', IMPORT_SECONDS)
+
+if os.environ.get('RECOMM_WARM_CACHE', '').lower() in ('1', 'true'):
+    from Main.pool import scoring_pool
+    from Main.recomm import warm_recommendation_cache
+    # This may be the --preload master, which must not start scoring processes of its own
+    with scoring_pool.inline_calls():
+        warm_recommendation_cache()
 
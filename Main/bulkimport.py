@@ -0,0 +1,133 @@
+import csv
+import json
+import os
+from urllib.parse import urlsplit
+from Main.catalog import get_catalog, MOVIE_COLUMNS
+from Main.metrics import metrics
+from Main.search import get_title_index, normalize_title
+from Main.store import store, CatalogChanged
+
+
+IMPORT_COLUMNS = MOVIE_COLUMNS + ['image_url']
+# Rows accepted per /api/movies/import request; the CLI has no limit
+MAX_IMPORT_ROWS = int(os.environ.get('MAX_IMPORT_ROWS', 10000))
+# Validations of a batch before giving up when other writes keep landing in between
+IMPORT_ATTEMPTS = 5
+
+JSONL_TYPES = ('application/x-ndjson', 'application/jsonl', 'application/json-lines', 'application/json')
+
+
+def batch_format(filename=None, mimetype=None, first_line=''):
+    """'jsonl' or 'csv', from the file extension, then the content type, then the first line."""
+    extension = os.path.splitext(filename or '')[1].lower()
+    if extension in ('.jsonl', '.ndjson'):
+        return 'jsonl'
+    if extension == '.csv' or mimetype == 'text/csv':
+        return 'csv'
+    if mimetype in JSONL_TYPES or first_line.lstrip().startswith('{'):
+        return 'jsonl'
+    return 'csv'
+
+
+def read_batch(lines, fmt):
+    """
+    Parses a CSV (with a header row) or JSON Lines batch from an iterable of text lines.
+    Returns ([(row number, row dict), ...], [error, ...]) where errors are rows that could
+    not be parsed at all; CSV rows are numbered from the first data row, JSON Lines by line.
+    """
+    rows, errors = [], []
+    if fmt == 'csv':
+        for number, row in enumerate(csv.DictReader(lines), start=1):
+            rows.append((number, row))
+        return rows, errors
+
+    for number, line in enumerate(lines, start=1):
+        if not line.strip():
+            continue
+        try:
+            row = json.loads(line)
+        except ValueError as e:
+            errors.append({'row': number, 'movie_id': '', 'errors': [f'invalid JSON: {e}']})
+            continue
+        if not isinstance(row, dict):
+            errors.append({'row': number, 'movie_id': '', 'errors': ['expected a JSON object']})
+            continue
+        rows.append((number, row))
+    return rows, errors
+
+
+def _is_image_url(url):
+    parts = urlsplit(url)
+    return parts.scheme in ('http', 'https') and '.' in parts.netloc
+
+
+def validate_batch(rows):
+    """
+    Checks every row in one pass against the catalog's ids and the title index, and against
+    the rows before it in the batch: all fields present, a whole-number year, an unused
+    movie_id and title, and an http(s) image URL. Returns (movies to import, row errors).
+    """
+    catalog = get_catalog()
+    titles = get_title_index().exact
+    seen_ids, seen_titles = set(), set()
+    movies, errors = [], []
+
+    for number, row in rows:
+        movie = {col: str(row.get(col) or '').strip() for col in IMPORT_COLUMNS}
+        problems = []
+        missing = [col for col in IMPORT_COLUMNS if not movie[col]]
+        if missing:
+            problems.append('missing ' + ', '.join(missing))
+
+        movie_id = movie['movie_id']
+        if movie_id and movie_id in seen_ids:
+            problems.append('movie_id appears earlier in the batch')
+        elif movie_id and movie_id in catalog:
+            problems.append('movie_id already exists')
+
+        title = normalize_title(movie['title'])
+        if title and title in seen_titles:
+            problems.append('title appears earlier in the batch')
+        elif title and title in titles:
+            problems.append('title already exists')
+
+        if movie['year'] and not movie['year'].isdigit():
+            problems.append('year must be a whole number')
+        if movie['image_url'] and not _is_image_url(movie['image_url']):
+            problems.append('image_url must be an http(s) URL')
+
+        if problems:
+            errors.append({'row': number, 'movie_id': movie_id, 'errors': problems})
+            continue
+        seen_ids.add(movie_id)
+        seen_titles.add(title)
+        movies.append(movie)
+    return movies, errors
+
+
+def import_movies(rows, errors=(), dry_run=False):
+    """
+    Validates rows and appends the valid ones to the catalog with a single locked write, so
+    readers see all of them or none. The write only goes through if nothing else was written
+    since the catalog state the batch was validated against, otherwise the batch is validated
+    again; CatalogChanged is raised after IMPORT_ATTEMPTS tries. Returns {'rows', 'imported',
+    'errors'} with errors (including the parse errors passed in) sorted by row.
+    """
+    with metrics.timer('bulk_import'):
+        for attempt in range(IMPORT_ATTEMPTS):
+            generation = get_catalog().generation
+            movies, invalid = validate_batch(rows)
+            if not movies or dry_run:
+                break
+            try:
+                store.upsert_many(movies, generation=generation)
+                break
+            except CatalogChanged:
+                if attempt == IMPORT_ATTEMPTS - 1:
+                    raise
+                metrics.count('bulk_import_retry')
+    return {
+        'rows': len(rows) + len(errors),
+        'imported': len(movies),
+        'errors': sorted(list(errors) + invalid, key=lambda error: error['row']),
+    }
@@ -0,0 +1,537 @@
+import bisect
+import hashlib
+import json
+import mmap
+import os
+import struct
+import threading
+from collections import namedtuple
+from contextlib import contextmanager
+from datetime import datetime, timezone
+import numpy as np
+from Main.columnar import ColumnarCatalog
+from Main.metrics import metrics
+from Main.tokens import GrowableArray
+
+try:
+    import fcntl
+except ImportError:  # Windows: single-process dev server only
+    fcntl = None
+
+
+BASE_DIR = os.path.dirname(os.path.abspath(__file__))
+# Directory holding the catalog files; MOVIE_DATA_DIR points the app (or a benchmark) elsewhere
+DATA_DIR = os.environ.get('MOVIE_DATA_DIR', BASE_DIR)
+MOVIES_CSV = os.path.join(DATA_DIR, 'movies.csv')
+IMAGES_CSV = os.path.join(DATA_DIR, 'movie_images.csv')
+# Optional columnar copy of both CSVs written by cleaning.py (see Main/columnar.py)
+CATALOG_BIN = os.path.join(DATA_DIR, 'catalog.bin')
+# Append-only upserts/tombstones not yet compacted into the CSVs (see Main/store.py)
+CATALOG_LOG = os.path.join(DATA_DIR, 'catalog.log')
+CATALOG_LOCK = os.path.join(DATA_DIR, 'catalog.lock')
+# Counter bumped with every write to the log, so workers notice changes without a stat
+CATALOG_GENERATION = os.path.join(DATA_DIR, 'catalog.gen')
+
+MOVIE_COLUMNS = ['movie_id', 'title', 'genres', 'overview', 'cast', 'director', 'year']
+RECORD_COLUMNS = MOVIE_COLUMNS + ['image_url']
+
+_thread_lock = threading.RLock()
+
+
+@contextmanager
+def catalog_lock(shared=False, path=CATALOG_LOCK):
+    """
+    Cross-process lock on the catalog files. Readers take it shared while loading a
+    snapshot; appends and compaction take it exclusive.
+    """
+    with _thread_lock:
+        if fcntl is None or path is None:
+            yield
+            return
+        with open(path, 'a') as f:
+            fcntl.flock(f.fileno(), fcntl.LOCK_SH if shared else fcntl.LOCK_EX)
+            try:
+                yield
+            finally:
+                fcntl.flock(f.fileno(), fcntl.LOCK_UN)
+
+
+class GenerationCounter:
+    """
+    Catalog generation shared by every process: a little-endian uint64 in `path`, bumped by
+    CatalogStore under the exclusive catalog lock after each append or compaction. Readers
+    map the file once, so checking for a change is a memory read.
+    """
+
+    def __init__(self, path=CATALOG_GENERATION):
+        self.path = path
+        self._map = None
+
+    def read(self):
+        if self.path is None:
+            return 0
+        if self._map is None:
+            try:
+                with open(self.path, 'rb') as f:
+                    self._map = mmap.mmap(f.fileno(), 8, access=mmap.ACCESS_READ)
+            except (OSError, ValueError):  # not written yet (ValueError: still empty)
+                return 0
+        return struct.unpack_from('<Q', self._map)[0]
+
+    def bump(self):
+        """Increments the counter and returns the new value; the caller holds the exclusive lock."""
+        fd = os.open(self.path, os.O_RDWR | os.O_CREAT, 0o644)
+        with os.fdopen(fd, 'r+b') as f:
+            data = f.read(8)
+            value = (struct.unpack('<Q', data)[0] if len(data) == 8 else 0) + 1
+            f.seek(0)
+            f.write(struct.pack('<Q', value))
+        return value
+
+
+def compaction_paths(log_path):
+    """
+    (folded log, marker) next to log_path: compaction moves the log it folded into the base
+    files to the first, and records the stamps of the base files it read and of the ones it
+    wrote in the second (see Catalog._follow_compaction()).
+    """
+    return log_path + '.prev', log_path + '.compacted'
+
+
+def _stamps(stamps):
+    return tuple(tuple(stamp) if stamp else None for stamp in stamps)
+
+
+def read_compaction(marker_path):
+    """The (read, written) base file stamps of the last compaction, or None."""
+    try:
+        with open(marker_path, encoding='utf-8') as f:
+            marker = json.load(f)
+        return _stamps(marker['read']), _stamps(marker['written'])
+    except (OSError, ValueError, KeyError, TypeError):
+        return None
+
+
+def _read_csv(path):
+    # pandas is only needed without a current catalog.bin, so it is not imported at startup
+    import pandas as pd
+    if not os.path.exists(path):
+        return pd.DataFrame()
+    # Everything is read as text so records look the same as csv.DictReader rows
+    return pd.read_csv(path, dtype=str, keep_default_na=False, on_bad_lines='skip')
+
+
+class CatalogRows:
+    """
+    Row space shared by the indexes for one load of the base files (an epoch): the base
+    records, then every movie upserted through the log, in log order. Rows never move, so
+    an index built at any point applies later changes by row; a delete or a replacement
+    only marks the old row dead.
+    """
+
+    def __init__(self, base):
+        self.base = base
+        self.appended = []
+        self.alive = GrowableArray(np.ones(len(base), dtype=bool))
+        self.live = len(base)
+
+    def __len__(self):
+        return len(self.base) + len(self.appended)
+
+    def __getitem__(self, row):
+        if row < len(self.base):
+            return self.base[row]
+        return self.appended[row - len(self.base)]
+
+    def append(self, record):
+        self.alive.append(True)
+        self.appended.append(record)
+        self.live += 1
+        return len(self) - 1
+
+    def kill(self, row):
+        if self.alive[row]:
+            self.alive[row] = False
+            self.live -= 1
+
+
+# What an index is built from: rows (which keep growing), its alive mask at `version`
+CatalogSnapshot = namedtuple('CatalogSnapshot', ['records', 'alive', 'epoch', 'version'])
+
+
+class OverlayRecords:
+    """Base records with the log applied: deleted rows skipped, replaced rows swapped, new movies appended."""
+
+    def __init__(self, base, kept, replaced, appended):
+        self._base = base
+        self._kept = kept
+        self._replaced = replaced
+        self._appended = appended
+
+    def __len__(self):
+        return len(self._kept) + len(self._appended)
+
+    def __getitem__(self, row):
+        if row < 0:
+            row += len(self)
+        if row < 0:
+            raise IndexError(row)
+        if row < len(self._kept):
+            base_row = int(self._kept[row])
+            record = self._replaced.get(base_row)
+            return record if record is not None else self._base[base_row]
+        return self._appended[row - len(self._kept)]
+
+    def __iter__(self):
+        for row in range(len(self)):
+            yield self[row]
+
+
+class Catalog:
+    """
+    In-process copy of movies.csv joined to the poster URLs in movie_images.csv.
+    The CSVs are parsed once per worker and only re-parsed when one of the files changes
+    (checked via mtime and size), so request handlers can call refresh() freely.
+    When a columnar catalog.bin at least as new as both CSVs exists it is mapped instead,
+    so records are decoded on access and all workers share the same pages.
+    Uploads and deletes recorded in catalog.log are applied on top of either base: when
+    the shared generation moves, only the lines appended since the last refresh are read,
+    and the row changes are journaled for the indexes (see changes_since()). A compaction
+    does not start a new epoch either: the base it writes holds the movies this catalog
+    already has, so it reads what is left of the folded log and carries on.
+    """
+
+    def __init__(self, movies_path=MOVIES_CSV, images_path=IMAGES_CSV, binary_path=CATALOG_BIN,
+                 log_path=CATALOG_LOG, lock_path=CATALOG_LOCK, generation_path=CATALOG_GENERATION):
+        self.movies_path = movies_path
+        self.images_path = images_path
+        self.binary_path = binary_path
+        self.log_path = log_path
+        self.lock_path = lock_path
+        # Bumped on every reload of the base files; rows and the journal start over
+        self.epoch = 0
+        self.version = 0
+        # Derived from the files' stamps and the generation, so every worker agrees on it (unlike version)
+        self.fingerprint = None
+        # The shared generation this state was read at (see CatalogStore.upsert_many())
+        self.generation = 0
+        self.last_modified = None
+        self.rows = CatalogRows([])
+        self._records = None
+        self._movies = None
+        self._base_stamp = None
+        self._base_records = []
+        self._base_rows = {}
+        self._base_table = None
+        self._upserts = {}
+        self._deletes = set()
+        self._live_rows = {}
+        self._journal = []
+        self._log_offset = 0
+        self._generation = GenerationCounter(generation_path if log_path else None)
+        self._stamp = None
+        self._lock = threading.Lock()
+
+    def base_file_stamp(self):
+        """(mtime_ns, size) of movies.csv, movie_images.csv and catalog.bin; None for a missing file."""
+        stamp = []
+        for path in (self.movies_path, self.images_path, self.binary_path):
+            if path is None:
+                stamp.append(None)
+                continue
+            try:
+                st = os.stat(path)
+                stamp.append((st.st_mtime_ns, st.st_size))
+            except OSError:
+                stamp.append(None)
+        return tuple(stamp)
+
+    @property
+    def loaded_base_stamp(self):
+        """base_file_stamp() of the base files the rows were loaded from (or followed to)."""
+        return self._base_stamp
+
+    def _file_stamp(self):
+        return self.base_file_stamp() + (self._generation.read(),)
+
+    def refresh(self):
+        if self._file_stamp() != self._stamp:
+            with self._lock:
+                with catalog_lock(shared=True, path=self.lock_path):
+                    stamp = self._file_stamp()
+                    if stamp != self._stamp:
+                        stage = 'catalog_load' if stamp[:3] != self._base_stamp else 'catalog_delta'
+                        with metrics.timer(stage):
+                            self._load(stamp)
+                        self._stamp = stamp
+        return self
+
+    def _binary_is_current(self, stamp):
+        movies_stamp, images_stamp, binary_stamp = stamp[:3]
+        if binary_stamp is None:
+            return False
+        return all(csv_stamp is None or csv_stamp[0] <= binary_stamp[0]
+                   for csv_stamp in (movies_stamp, images_stamp))
+
+    def _load(self, stamp):
+        # Only the generation moved: keep the parsed (or mapped) base and read the new log lines
+        operations = []
+        if stamp[:3] != self._base_stamp:
+            operations = self._follow_compaction(stamp)
+            if operations is None:
+                self._load_base(stamp)
+                operations = []
+
+        self.version += 1
+        new_operations = self._read_log(self.log_path)
+        if new_operations is None:
+            # The log shrank without a compaction this catalog could follow; start over from the files
+            self._load_base(stamp)
+            operations, new_operations = [], self._read_log(self.log_path) or []
+        operations += new_operations
+        # Readers may be iterating the current dicts, so the operations go into copies
+        upserts, deletes = dict(self._upserts), set(self._deletes)
+        for op in operations:
+            self._apply(op, upserts, deletes)
+        self._upserts, self._deletes = upserts, deletes
+        self._records = None
+        self._movies = None
+        self.fingerprint = hashlib.sha1(repr(stamp).encode('utf-8')).hexdigest()[:16]
+        self.generation = stamp[3]
+        mtimes = [s[0] for s in stamp[:3] if s is not None]
+        if self.log_path and os.path.exists(self.log_path):
+            mtimes.append(os.stat(self.log_path).st_mtime_ns)
+        self.last_modified = datetime.fromtimestamp(max(mtimes) / 1e9, timezone.utc) if mtimes else None
+
+    def _load_base(self, stamp):
+        if self._binary_is_current(stamp):
+            self._load_binary()
+        else:
+            self._load_csv()
+        self._base_stamp = stamp[:3]
+        self._start_epoch()
+
+    def _follow_compaction(self, stamp):
+        """
+        When the base files changed because a compaction folded the log this catalog is reading
+        into the files it loaded, returns the operations of that log not read yet: the new
+        files hold the same live movies, so the row space, the loaded base and the indexes
+        built on them carry on. None when the files have to be loaded again because they
+        changed some other way, or more than one compaction happened since.
+        """
+        if not self.log_path or self._base_stamp is None:
+            return None
+        folded_log, marker_path = compaction_paths(self.log_path)
+        if read_compaction(marker_path) != (self._base_stamp, stamp[:3]):
+            return None
+        operations = self._read_log(folded_log)
+        if operations is None:
+            return None
+        self._base_stamp = stamp[:3]
+        self._log_offset = 0
+        return operations
+
+    def _start_epoch(self):
+        self.epoch += 1
+        self.rows = CatalogRows(self._base_records)
+        self._upserts, self._deletes = {}, set()
+        self._live_rows = {}
+        self._journal = []
+        self._log_offset = 0
+
+    def _read_log(self, path):
+        """Operations in the complete lines of the log at path written since the last read; None if it shrank."""
+        if not path:
+            return []
+        try:
+            f = open(path, 'rb')
+        except OSError:
+            return None if self._log_offset else []
+        with f:
+            if os.fstat(f.fileno()).st_size < self._log_offset:
+                return None
+            f.seek(self._log_offset)
+            data = f.read()
+        # A torn last line is left for the next read (the store completes it before appending)
+        end = data.rfind(b'\n') + 1
+        self._log_offset += end
+        operations = []
+        for line in data[:end].splitlines():
+            try:
+                operations.append(json.loads(line))
+            except ValueError:
+                continue
+        return operations
+
+    def _apply(self, op, upserts, deletes):
+        if op.get('op') == 'upsert':
+            record = op['movie']
+            movie_id = record['movie_id']
+            self._kill(movie_id, upserts, deletes)
+            row = self.rows.append(record)
+            self._live_rows[movie_id] = row
+            upserts[movie_id] = record
+            deletes.discard(movie_id)
+            self._journal.append((self.version, row, record))
+        elif op.get('op') == 'delete':
+            movie_id = op['movie_id']
+            self._kill(movie_id, upserts, deletes)
+            upserts.pop(movie_id, None)
+            deletes.add(movie_id)
+
+    def _kill(self, movie_id, upserts, deletes):
+        row = self._live_rows.pop(movie_id, None)
+        # A base row is only live while the log has not touched its movie
+        if row is None and movie_id not in upserts and movie_id not in deletes:
+            row = self._base_row(movie_id)
+        if row is not None:
+            self.rows.kill(row)
+            self._journal.append((self.version, row, None))
+
+    def changes_since(self, epoch, version):
+        """
+        Row changes after `version` as ([(row, record, or None if the row died), ...], current
+        version), oldest first; (None, version) when `epoch` is over and indexes must rebuild.
+        """
+        with self._lock:
+            if epoch != self.epoch:
+                return None, self.version
+            start = bisect.bisect_right(self._journal, version, key=lambda change: change[0])
+            return [(row, record) for _, row, record in self._journal[start:]], self.version
+
+    def snapshot(self):
+        """The row space and a copy of its alive mask, as of the current version (see CatalogSnapshot)."""
+        with self._lock:
+            return CatalogSnapshot(self.rows, self.rows.alive.view().copy(), self.epoch, self.version)
+
+    def _load_binary(self):
+        table = ColumnarCatalog(self.binary_path)
+        self._base_table = table
+        self._base_records = table.records
+        self._base_rows = None
+
+    def _load_csv(self):
+        movies = _read_csv(self.movies_path)
+        for col in MOVIE_COLUMNS:
+            if col not in movies.columns:
+                movies[col] = ''
+        movies = movies[MOVIE_COLUMNS].copy()
+        movies['movie_id'] = movies['movie_id'].str.strip()
+
+        img = _read_csv(self.images_path)
+        if 'movie_id' in img.columns and 'image_url' in img.columns:
+            img['movie_id'] = img['movie_id'].str.strip()
+            img = img.drop_duplicates('movie_id', keep='first')
+            posters = img.set_index('movie_id')['image_url'].str.strip()
+            movies['image_url'] = movies['movie_id'].map(posters).fillna('')
+        else:
+            movies['image_url'] = ''
+
+        movies = movies.reset_index(drop=True)
+        records = movies.to_dict('records')
+        rows = {}
+        for row, record in enumerate(records):
+            rows.setdefault(record['movie_id'], row)
+
+        self._base_table = None
+        self._base_records = records
+        self._base_rows = rows
+
+    def _base_row(self, movie_id):
+        if self._base_table is not None:
+            return self._base_table.row_of(movie_id)
+        return self._base_rows.get(movie_id)
+
+    @property
+    def records(self):
+        """The live movies in catalog order: base rows (replaced ones in place), then new movies."""
+        records = self._records
+        if records is None:
+            records = self._records = self._overlay()
+        return records
+
+    def _overlay(self):
+        if not self._upserts and not self._deletes:
+            return self._base_records
+        dropped, replaced, appended = [], {}, []
+        for movie_id in self._deletes:
+            row = self._base_row(movie_id)
+            if row is not None:
+                dropped.append(row)
+        for movie_id, record in self._upserts.items():
+            row = self._base_row(movie_id)
+            if row is None:
+                appended.append(record)
+            else:
+                replaced[row] = record
+        kept = np.delete(np.arange(len(self._base_records)), dropped)
+        return OverlayRecords(self._base_records, kept, replaced, appended)
+
+    @property
+    def movies(self):
+        """The catalog as a DataFrame; built on first use."""
+        if self._movies is None:
+            import pandas as pd
+            self._movies = pd.DataFrame(list(self.records), columns=RECORD_COLUMNS)
+        return self._movies
+
+    def _record(self, movie_id):
+        if movie_id in self._upserts:
+            return self._upserts[movie_id]
+        if movie_id in self._deletes:
+            return None
+        row = self._base_row(movie_id)
+        return None if row is None else self._base_records[row]
+
+    def __len__(self):
+        return self.rows.live
+
+    def __contains__(self, movie_id):
+        return self._record(str(movie_id).strip()) is not None
+
+    def get(self, movie_id):
+        """Returns a copy of the record for movie_id, or None."""
+        record = self._record(str(movie_id).strip())
+        return dict(record) if record else None
+
+    def get_many(self, movie_ids):
+        """Returns {movie_id: record copy} for the ids that exist, in the order given."""
+        found = {}
+        for movie_id in movie_ids:
+            movie_id = str(movie_id).strip()
+            if movie_id not in found:
+                record = self._record(movie_id)
+                if record:
+                    found[movie_id] = dict(record)
+        return found
+
+
+_catalog = Catalog()
+
+
+def get_catalog():
+    """Returns this worker's catalog, reloading it first if the catalog files changed on disk."""
+    return _catalog.refresh()
+
+
+def refresh_index(index, build, stage):
+    """
+    Brings an index with epoch/version attributes and an apply(changes) method up to date:
+    rows added or deleted since it was built are applied in place, in time proportional to
+    the change, and only an index from an earlier epoch is rebuilt with build(snapshot),
+    timed as `stage`. Returns the index to use; callers serialize calls per index.
+    """
+    catalog = get_catalog()
+    if index is not None:
+        changes, version = catalog.changes_since(index.epoch, index.version)
+        if changes is not None:
+            if changes:
+                with metrics.timer('index_delta'):
+                    index.apply(changes)
+            index.version = version
+            return index
+    snapshot = catalog.snapshot()
+    with metrics.timer(stage):
+        index = build(snapshot)
+    index.epoch, index.version = snapshot.epoch, snapshot.version
+    return index
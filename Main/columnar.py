@@ -0,0 +1,179 @@
+import json
+import mmap
+import os
+import shutil
+import struct
+import tempfile
+from array import array
+import numpy as np
+
+
+# Layout: MAGIC, little-endian uint64 header length, space-padded JSON header, then 8-byte
+# aligned sections whose offsets in the header are relative to the end of the header.
+# A string column is an int64 offsets array (rows + 1 entries) followed by one UTF-8 blob.
+MAGIC = b'MOVCAT1\0'
+STRING_COLUMNS = ['movie_id', 'title', 'genres', 'overview', 'cast', 'director', 'year', 'image_url']
+
+
+def _year_number(year):
+    year = str(year).strip()
+    return int(year) if year.isdigit() else -1
+
+
+def write_columnar(records, path):
+    """
+    Writes records (dicts with STRING_COLUMNS) as a columnar file that ColumnarCatalog can
+    mmap. Besides the string columns it stores an int32 year_num column (-1 when unknown)
+    and an int32 id_order permutation that sorts rows by movie_id. `records` is read once,
+    as a stream: string data is spooled to temporary files next to `path`, so only the
+    per-row offsets and movie_ids are held in memory.
+    """
+    directory = os.path.dirname(os.path.abspath(path))
+    spools = {column: tempfile.TemporaryFile(dir=directory) for column in STRING_COLUMNS}
+    try:
+        offsets = {column: array('q', [0]) for column in STRING_COLUMNS}
+        years, movie_ids = array('i'), []
+        for r in records:
+            for column in STRING_COLUMNS:
+                data = str(r.get(column, '') or '').encode('utf-8')
+                spools[column].write(data)
+                offsets[column].append(offsets[column][-1] + len(data))
+            years.append(_year_number(r.get('year', '')))
+            movie_ids.append(str(r['movie_id']))
+        n = len(movie_ids)
+
+        # Section offsets are relative to the end of the header and 8-byte aligned
+        sections = []
+        header = {'rows': n, 'columns': {}}
+        position = 0
+
+        def add_section(length, write):
+            nonlocal position
+            start = position
+            pad = -length % 8
+            sections.append((write, pad))
+            position += length + pad
+            return start
+
+        def spool_writer(spool):
+            def write(f):
+                spool.seek(0)
+                shutil.copyfileobj(spool, f)
+            return write
+
+        for column in STRING_COLUMNS:
+            column_offsets = np.frombuffer(offsets[column], dtype=np.int64).astype('<i8').tobytes()
+            header['columns'][column] = {
+                'type': 'str',
+                'offsets': add_section(len(column_offsets), lambda f, data=column_offsets: f.write(data)),
+                'data': add_section(offsets[column][-1], spool_writer(spools[column])),
+            }
+
+        years = np.frombuffer(years, dtype=np.int32).astype('<i4').tobytes()
+        header['columns']['year_num'] = {'type': 'int32', 'offset': add_section(len(years), lambda f: f.write(years))}
+
+        id_order = np.array(sorted(range(n), key=movie_ids.__getitem__), dtype='<i4').tobytes()
+        header['id_order'] = add_section(len(id_order), lambda f: f.write(id_order))
+
+        header_bytes = json.dumps(header).encode('utf-8')
+        header_bytes += b' ' * (-(len(MAGIC) + 8 + len(header_bytes)) % 8)
+
+        tmp_path = path + '.tmp'
+        with open(tmp_path, 'wb') as f:
+            f.write(MAGIC)
+            f.write(struct.pack('<Q', len(header_bytes)))
+            f.write(header_bytes)
+            for write, pad in sections:
+                write(f)
+                f.write(b'\0' * pad)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp_path, path)
+        return n
+    finally:
+        for spool in spools.values():
+            spool.close()
+
+
+class StringColumn:
+    """One string column of a ColumnarCatalog; values are decoded on access."""
+
+    def __init__(self, buf, base, rows, spec):
+        self._buf = buf
+        self._data = base + spec['data']
+        self._offsets = np.frombuffer(buf, dtype='<i8', count=rows + 1, offset=base + spec['offsets'])
+
+    def __len__(self):
+        return len(self._offsets) - 1
+
+    def __getitem__(self, row):
+        start = self._data + int(self._offsets[row])
+        end = self._data + int(self._offsets[row + 1])
+        return self._buf[start:end].decode('utf-8')
+
+
+class ColumnarRecords:
+    """Read-only sequence of record dicts built on demand from the mapped columns."""
+
+    def __init__(self, columns, rows):
+        self._columns = columns
+        self._rows = rows
+
+    def __len__(self):
+        return self._rows
+
+    def __getitem__(self, row):
+        if row < 0:
+            row += self._rows
+        if not 0 <= row < self._rows:
+            raise IndexError(row)
+        return {name: column[row] for name, column in self._columns.items()}
+
+    def __iter__(self):
+        for row in range(self._rows):
+            yield self[row]
+
+
+class ColumnarCatalog:
+    """
+    Zero-copy view of a file written by write_columnar(). The file is mapped read-only, so
+    every worker (and a --preload master) shares the same page-cache pages.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        with open(path, 'rb') as f:
+            self._buf = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        if self._buf[:len(MAGIC)] != MAGIC:
+            raise ValueError(f"'{path}' is not a columnar movie catalog.")
+        (header_len,) = struct.unpack_from('<Q', self._buf, len(MAGIC))
+        start = len(MAGIC) + 8
+        header = json.loads(bytes(self._buf[start:start + header_len]))
+        self.rows = header['rows']
+        base = start + header_len
+
+        self.columns = {}
+        for name, spec in header['columns'].items():
+            if spec['type'] == 'str':
+                self.columns[name] = StringColumn(self._buf, base, self.rows, spec)
+        self.year_num = np.frombuffer(self._buf, dtype='<i4', count=self.rows,
+                                      offset=base + header['columns']['year_num']['offset'])
+        self.id_order = np.frombuffer(self._buf, dtype='<i4', count=self.rows, offset=base + header['id_order'])
+        self.records = ColumnarRecords(self.columns, self.rows)
+
+    def __len__(self):
+        return self.rows
+
+    def row_of(self, movie_id):
+        """Binary search of the id_order permutation; returns the first row with movie_id, or None."""
+        ids = self.columns['movie_id']
+        lo, hi = 0, self.rows
+        while lo < hi:
+            mid = (lo + hi) // 2
+            if ids[int(self.id_order[mid])] < movie_id:
+                lo = mid + 1
+            else:
+                hi = mid
+        if lo < self.rows and ids[int(self.id_order[lo])] == movie_id:
+            return int(self.id_order[lo])
+        return None
@@ -0,0 +1,51 @@
+import click
+from sqlalchemy import func
+from Main import app, db
+from Main.models import UserWatchlist
+from Main.store import store, CatalogChanged
+from Main.bulkimport import batch_format, read_batch, import_movies
+
+
+@app.cli.command('compact-catalog')
+def compact_catalog():
+    """Fold catalog.log into movies.csv / movie_images.csv."""
+    count = store.compact()
+    if count is None:
+        click.echo('Catalog log is empty, nothing to compact.')
+    else:
+        click.echo(f'Compacted catalog: {count} movies.')
+
+
+@app.cli.command('import-movies')
+@click.argument('path', type=click.Path(exists=True, dir_okay=False))
+@click.option('--dry-run', is_flag=True, help='Validate the batch without writing it.')
+def import_movies_command(path, dry_run):
+    """Add the movies in a CSV or JSON Lines file with one catalog write."""
+    with open(path, newline='', encoding='utf-8-sig') as f:
+        first_line = f.readline()
+        f.seek(0)
+        rows, errors = read_batch(f, batch_format(path, None, first_line))
+    try:
+        report = import_movies(rows, errors, dry_run=dry_run)
+    except CatalogChanged:
+        raise click.ClickException('The catalog kept changing during the import; run it again.')
+    for error in report['errors']:
+        click.echo(f"row {error['row']} ({error['movie_id'] or 'no id'}): {'; '.join(error['errors'])}", err=True)
+    action = 'Validated' if dry_run else 'Imported'
+    click.echo(f"{action} {report['imported']} of {report['rows']} movies; {len(report['errors'])} rejected.")
+
+
+@app.cli.command('create-tables')
+def create_tables():
+    """Create missing tables and the unique watchlist index, dropping duplicate entries first."""
+    db.create_all()
+    # MySQL cannot delete from a table it reads in a subquery, so the ids are collected first
+    keep = {row_id for (row_id,) in db.session.query(func.min(UserWatchlist.id))
+            .group_by(UserWatchlist.user_id, UserWatchlist.movie_id)}
+    duplicates = [row_id for (row_id,) in db.session.query(UserWatchlist.id) if row_id not in keep]
+    if duplicates:
+        UserWatchlist.query.filter(UserWatchlist.id.in_(duplicates)).delete(synchronize_session=False)
+        db.session.commit()
+    for index in UserWatchlist.__table__.indexes:
+        index.create(db.engine, checkfirst=True)
+    click.echo(f'Tables ready; removed {len(duplicates)} duplicate watchlist entries.')
@@ -3,7 +3,7 @@ from wtforms import StringField, PasswordField, SubmitField, BooleanField, Integ
 from wtforms.validators import DataRequired, Length, Email, EqualTo, ValidationError, URL
 from flask_wtf.file import FileField, FileAllowed
 from Main.models import User
-import pandas as pd
+from Main.catalog import get_catalog
 
 class RegistrationForm(FlaskForm):
     username = StringField('Username',
@@ -57,7 +57,8 @@ class UpdateAccount(FlaskForm):
                 raise ValidationError('That email is taken. Please choose a different one.')
 
 class MovieForm(FlaskForm):
-    moviename = StringField('Movie Name', validators=[DataRequired()])
+    moviename = StringField('Movie Name', validators=[DataRequired()],
+                            render_kw={'autocomplete': 'off', 'list': 'movie-suggestions'})
     submit = SubmitField('Get Recommendations')
 
 class UploadMovie(FlaskForm):
@@ -72,22 +73,16 @@ class UploadMovie(FlaskForm):
     submit = SubmitField('Upload Movie')
 
     def validate_movie_id(self, movie_id):
-        df = pd.read_csv('movies.csv', on_bad_lines='skip', low_memory=False) if pd.io.common.file_exists('movies.csv') else None
-        if df is not None:
-            existing_ids = df['movie_id'].astype(str).str.strip().tolist()
-            if movie_id.data.strip() in existing_ids:
-                raise ValidationError('Movie ID already exists. Please enter a unique ID.')
+        if movie_id.data.strip() in get_catalog():
+            raise ValidationError('Movie ID already exists. Please enter a unique ID.')
 
 class DeleteMovie(FlaskForm):
     movie_id = StringField('Movie ID', validators=[DataRequired()])
     submit = SubmitField('Delete Movie')
 
     def validate_movie_id(self, movie_id):
-        df = pd.read_csv('movies.csv', on_bad_lines='skip', low_memory=False) if pd.io.common.file_exists('movies.csv') else None
-        if df is not None:
-            existing_ids = df['movie_id'].astype(str).str.strip().tolist()
-            if movie_id.data.strip() not in existing_ids:
-                raise ValidationError('Movie ID not found.')
+        if movie_id.data.strip() not in get_catalog():
+            raise ValidationError('Movie ID not found.')
 
 class Contact(FlaskForm):
     subject = StringField('Subject', validators=[DataRequired(), Length(max=100)])
@@ -0,0 +1,83 @@
+import hashlib
+import json
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from Main import app, db
+from Main.models import UserWatchlist, UserRecommendation
+from Main.recomm import profile_recommendations
+
+
+FOR_YOU_K = 10
+
+
+def watchlist_key(movie_ids):
+    """Fingerprint of a watchlist; stored picks are current while it matches."""
+    return hashlib.sha1(','.join(sorted(movie_ids)).encode('utf-8')).hexdigest()
+
+
+def refresh_for_you(user_id, k=FOR_YOU_K):
+    """Scores the catalog against user_id's watchlist and stores the top k as UserRecommendation."""
+    movie_ids = [movie_id for (movie_id,) in
+                 db.session.query(UserWatchlist.movie_id).filter_by(user_id=user_id)]
+    picks = profile_recommendations(movie_ids, k)
+
+    row = UserRecommendation.query.filter_by(user_id=user_id).first()
+    if row is None:
+        row = UserRecommendation(user_id=user_id)
+        db.session.add(row)
+    row.watchlist_key = watchlist_key(movie_ids)
+    row.movie_ids = json.dumps([movie['movie_id'] for movie in picks])
+    db.session.commit()
+    return picks
+
+
+class ForYouWorker:
+    """
+    Recomputes "for you" picks on a background thread after a watchlist change, so the
+    account page only reads stored ids. Changes queued for the same user collapse into one
+    run, which reads the watchlist as it is when the run starts. The thread is started on
+    first use, i.e. in the gunicorn worker rather than the --preload master.
+    """
+
+    def __init__(self, k=FOR_YOU_K):
+        self.k = k
+        self._executor = None
+        self._pending = set()
+        self._lock = threading.Lock()
+
+    def schedule(self, user_id):
+        with self._lock:
+            if user_id in self._pending:
+                return
+            self._pending.add(user_id)
+            if self._executor is None:
+                self._executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix='for-you')
+        self._executor.submit(self._run, user_id)
+
+    def _run(self, user_id):
+        with self._lock:
+            self._pending.discard(user_id)
+        with app.app_context():
+            try:
+                refresh_for_you(user_id, self.k)
+            except Exception:
+                db.session.rollback()
+                app.logger.exception("Could not refresh recommendations for user %s", user_id)
+
+
+worker = ForYouWorker()
+
+
+def for_you_ids(user_id, watchlist_ids):
+    """
+    Stored picks for user_id, best first, minus anything now on the watchlist. When they were
+    computed for a different watchlist a refresh is scheduled and the old picks are served.
+    """
+    row = UserRecommendation.query.filter_by(user_id=user_id).first()
+    if row is None or row.watchlist_key != watchlist_key(watchlist_ids):
+        if row is not None or watchlist_ids:
+            worker.schedule(user_id)
+    if row is None:
+        return []
+    on_watchlist = set(watchlist_ids)
+    return [movie_id for movie_id in json.loads(row.movie_ids or '[]') if movie_id not in on_watchlist]
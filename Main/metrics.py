@@ -0,0 +1,274 @@
+import bisect
+import cProfile
+import io
+import mmap
+import os
+import pstats
+import random
+import struct
+import threading
+import time
+from collections import defaultdict
+from contextlib import contextmanager
+
+try:
+    import resource
+except ImportError:  # Windows: no getrusage, memory gauges report 0
+    resource = None
+
+
+# Histogram bucket upper bounds in seconds (Prometheus "le" labels)
+LATENCY_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+# Fraction of requests run under cProfile; 0 disables profiling. Changeable at runtime via set_profile_rate()
+PROFILE_RATE = float(os.environ.get('METRICS_PROFILE_RATE', 0))
+# Where a rate set at runtime is shared with the other workers; reset_profile_rate() puts
+# METRICS_PROFILE_RATE back in it when the server starts
+PROFILE_RATE_PATH = os.environ.get(
+    'METRICS_PROFILE_RATE_PATH',
+    os.path.join(os.environ.get('MOVIE_DATA_DIR', os.path.dirname(os.path.abspath(__file__))), 'profile.rate'))
+
+
+class Histogram:
+    """Cumulative-bucket latency histogram in the Prometheus layout."""
+
+    def __init__(self, buckets=LATENCY_BUCKETS):
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)
+        self.count = 0
+        self.sum = 0.0
+
+    def observe(self, seconds):
+        self.counts[bisect.bisect_left(self.buckets, seconds)] += 1
+        self.count += 1
+        self.sum += seconds
+
+    def add(self, other):
+        for i, count in enumerate(other.counts):
+            self.counts[i] += count
+        self.count += other.count
+        self.sum += other.sum
+
+    def cumulative(self):
+        total = 0
+        for bound, count in zip(self.buckets + ('+Inf',), self.counts):
+            total += count
+            yield bound, total
+
+
+class SharedRate:
+    """
+    A float shared by every worker: a little-endian double in `path`, mapped once like the
+    catalog generation, so reading it is a memory read. `default` applies until it is first
+    written; without a path the value stays in this process.
+    """
+
+    def __init__(self, path, default):
+        self.path = path
+        self.default = default
+        self._map = None
+
+    def read(self):
+        if self.path is None:
+            return self.default
+        if self._map is None:
+            try:
+                with open(self.path, 'rb') as f:
+                    self._map = mmap.mmap(f.fileno(), 8, access=mmap.ACCESS_READ)
+            except (OSError, ValueError):  # not written yet (ValueError: still empty)
+                return self.default
+        return struct.unpack_from('<d', self._map)[0]
+
+    def write(self, value):
+        if self.path is None:
+            self.default = value
+            return
+        fd = os.open(self.path, os.O_RDWR | os.O_CREAT, 0o644)
+        with os.fdopen(fd, 'r+b') as f:
+            f.write(struct.pack('<d', value))
+
+
+class Metrics:
+    """
+    Per-worker stage latencies, request counts/latencies and sampled profiles. Each gunicorn
+    worker keeps its own copy, including the stages its scoring pool processes ran; /metrics
+    reports the worker that served it, labelled with its pid. The profiling rate is the one
+    setting shared by all workers (see SharedRate).
+    """
+
+    def __init__(self, profile_rate=PROFILE_RATE, profile_rate_path=PROFILE_RATE_PATH):
+        self._lock = threading.Lock()
+        self.stages = defaultdict(Histogram)
+        self.requests = defaultdict(int)
+        self.request_latency = defaultdict(Histogram)
+        self.events = defaultdict(int)
+        self._profile_rate = SharedRate(profile_rate_path, profile_rate)
+        self.profiled_requests = 0
+        self._profile_stats = None
+        self.caches = {}
+
+    def register_cache(self, name, cache):
+        """Reports cache.stats() (see Main/cache.py) in render(), labelled cache=name."""
+        self.caches[name] = cache
+
+    def observe(self, stage, seconds):
+        with self._lock:
+            self.stages[stage].observe(seconds)
+
+    @contextmanager
+    def timer(self, stage):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(stage, time.perf_counter() - start)
+
+    def count(self, event):
+        with self._lock:
+            self.events[event] += 1
+
+    def take(self):
+        """Returns and clears the stage histograms and event counts, to be merge()d in another process."""
+        with self._lock:
+            stages, events = dict(self.stages), dict(self.events)
+            self.stages.clear()
+            self.events.clear()
+        return stages, events
+
+    def merge(self, stages, events):
+        """Adds stage histograms and event counts recorded elsewhere (e.g. in a scoring pool process)."""
+        with self._lock:
+            for stage, histogram in stages.items():
+                self.stages[stage].add(histogram)
+            for event, count in events.items():
+                self.events[event] += count
+
+    def observe_request(self, endpoint, method, status, seconds):
+        with self._lock:
+            self.requests[(endpoint, method, status)] += 1
+            self.request_latency[endpoint].observe(seconds)
+
+    @property
+    def profile_rate(self):
+        return self._profile_rate.read()
+
+    @profile_rate.setter
+    def profile_rate(self, rate):
+        self._profile_rate.write(rate)
+
+    def should_profile(self):
+        rate = self.profile_rate
+        return rate > 0 and random.random() < rate
+
+    def add_profile(self, profiler):
+        with self._lock:
+            if self._profile_stats is None:
+                self._profile_stats = pstats.Stats(profiler)
+            else:
+                self._profile_stats.add(profiler)
+            self.profiled_requests += 1
+
+    def profile_report(self, limit=40, sort='cumulative'):
+        """Text report of the functions taking the most time across all sampled requests."""
+        with self._lock:
+            if self._profile_stats is None:
+                return 'No requests profiled yet.\n'
+            out = io.StringIO()
+            self._profile_stats.stream = out
+            self._profile_stats.sort_stats(sort).print_stats(limit)
+        return f'{self.profiled_requests} profiled requests\n' + out.getvalue()
+
+    def reset_profile(self):
+        with self._lock:
+            self._profile_stats = None
+            self.profiled_requests = 0
+
+    def render(self):
+        """All metrics in the Prometheus text exposition format."""
+        pid = os.getpid()
+        lines = []
+
+        def histogram(name, label, histograms):
+            lines.append(f'# TYPE {name} histogram')
+            for value, h in sorted(histograms.items()):
+                for bound, total in h.cumulative():
+                    lines.append(f'{name}_bucket{{{label}="{value}",le="{bound}",pid="{pid}"}} {total}')
+                lines.append(f'{name}_sum{{{label}="{value}",pid="{pid}"}} {h.sum:.6f}')
+                lines.append(f'{name}_count{{{label}="{value}",pid="{pid}"}} {h.count}')
+
+        with self._lock:
+            histogram('movie_stage_seconds', 'stage', self.stages)
+            histogram('movie_request_seconds', 'endpoint', self.request_latency)
+            lines.append('# TYPE movie_requests_total counter')
+            for (endpoint, method, status), count in sorted(self.requests.items()):
+                lines.append(f'movie_requests_total{{endpoint="{endpoint}",method="{method}",'
+                             f'status="{status}",pid="{pid}"}} {count}')
+            lines.append('# TYPE movie_events_total counter')
+            for event, count in sorted(self.events.items()):
+                lines.append(f'movie_events_total{{event="{event}",pid="{pid}"}} {count}')
+            lines.append('# TYPE movie_profiled_requests_total counter')
+            lines.append(f'movie_profiled_requests_total{{pid="{pid}"}} {self.profiled_requests}')
+
+        cache_stats = {name: cache.stats() for name, cache in sorted(self.caches.items())}
+        for name, kind, key in (('movie_cache_entries', 'gauge', 'size'),
+                                ('movie_cache_max_entries', 'gauge', 'maxsize'),
+                                ('movie_cache_hits_total', 'counter', 'hits'),
+                                ('movie_cache_misses_total', 'counter', 'misses'),
+                                ('movie_cache_evictions_total', 'counter', 'evictions'),
+                                ('movie_cache_expirations_total', 'counter', 'expirations')):
+            lines.append(f'# TYPE {name} {kind}')
+            for cache, stats in cache_stats.items():
+                lines.append(f'{name}{{cache="{cache}",pid="{pid}"}} {stats[key]}')
+
+        lines.append('# TYPE movie_profile_rate gauge')
+        lines.append(f'movie_profile_rate{{pid="{pid}"}} {self.profile_rate}')
+        lines.append('# TYPE movie_process_resident_bytes gauge')
+        lines.append(f'movie_process_resident_bytes{{pid="{pid}"}} {resident_bytes()}')
+        lines.append('# TYPE movie_process_peak_resident_bytes gauge')
+        lines.append(f'movie_process_peak_resident_bytes{{pid="{pid}"}} {peak_resident_bytes()}')
+        return '\n'.join(lines) + '\n'
+
+
+def resident_bytes():
+    """Current RSS of this process, or 0 where /proc is not available."""
+    try:
+        with open('/proc/self/statm') as f:
+            return int(f.read().split()[1]) * os.sysconf('SC_PAGE_SIZE')
+    except (OSError, ValueError, IndexError, AttributeError):
+        return 0
+
+
+def peak_resident_bytes():
+    if resource is None:
+        return 0
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024
+
+
+metrics = Metrics()
+
+
+def profile_request():
+    """Returns a started profiler for a sampled request, or None (the common, near-free case)."""
+    if not metrics.should_profile():
+        return None
+    profiler = cProfile.Profile()
+    try:
+        profiler.enable()
+    except ValueError:  # another profiler is already active on this thread
+        return None
+    return profiler
+
+
+def finish_profile(profiler):
+    profiler.disable()
+    metrics.add_profile(profiler)
+
+
+def set_profile_rate(rate):
+    """Sets the fraction of requests profiled, in every worker; returns the clamped rate."""
+    metrics.profile_rate = min(max(float(rate), 0.0), 1.0)
+    return metrics.profile_rate
+
+
+def reset_profile_rate():
+    """Restores METRICS_PROFILE_RATE for every worker, dropping a rate set at runtime before a restart."""
+    metrics.profile_rate = PROFILE_RATE
@@ -1,10 +1,13 @@
 from Main import db, login_manager
 from flask_login import UserMixin
 from datetime import datetime
+from sqlalchemy import func, insert, select, literal
 
 @login_manager.user_loader
 def load_user(user_id):
-    return User.query.get(int(user_id))
+    # Flask-Login calls this once per request and keeps current_user; session.get also skips
+    # the query while the user is still in the session's identity map
+    return db.session.get(User, int(user_id))
 
 class User(db.Model, UserMixin):
     id = db.Column(db.Integer, primary_key=True)
@@ -17,6 +20,9 @@ class User(db.Model, UserMixin):
         return f"User('{self.username}', '{self.email}', '{self.image_file}')"
 
 class UserWatchlist(db.Model):
+    # Serves the per-user lookups (user_id is the leading column) and rejects duplicate entries
+    __table_args__ = (db.Index('ix_watchlist_user_movie', 'user_id', 'movie_id', unique=True),)
+
     id = db.Column(db.Integer, primary_key=True)
     user_id = db.Column(db.Integer, db.ForeignKey('user.id'), nullable=False)
     movie_id = db.Column(db.String(50), nullable=False)
@@ -24,3 +30,37 @@ class UserWatchlist(db.Model):
 
     def __repr__(self):
         return f"<UserWatchlist user:{self.user_id} movie:{self.movie_id}>"
+
+    @classmethod
+    def add_if_room(cls, user_id, movie_id, limit):
+        """
+        Inserts (user_id, movie_id) only while the user has fewer than `limit` entries.
+        Returns True if a row was added; a duplicate raises IntegrityError from the unique index.
+
+        The user's row is locked by a SELECT ... FOR UPDATE of its own first, so concurrent
+        adds for one user queue there, and the INSERT ... SELECT that follows counts with a
+        snapshot taken after the previous one committed. (A COUNT inside the locking statement
+        is evaluated before the lock under READ COMMITTED.) SQLite has no row locks and skips
+        FOR UPDATE, but it runs the INSERT ... SELECT, count included, under its write lock.
+        """
+        db.session.execute(select(User.id).where(User.id == user_id).with_for_update())
+        count = select(func.count()).select_from(cls).where(cls.user_id == user_id).scalar_subquery()
+        source = (
+            select(literal(user_id), literal(movie_id), literal(datetime.now()))
+            .select_from(User)
+            .where(User.id == user_id, count < limit)
+        )
+        result = db.session.execute(
+            insert(cls).from_select(['user_id', 'movie_id', 'added_on'], source)
+        )
+        return result.rowcount == 1
+
+class UserRecommendation(db.Model):
+    # "For you" picks computed in the background from the user's watchlist (see Main/foryou.py)
+    user_id = db.Column(db.Integer, db.ForeignKey('user.id'), primary_key=True)
+    watchlist_key = db.Column(db.String(40), nullable=False)
+    movie_ids = db.Column(db.Text, nullable=False, default='')
+    updated_on = db.Column(db.DateTime, default=datetime.now, onupdate=datetime.now)
+
+    def __repr__(self):
+        return f"<UserRecommendation user:{self.user_id} key:{self.watchlist_key}>"
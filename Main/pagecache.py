@@ -0,0 +1,72 @@
+import hashlib
+import os
+from datetime import datetime, timezone
+from flask import request, session, g, make_response
+from flask_login import current_user
+from markupsafe import Markup
+from werkzeug.http import is_resource_modified
+from Main.cache import LRUCache
+from Main.catalog import get_catalog
+from Main.metrics import metrics
+
+
+FRAGMENT_CACHE_SIZE = int(os.environ.get('FRAGMENT_CACHE_SIZE', 2048))
+
+# Rendered, user-independent page bodies keyed by (catalog fingerprint, ...). Entries for an
+# older catalog are never looked up again and age out of the LRU.
+fragment_cache = LRUCache(FRAGMENT_CACHE_SIZE)
+metrics.register_cache('fragment', fragment_cache)
+
+
+def cached_fragment(key, render):
+    """Returns the rendered HTML for key, calling render() only on a miss."""
+    key = (get_catalog().fingerprint,) + tuple(key)
+    html = fragment_cache.get(key)
+    if html is None:
+        metrics.count('fragment_miss')
+        html = Markup(render())
+        fragment_cache.set(key, html)
+    else:
+        metrics.count('fragment_hit')
+    return html
+
+
+def skip_validation():
+    """Marks the page being rendered as one-off (e.g. degraded results): no ETag, no 304 later."""
+    g.skip_validation = True
+
+
+def conditional_page(key, render_page, last_modified=None):
+    """
+    Sends render_page() with a weak ETag built from the catalog fingerprint, key and the
+    viewer (the navigation differs per user), or an empty 304 if the client already has it.
+    Pages with flashed messages are always rendered, since the messages are shown only once.
+    """
+    if session.get('_flashes'):
+        return make_response(render_page())
+
+    catalog = get_catalog()
+    viewer = current_user.get_id() if current_user.is_authenticated else None
+    etag = hashlib.sha1(repr((catalog.fingerprint, tuple(key), viewer)).encode('utf-8')).hexdigest()
+    last_modified = max(filter(None, (last_modified, catalog.last_modified)), default=None)
+
+    if not is_resource_modified(request.environ, etag=etag, last_modified=last_modified):
+        metrics.count('not_modified')
+        response = make_response('', 304)
+    else:
+        response = make_response(render_page())
+        if g.pop('skip_validation', False):
+            return response
+    response.set_etag(etag, weak=True)
+    if last_modified is not None:
+        response.last_modified = last_modified
+    # Browsers keep the page but must revalidate, which is cheap when the answer is 304
+    response.cache_control.private = True
+    response.cache_control.no_cache = True
+    return response
+
+
+def time_bucket(seconds):
+    """Start of the current `seconds`-long window, for pages that rotate on a timer."""
+    now = datetime.now(timezone.utc).timestamp()
+    return datetime.fromtimestamp(now - now % seconds, timezone.utc)
@@ -0,0 +1,65 @@
+import os
+from flask import current_app
+from itsdangerous import BadSignature, URLSafeSerializer
+
+
+# How deep search results and recommendations can be paged. A ranking is selected to this
+# depth once (partially, never fully sorted) and cached, so later pages are slices of it.
+RESULTS_DEPTH = int(os.environ.get('RESULTS_DEPTH', 100))
+MAX_PAGE_SIZE = 100
+
+
+def _serializer():
+    return URLSafeSerializer(current_app.config['SECRET_KEY'], salt='results-cursor')
+
+
+def encode_cursor(kind, query, offset, page_size):
+    """Opaque, signed token for the page of `kind` results for query that starts at offset."""
+    return _serializer().dumps([kind, query, offset, page_size])
+
+
+def decode_cursor(cursor, kind):
+    """Returns (query, offset, page_size) from a cursor made by encode_cursor, or raises ValueError."""
+    try:
+        cursor_kind, query, offset, page_size = _serializer().loads(cursor)
+    except (BadSignature, TypeError, ValueError):
+        raise ValueError('Invalid cursor.')
+    if cursor_kind != kind:
+        raise ValueError('Invalid cursor.')
+    return query, offset, page_size
+
+
+def page_request(args, kind, query, default_size):
+    """
+    (query, offset, page_size) for a request: taken from its `cursor` when there is one,
+    otherwise from `page` (1-based) and `page_size`. Raises ValueError with a message
+    that can be shown to the client.
+    """
+    if args.get('cursor'):
+        return decode_cursor(args['cursor'], kind)
+    try:
+        page = int(args.get('page', 1))
+        page_size = int(args.get('page_size', default_size))
+    except (TypeError, ValueError):
+        raise ValueError('page and page_size must be integers.')
+    if page < 1 or not 1 <= page_size <= MAX_PAGE_SIZE:
+        raise ValueError(f'page must be at least 1 and page_size between 1 and {MAX_PAGE_SIZE}.')
+    offset = (page - 1) * page_size
+    if offset >= RESULTS_DEPTH:
+        raise ValueError(f'Only the first {RESULTS_DEPTH} results can be paged through.')
+    return query, offset, page_size
+
+
+def paginate(kind, query, results, offset, page_size, has_more):
+    """
+    One page of results as {'results', 'page', 'page_size', 'next_cursor'}; next_cursor is
+    None on the last page, including the one that reaches RESULTS_DEPTH.
+    """
+    end = offset + page_size
+    more = has_more and end < RESULTS_DEPTH
+    return {
+        'results': results,
+        'page': offset // page_size + 1,
+        'page_size': page_size,
+        'next_cursor': encode_cursor(kind, query, end, page_size) if more else None,
+    }
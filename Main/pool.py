@@ -0,0 +1,173 @@
+import multiprocessing
+import os
+import threading
+from contextlib import contextmanager
+from concurrent.futures import ProcessPoolExecutor, TimeoutError as FutureTimeout
+from concurrent.futures.process import BrokenProcessPool
+from Main.metrics import metrics
+
+
+# Scoring processes per web worker (0 scores inline in the request), how many tasks may be
+# running or queued before new ones are turned away, and how long a request waits for one.
+SCORING_POOL_WORKERS = int(os.environ.get('SCORING_POOL_WORKERS', 2))
+SCORING_POOL_QUEUE = int(os.environ.get('SCORING_POOL_QUEUE', 2 * max(SCORING_POOL_WORKERS, 1)))
+SCORING_TIMEOUT = float(os.environ.get('SCORING_TIMEOUT', 5))
+
+BUSY_MESSAGE = "We're handling a lot of requests right now. Please try again in a moment."
+
+
+class ScoringBusy(Exception):
+    """The pool was full, broken or too slow; the message is safe to show to users."""
+
+    def __init__(self, message=BUSY_MESSAGE):
+        super().__init__(message)
+
+
+class ScoringPool:
+    """
+    Bounded process pool for CPU-bound recommendation and search scoring, so a heavy query
+    neither holds the GIL of the web worker nor queues up behind others: when max_pending
+    tasks are already running or waiting, run() fails fast with ScoringBusy, and it gives up
+    waiting after `timeout` seconds. Tasks must be module-level functions with picklable
+    arguments and results; each pool process keeps its own catalog and indexes.
+
+    The processes are started by start() in the gunicorn worker (not the --preload master)
+    once it is warmed up, by fork where available, so they begin with the worker's catalog
+    and indexes shared copy-on-write instead of building their own. Until every process has
+    answered, run() scores inline; inside a pool process (and with workers=0) it always does.
+    Stage timings recorded in a pool process come back with each result (see Metrics.take).
+    """
+
+    def __init__(self, workers=SCORING_POOL_WORKERS, max_pending=SCORING_POOL_QUEUE, timeout=SCORING_TIMEOUT):
+        self.workers = workers
+        self.max_pending = max_pending
+        self.timeout = timeout
+        self.pending = 0
+        self.ready = False
+        self._executor = None
+        self._inline_calls = False
+        # Reentrant: a done callback may run right away, inside _get_executor
+        self._lock = threading.RLock()
+
+    @property
+    def inline(self):
+        return self.workers <= 0 or self._inline_calls or multiprocessing.parent_process() is not None
+
+    @contextmanager
+    def inline_calls(self):
+        """Runs tasks in the calling process for the duration, e.g. while warming up at startup."""
+        self._inline_calls = True
+        try:
+            yield
+        finally:
+            self._inline_calls = False
+
+    def _get_executor(self):
+        if self._executor is None:
+            methods = multiprocessing.get_all_start_methods()
+            # fork starts every process at once, from this (warmed) process; the fork server
+            # is the fallback where fork is missing, and its processes warm up on their own
+            method = 'fork' if 'fork' in methods else 'forkserver' if 'forkserver' in methods else 'spawn'
+            executor = ProcessPoolExecutor(self.workers, mp_context=multiprocessing.get_context(method),
+                                           initializer=_warm_process)
+            self._executor = executor
+            self.ready = False
+            started = [executor.submit(os.getpid) for _ in range(self.workers)]
+            remaining = [len(started)]
+
+            def answered(future):
+                with self._lock:
+                    remaining[0] -= 1
+                    if (remaining[0] == 0 and self._executor is executor
+                            and not future.cancelled() and future.exception() is None):
+                        self.ready = True
+                        metrics.count('scoring_pool_ready')
+
+            for future in started:
+                future.add_done_callback(answered)
+        return self._executor
+
+    def start(self):
+        """Starts the pool processes now instead of on the first task, e.g. right after a fork."""
+        if self.inline:
+            return
+        with self._lock:
+            self._get_executor()
+
+    def _task_done(self, future):
+        with self._lock:
+            self.pending -= 1
+
+    def _broken(self, executor):
+        with self._lock:
+            if self._executor is executor:
+                self._executor = None
+                self.ready = False
+        metrics.count('scoring_pool_broken')
+        return ScoringBusy()
+
+    def run(self, fn, *args, timeout=None):
+        """Returns fn(*args) computed in a pool process; exceptions raised by fn propagate."""
+        if self.inline:
+            return fn(*args)
+
+        with self._lock:
+            executor = self._get_executor()
+            if not self.ready:
+                # Still starting: the web worker's own (warm) indexes answer meanwhile
+                executor = None
+            elif self.pending >= self.max_pending:
+                metrics.count('scoring_rejected')
+                raise ScoringBusy()
+            else:
+                self.pending += 1
+        if executor is None:
+            metrics.count('scoring_inline')
+            return fn(*args)
+        try:
+            future = executor.submit(_call, fn, args)
+        except (BrokenProcessPool, RuntimeError):
+            self._task_done(None)
+            raise self._broken(executor)
+        future.add_done_callback(self._task_done)
+
+        with metrics.timer('pool_task'):
+            try:
+                result, (stages, events) = future.result(timeout=timeout or self.timeout)
+                metrics.merge(stages, events)
+                return result
+            except FutureTimeout:
+                # A task that already started keeps its slot until it finishes
+                future.cancel()
+                metrics.count('scoring_timeout')
+                raise ScoringBusy()
+            except BrokenProcessPool:
+                raise self._broken(executor)
+
+    def shutdown(self):
+        with self._lock:
+            executor, self._executor = self._executor, None
+        if executor is not None:
+            executor.shutdown(wait=False, cancel_futures=True)
+
+
+def _call(fn, args):
+    # Runs in a pool process; the stage timings go back to the web worker that serves /metrics
+    result = fn(*args)
+    return result, metrics.take()
+
+
+def _warm_process():
+    from Main.warmup import warm_indexes, SCORING_STEPS, WARM_INDEXES
+    # A forked process starts with the web worker's metrics, which that worker already reports
+    metrics.take()
+    if not WARM_INDEXES:
+        return
+    try:
+        warm_indexes(SCORING_STEPS)
+    except Exception:
+        # A failing initializer would break the pool; the first task reports the error instead
+        pass
+
+
+scoring_pool = ScoringPool()
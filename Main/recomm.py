@@ -1,14 +1,52 @@
-import pandas as pd
-import numpy as np
+import atexit
+import heapq
+import itertools
+import json
 import os
+import random
+import threading
+from collections import Counter, defaultdict
+import numpy as np
+from Main.cache import LRUCache
+from Main.catalog import get_catalog, catalog_lock, refresh_index, DATA_DIR
+from Main.metrics import metrics
+from Main.paging import RESULTS_DEPTH
+from Main.pool import scoring_pool, ScoringBusy
+from Main.search import get_title_index, normalize_title
+from Main.tokens import Vocabulary, TokenSets, GrowableArray, GrowingTokenSets, Postings, intersection_size
 
 
-BASE_DIR = os.path.dirname(os.path.abspath(__file__))
-MOVIES_CSV = os.path.join(BASE_DIR, 'movies.csv')
-IMAGES_CSV = os.path.join(BASE_DIR, 'movie_images.csv')
+DEFAULT_IMAGE_URL = '/static/defaultposter.jpg'
 
+# MinHash/LSH settings for recom(..., approximate=True); num_perm must be a multiple of bands
+LSH_NUM_PERM = int(os.environ.get('RECOMM_LSH_NUM_PERM', 128))
+LSH_BANDS = int(os.environ.get('RECOMM_LSH_BANDS', 64))
+_LSH_PRIME = (1 << 31) - 1
 
-DEFAULT_IMAGE_URL = '/static/defaultposter.jpg'
+# Offline top-K table written by build_neighbour_table() (see cleaning.py). K is larger than
+# the 10 results served so that a few deleted neighbours can be skipped without a rescore.
+NEIGHBOURS_PATH = os.path.join(DATA_DIR, 'neighbours')
+NEIGHBOURS_K = 20
+# Upper bound on the dense (seeds x catalog) score block of a batch scoring call, so batches
+# shrink as the catalog grows (about 220 MB of temporaries at this size)
+NEIGHBOURS_BATCH_CELLS = 1 << 24
+
+# Rankings keyed by (normalized title, mode, catalog version), as (depth scored, movies); every
+# page within that depth is a slice. Every worker checks the catalog generation before
+# serving, so an upload or delete anywhere bumps the version everywhere.
+RECOMM_CACHE_SIZE = int(os.environ.get('RECOMM_CACHE_SIZE', 512))
+RECOMM_CACHE_TTL = float(os.environ.get('RECOMM_CACHE_TTL', 3600))
+# The card deck drops deleted rows from its buckets once they are this share of all rows
+CARD_DECK_COMPACT_FRACTION = 0.25
+# Request counts per title, merged across workers on exit and used to warm the cache
+POPULAR_TITLES_PATH = os.path.join(DATA_DIR, 'popular_titles.json')
+
+recommendation_cache = LRUCache(RECOMM_CACHE_SIZE, RECOMM_CACHE_TTL)
+metrics.register_cache('recommendation', recommendation_cache)
+_cache_version = None
+# Serializes building and updating this module's indexes; readers never take it
+_index_lock = threading.RLock()
+_title_requests = Counter()
 
 
 def get_trailer_search_url(title, year):
@@ -16,127 +54,780 @@ def get_trailer_search_url(title, year):
     return f"https://www.youtube.com/results?search_query={query}"
 
 
-def recom(movie_title_input):
+def get_word_set(row):
+    title_words = row['title'].lower().split()
+    genres_words = [g.strip() for g in row['genres'].lower().split(',')] if row['genres'] else []
+    overview_words = row['overview'].lower().split()
+    cast_words = [c.strip() for c in row['cast'].lower().split(',')] if row['cast'] else []
+    director_words = row['director'].lower().split()
+    word_list = title_words * 4 + overview_words * 3 + genres_words * 2 + cast_words + director_words
+    return set(word_list)
+
+
+def jaccard_similarity(set1, set2):
+    intersection = set1.intersection(set2)
+    union = set1.union(set2)
+    return len(intersection) / len(union) if union else 0
+
+
+class JaccardIndex:
     """
-    Given a movie title, returns a list of top 10 recommended movies based on Jaccard similarity
-    of combined weighted word sets from title, genres, overview, cast, and director.
+    The catalog's word sets interned to int32 ids (see Main/tokens.py), plus the inverted
+    token -> rows postings. |A∩B| for every movie comes from one bincount over the query's
+    posting lists and the Jaccard score from the stored set sizes, so it equals
+    jaccard_similarity() on the original string sets.
+
+    apply() adds uploaded movies as new rows and masks deleted ones without a rebuild.
+    Readers use the first `n` rows, and n is raised only once a row is complete.
     """
-    movies = pd.read_csv(MOVIES_CSV, on_bad_lines='skip', low_memory=False)
-    img = pd.read_csv(IMAGES_CSV, on_bad_lines='skip', low_memory=False)
 
-    # Ensure movie_id is string and trimmed
-    movies['movie_id'] = movies['movie_id'].astype(str).str.strip()
-    img['movie_id'] = img['movie_id'].astype(str).str.strip()
+    def __init__(self, records, version=None, alive=None):
+        self.version = version
+        self.epoch = None
+        self.records = records
+        alive = np.ones(len(records), dtype=bool) if alive is None else alive
+        n = len(alive)
+        self.alive = GrowableArray(alive)
+        self.movie_ids = [records[row]['movie_id'] for row in range(n)]
+        self.row_by_id = {}
+        same_id = defaultdict(list)
+        for row in np.flatnonzero(alive).tolist():
+            movie_id = self.movie_ids[row]
+            self.row_by_id.setdefault(movie_id, row)
+            same_id[movie_id].append(row)
+        # Only ids that occur on several rows; a movie is never recommended for itself
+        self.same_id = {movie_id: rows for movie_id, rows in same_id.items() if len(rows) > 1}
+
+        # Dead rows are tokenized too, so token ids match an index that saw them arrive
+        self.vocabulary = Vocabulary()
+        with metrics.timer('tokenize'):
+            token_sets = TokenSets.build((get_word_set(records[row]) for row in range(n)), self.vocabulary)
+        self.token_sets = GrowingTokenSets(token_sets)
+        self.sizes = self.token_sets.sizes
+        self.postings = Postings(token_sets.invert(len(self.vocabulary)))
+        self.n = n
+
+    def __len__(self):
+        return self.n
+
+    def scores(self, row):
+        """Jaccard score of every movie against `row`; dead rows and rows with the same movie_id score -1."""
+        n = self.n
+        sizes = self.sizes.view()[:n]
+        inter = self.postings.count_hits(self.token_sets[row], n).astype(np.float64)
+        union = sizes[row] + sizes - inter
+        scores = np.divide(inter, union, out=np.zeros_like(inter), where=union > 0)
+        scores[self.same_id.get(self.movie_ids[row], row)] = -1
+        scores[~self.alive.view()[:n]] = -1
+        return scores
 
-    df = movies.copy().reset_index(drop=True)
+    def top_k(self, row, k=10):
+        """
+        Returns [(row, score), ...] for the k movies most similar to `row`, best first.
+        Ties keep catalog order, as the stable sort in the original scan did, and movies
+        sharing no token fill any remaining places in catalog order with score 0.
+        """
+        scores = self.scores(row)
+        return [(int(other), float(scores[other])) for other in _top_k_rows(scores, k)]
 
-    if 'movie_id' not in df.columns:
-        df['movie_id'] = df.index
+    def apply(self, changes):
+        """Applies catalog row changes [(row, record or None), ...] (see Catalog.changes_since)."""
+        for row, record in changes:
+            if record is None:
+                self._remove(row)
+            else:
+                self._add(row, record)
 
-    df['movie_id'] = df['movie_id'].astype(str).str.strip()
+    def _add(self, row, record):
+        ids = np.array(sorted(self.vocabulary.add(get_word_set(record))), dtype=np.int32)
+        movie_id = record['movie_id']
+        self.movie_ids.append(movie_id)
+        self.token_sets.append(ids)
+        self.postings.add(row, ids)
+        self.alive.append(True)
+        self.n = row + 1
+        if movie_id in self.row_by_id:
+            self.same_id.setdefault(movie_id, [self.row_by_id[movie_id]]).append(row)
+        else:
+            self.row_by_id[movie_id] = row
 
-    features = ['title', 'genres', 'overview', 'cast', 'director']
-    for feature in features:
-        df[feature] = df[feature].fillna('')
+    def _remove(self, row):
+        self.alive[row] = False
+        movie_id = self.movie_ids[row]
+        if self.row_by_id.get(movie_id) == row:
+            others = [other for other in self.same_id.get(movie_id, ()) if self.alive[other]]
+            if others:
+                self.row_by_id[movie_id] = others[0]
+            else:
+                del self.row_by_id[movie_id]
 
-    def get_word_set(row):
-        title_words = row['title'].lower().split()
-        genres_words = [g.strip() for g in row['genres'].lower().split(',')] if row['genres'] else []
-        overview_words = row['overview'].lower().split()
-        cast_words = [c.strip() for c in row['cast'].lower().split(',')] if row['cast'] else []
-        director_words = row['director'].lower().split()
-        word_list = title_words * 4 + overview_words * 3 + genres_words * 2 + cast_words + director_words
-        return set(word_list)
 
-    df['word_set'] = df.apply(get_word_set, axis=1)
+_jaccard_index = None
 
-    movie_title = movie_title_input.strip().lower()
-    matched = df[df['title'].str.strip().str.lower().str.contains(movie_title, na=False)]
-    if matched.empty:
+
+def get_jaccard_index():
+    """Returns the postings index for the current catalog, applying uploads and deletes to it in place."""
+    global _jaccard_index
+    with _index_lock:
+        _jaccard_index = refresh_index(
+            _jaccard_index, lambda snapshot: JaccardIndex(snapshot.records, alive=snapshot.alive),
+            'jaccard_index_build')
+        return _jaccard_index
+
+
+def find_movie_row(movie_title_input):
+    row = get_title_index().resolve(movie_title_input)
+    if row is None:
         raise ValueError(f"Movie titled '{movie_title_input}' not found in the database.")
+    return row
+
+
+def _resolve_seeds(queries, get_index):
+    """
+    Returns (index, rows): the index from get_index() and the row in it of each ('title',
+    text) or ('movie_id', id) query, None where not found. Titles resolve through the title
+    index, which is updated in place and may be ahead of the scoring index; when it hands
+    back a row from another epoch or one added since, the scoring index is fetched again
+    and the whole batch resolved against it.
+    """
+    index = get_index()
+    while True:
+        titles = get_title_index()
+        rows = []
+        for kind, value in queries:
+            if kind == 'movie_id':
+                rows.append(index.row_by_id.get(str(value).strip()))
+            else:
+                rows.append(titles.resolve(value))
+        if titles.epoch == index.epoch and all(row is None or row < len(index) for row in rows):
+            return index, rows
+        index = get_index()
+
+
+class SparseJaccardIndex:
+    """
+    Binary CSR matrix of the catalog's word sets (one row per movie, one column per token).
+    Intersections for a batch of query rows come from one sparse product, so scoring many
+    seeds costs a few matrix operations instead of a Python loop per seed.
+    """
+
+    def __init__(self, index):
+        from scipy import sparse  # only the batch paths need scipy; keep it off the import path
+        n = len(index)
+        self.version = index.version
+        self.epoch = index.epoch
+        self.records = index.records
+        self.movie_ids = np.array(index.movie_ids[:n], dtype=object)
+        self.row_by_id = dict(index.row_by_id)
+        self.same_id = {movie_id: list(rows) for movie_id, rows in index.same_id.items()}
+        self.sizes = np.array(index.sizes.view()[:n], dtype=np.int32)
+        self.dead = ~index.alive.view()[:n]
+
+        # The token sets already are CSR rows: sorted column ids plus offsets
+        token_sets = index.token_sets.compacted(n)
+        data = np.ones(len(token_sets.values), dtype=np.int32)
+        shape = (n, len(index.vocabulary))
+        self.matrix = sparse.csr_matrix((data, token_sets.values, token_sets.offsets), shape=shape)
+        self._matrix_t = self.matrix.T.tocsc()
+
+    def __len__(self):
+        return len(self.movie_ids)
+
+    def scores(self, rows):
+        """Returns a dense (len(rows), N) array of Jaccard scores; each seed's own movie_id scores -1."""
+        rows = np.asarray(rows, dtype=np.int64)
+        inter = (self.matrix[rows] @ self._matrix_t).toarray()
+        # The union is built in the one float64 buffer, and the division overwrites it in place;
+        # where it is 0 both sets are empty and the score stays 0
+        scores = np.subtract(self.sizes, inter, dtype=np.float64)
+        scores += self.sizes[rows][:, None]
+        np.divide(inter, scores, out=scores, where=scores > 0)
+        del inter
+        for i, row in enumerate(rows.tolist()):
+            scores[i, self._same_rows(row)] = -1
+        scores[:, self.dead] = -1
+        return scores
+
+    def _same_rows(self, row):
+        return self.same_id.get(self.movie_ids[row], row)
+
+    def profile_scores(self, rows):
+        """
+        Jaccard scores of every movie against the union of the word sets of `rows`, in one
+        sparse matrix-vector product. The seed movies themselves score -1.
+        """
+        rows = np.asarray(rows, dtype=np.int64)
+        profile = (np.asarray(self.matrix[rows].sum(axis=0)).ravel() > 0).astype(np.int32)
+        scores = (self.matrix @ profile).astype(np.float64)
+        union = profile.sum() + self.sizes - scores
+        np.divide(scores, union, out=scores, where=union > 0)
+        for row in rows.tolist():
+            scores[self._same_rows(row)] = -1
+        scores[self.dead] = -1
+        return scores
+
+    def top_k(self, rows, k=10, batch_size=256):
+        """
+        Yields, for each query row, [(row, score), ...] best first, ties in catalog order.
+        Batches are cut to NEIGHBOURS_BATCH_CELLS scores, whatever batch_size asks for.
+        """
+        batch_size = max(1, min(batch_size, NEIGHBOURS_BATCH_CELLS // max(len(self), 1)))
+        for start in range(0, len(rows), batch_size):
+            for score_row in self.scores(rows[start:start + batch_size]):
+                top = _top_k_rows(score_row, k)
+                yield [(int(other), float(score_row[other])) for other in top]
+
+
+def _top_k_rows(scores, k):
+    candidates = np.flatnonzero(scores >= 0)
+    if k < len(candidates):
+        part = np.argpartition(-scores[candidates], k - 1)[:k]
+        threshold = scores[candidates[part]].min()
+        candidates = candidates[scores[candidates] >= threshold]
+    order = np.lexsort((candidates, -scores[candidates]))
+    return candidates[order[:k]]
+
+
+_sparse_index = None
+
+
+def get_sparse_index():
+    """
+    Returns the CSR index for the current catalog. It is derived from the postings index
+    and rebuilt from its integer arrays (no re-tokenizing) whenever that one changes.
+    """
+    global _sparse_index
+    with _index_lock:
+        index = get_jaccard_index()
+        if _sparse_index is None or (_sparse_index.epoch, _sparse_index.version) != (index.epoch, index.version):
+            with metrics.timer('sparse_index_build'):
+                _sparse_index = SparseJaccardIndex(index)
+        return _sparse_index
+
+
+class MinHashLSHIndex:
+    """
+    Approximate Jaccard neighbours. Each word set gets a MinHash signature of num_perm
+    hashes, split into `bands` bands; movies that collide in any band become candidates,
+    which are then reranked with the exact Jaccard score. More bands (fewer rows per band)
+    raise recall at the cost of more candidates.
+    """
+
+    def __init__(self, sparse_index, jaccard_index, num_perm=LSH_NUM_PERM, bands=LSH_BANDS, seed=1):
+        if num_perm % bands:
+            raise ValueError("num_perm must be a multiple of bands.")
+        self.version = jaccard_index.version
+        self.epoch = jaccard_index.epoch
+        self.num_perm = num_perm
+        self.bands = bands
+        self.rows_per_band = num_perm // bands
+        self.records = jaccard_index.records
+        self.movie_ids = jaccard_index.movie_ids
+        self.token_sets = jaccard_index.token_sets
+        self.sizes = jaccard_index.sizes
+        self.dead = sparse_index.dead
+        self.n = len(sparse_index)
+
+        rng = np.random.default_rng(seed)
+        a = rng.integers(1, _LSH_PRIME, size=num_perm, dtype=np.int64)[:, None]
+        b = rng.integers(0, _LSH_PRIME, size=num_perm, dtype=np.int64)[:, None]
+        self.signatures = self._signatures(sparse_index.matrix, a, b)
+
+        # One int64 key per (movie, band); a sorted copy per band turns lookups into searchsorted
+        mult = rng.integers(1, 1 << 62, size=self.rows_per_band, dtype=np.int64).view(np.uint64)
+        sig = self.signatures.view(np.uint64).reshape(self.n, bands, self.rows_per_band)
+        with np.errstate(over='ignore'):
+            self.band_keys = (sig * mult).sum(axis=2).T
+        self.band_order = np.argsort(self.band_keys, axis=1, kind='stable')
+        self.sorted_keys = np.take_along_axis(self.band_keys, self.band_order, axis=1)
+
+    def _signatures(self, matrix, a, b, chunk_rows=2048):
+        n = matrix.shape[0]
+        signatures = np.full((n, self.num_perm), _LSH_PRIME, dtype=np.int64)
+        indptr, indices = matrix.indptr, matrix.indices.astype(np.int64)
+        for start in range(0, n, chunk_rows):
+            end = min(start + chunk_rows, n)
+            lo, hi = indptr[start], indptr[end]
+            if lo == hi:
+                continue
+            hashes = (a * indices[lo:hi] + b) % _LSH_PRIME
+            nonempty = indptr[start + 1:end + 1] > indptr[start:end]
+            offsets = indptr[start:end][nonempty] - lo
+            signatures[start:end][nonempty] = np.minimum.reduceat(hashes, offsets, axis=1).T
+        return signatures
+
+    def __len__(self):
+        return self.n
+
+    def candidates(self, row):
+        found = set()
+        for band in range(self.bands):
+            key = self.band_keys[band, row]
+            lo = np.searchsorted(self.sorted_keys[band], key, side='left')
+            hi = np.searchsorted(self.sorted_keys[band], key, side='right')
+            found.update(self.band_order[band, lo:hi].tolist())
+        target_id = self.movie_ids[row]
+        return [other for other in found if self.movie_ids[other] != target_id and not self.dead[other]]
+
+    def top_k(self, row, k=10):
+        """Same contract as JaccardIndex.top_k, but only candidates from shared LSH buckets are scored."""
+        target = self.token_sets[row]
+        target_size = int(self.sizes[row])
+        scored = []
+        for other in self.candidates(row):
+            inter = intersection_size(target, self.token_sets[other])
+            union = target_size + int(self.sizes[other]) - inter
+            scored.append((inter / union if union else 0, other))
+        best = heapq.nsmallest(k, scored, key=lambda x: (-x[0], x[1]))
+        return [(other, score) for score, other in best]
+
+
+_lsh_index = None
+
+
+def get_lsh_index(num_perm=LSH_NUM_PERM, bands=LSH_BANDS):
+    """Returns the MinHash/LSH index for the current catalog and settings, rebuilding it when either changes."""
+    global _lsh_index
+    with _index_lock:
+        index = get_jaccard_index()
+        if (_lsh_index is None or (_lsh_index.epoch, _lsh_index.version) != (index.epoch, index.version)
+                or (_lsh_index.num_perm, _lsh_index.bands) != (num_perm, bands)):
+            _lsh_index = MinHashLSHIndex(get_sparse_index(), index, num_perm=num_perm, bands=bands)
+        return _lsh_index
+
+
+def _save_npy(path, array):
+    tmp_path = path + '.tmp'
+    with open(tmp_path, 'wb') as f:
+        np.save(f, array)
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(tmp_path, path)
+
+
+def build_neighbour_table(records, path=NEIGHBOURS_PATH, k=NEIGHBOURS_K):
+    """
+    Computes the exact top-k neighbours of every movie in `records` and writes them as
+    fixed-width arrays: <path>.ids.npy (movie_ids), <path>.rows.npy (int32 rows into ids,
+    -1 padded) and <path>.scores.npy (float32). Returns the number of movies written.
+    """
+    index = JaccardIndex(records)
+    sparse_index = SparseJaccardIndex(index)
+    n = len(index)
+    rows = np.full((n, k), -1, dtype=np.int32)
+    scores = np.zeros((n, k), dtype=np.float32)
+    for row, top in enumerate(sparse_index.top_k(np.arange(n), k)):
+        for col, (other, score) in enumerate(top):
+            rows[row, col] = other
+            scores[row, col] = score
+
+    _save_npy(path + '.ids.npy', np.array(index.movie_ids, dtype=str))
+    _save_npy(path + '.scores.npy', scores)
+    # rows is written last; readers reload when its mtime changes
+    _save_npy(path + '.rows.npy', rows)
+    return n
+
+
+class NeighbourTable:
+    """Memory-mapped view of a table written by build_neighbour_table()."""
+
+    def __init__(self, path=NEIGHBOURS_PATH):
+        self.path = path
+        self.stamp = os.stat(path + '.rows.npy').st_mtime_ns
+        self.ids = np.load(path + '.ids.npy', mmap_mode='r')
+        self.rows = np.load(path + '.rows.npy', mmap_mode='r')
+        self.scores = np.load(path + '.scores.npy', mmap_mode='r')
+        if self.rows.shape != self.scores.shape or self.rows.shape[0] != len(self.ids):
+            raise ValueError(f"Neighbour table at '{path}' is inconsistent.")
+        self.k = self.rows.shape[1]
+        self._row_of = {}
+        for row, movie_id in enumerate(self.ids.tolist()):
+            self._row_of.setdefault(movie_id, row)
+
+    def __contains__(self, movie_id):
+        return movie_id in self._row_of
+
+    def lookup(self, movie_id):
+        """Returns the stored [(movie_id, score), ...] for movie_id, best first, or None if it was not built."""
+        row = self._row_of.get(movie_id)
+        if row is None:
+            return None
+        return [
+            (str(self.ids[other]), float(score))
+            for other, score in zip(self.rows[row], self.scores[row]) if other >= 0
+        ]
+
+
+_neighbour_table = None
 
-    movie_id = matched.iloc[0]['movie_id']
-    target_set = matched.iloc[0]['word_set']
-
-    def jaccard_similarity(set1, set2):
-        intersection = set1.intersection(set2)
-        union = set1.union(set2)
-        return len(intersection) / len(union) if union else 0
-
-    similarities = [
-        (row['movie_id'], jaccard_similarity(target_set, row['word_set']))
-        for _, row in df.iterrows() if row['movie_id'] != movie_id
-    ]
-
-    top_similar_movies = sorted(similarities, key=lambda x: x[1], reverse=True)[:10]
-
-    def get_image_url(mid):
-        match = img[img['movie_id'] == mid]
-        if match.empty:
-            return DEFAULT_IMAGE_URL
-        url = match.iloc[0].get('image_url', '')
-        return url if isinstance(url, str) and url.strip() else DEFAULT_IMAGE_URL
-
-    final_list = []
-    for mid, _ in top_similar_movies:
-        row = df[df['movie_id'] == mid].iloc[0]
-        title = row.get("title", "")
-        image_url = get_image_url(mid)
-        year = row.get("year", "")
-        director = row.get("director", "")
-        trailer_url = get_trailer_search_url(title, year)
-        final_list.append({
-            "movie_id": mid,
-            "title": title,
-            "image_url": image_url,
-            "year": year,
-            "director": director,
-            "trailer_url": trailer_url
-        })
-
-    return final_list
-
-
-def movie_display():
-    """
-    Returns a list of 10 randomly selected movies with their image URLs, years, directors,
-    and trailer search URLs, for display purposes (e.g., homepage).
-    """
-    movies = pd.read_csv(MOVIES_CSV, on_bad_lines='skip', low_memory=False)
-    img = pd.read_csv(IMAGES_CSV, on_bad_lines='skip', low_memory=False)
-
-    # movie_id is string and trimmed
-    movies['movie_id'] = movies['movie_id'].astype(str).str.strip()
-    img['movie_id'] = img['movie_id'].astype(str).str.strip()
-
-    final_list = []
-    max_len = min(len(movies), len(img))
-    rand_indices = np.random.choice(movies.index, min(10, max_len), replace=False)
-
-    def get_image_url(mid):
-        match = img[img['movie_id'] == mid]
-        if match.empty:
-            return DEFAULT_IMAGE_URL
-        url = match.iloc[0].get('image_url', '')
-        return url if isinstance(url, str) and url.strip() else DEFAULT_IMAGE_URL
-
-    for idx in rand_indices:
-        row = movies.iloc[idx]
-        mid = row.get('movie_id', None)
-        if mid is None:
+
+def get_neighbour_table(path=NEIGHBOURS_PATH):
+    """Returns the precomputed neighbour table, or None when it has not been built."""
+    global _neighbour_table
+    try:
+        stamp = os.stat(path + '.rows.npy').st_mtime_ns
+    except OSError:
+        _neighbour_table = None
+        return None
+    if _neighbour_table is None or _neighbour_table.path != path or _neighbour_table.stamp != stamp:
+        _neighbour_table = NeighbourTable(path)
+    return _neighbour_table
+
+
+def _precomputed_top_k(movie_id, k, partial=False):
+    """
+    Reads movie_id's neighbours from the offline table, skipping movies deleted since the build,
+    and returns all that remain. Returns None (score live instead) if the movie is newer than
+    the table or fewer than k remain, unless partial=True, which returns whatever is left
+    (used when live scoring is unavailable).
+    """
+    table = get_neighbour_table()
+    if table is None:
+        return None
+    neighbours = table.lookup(movie_id)
+    if neighbours is None:
+        return None
+    catalog = get_catalog()
+    found = []
+    for other_id, _ in neighbours:
+        movie = catalog.get(other_id)
+        if movie:
+            found.append(movie)
+    if len(found) >= k or (partial and found):
+        return found
+    return None
+
+
+def _recommendation(movie):
+    title = movie.get("title", "")
+    image_url = movie.get("image_url") or DEFAULT_IMAGE_URL
+    year = movie.get("year", "")
+    director = movie.get("director", "")
+    trailer_url = get_trailer_search_url(title, year)
+    return {
+        "movie_id": movie["movie_id"],
+        "title": title,
+        "image_url": image_url,
+        "year": year,
+        "director": director,
+        "trailer_url": trailer_url
+    }
+
+
+def recom(movie_title_input, k=10, approximate=False, offset=0):
+    """
+    Given a movie title, returns a list of top k recommended movies based on Jaccard similarity
+    of combined weighted word sets from title, genres, overview, cast, and director, skipping
+    the best `offset` ones (for paging).
+    Served from the results cache or the offline neighbour table when possible; with
+    approximate=True only MinHash/LSH candidates are scored (see MinHashLSHIndex). Live
+    scoring selects RESULTS_DEPTH movies at once, so later pages come from the cache.
+    Raises ScoringBusy when live scoring is overloaded and no precomputed fallback exists.
+    """
+    global _cache_version
+    version = get_catalog().version
+    if version != _cache_version:
+        recommendation_cache.clear()
+        _cache_version = version
+
+    title_key = normalize_title(movie_title_input)
+    if offset == 0:
+        # Further pages are not new requests for the title
+        _title_requests[title_key] += 1
+    needed = offset + k
+    key = (title_key, approximate, version)
+    with metrics.timer('cache_lookup'):
+        cached = recommendation_cache.get(key)
+    if cached is None or not _covers(cached, needed):
+        depth, ranked, complete = _score(movie_title_input, needed, approximate)
+        cached = (depth, ranked)
+        if complete:
+            recommendation_cache.set(key, cached)
+    return [dict(movie) for movie in cached[1][offset:needed]]
+
+
+def _covers(cached, needed):
+    depth, ranked = cached
+    # A ranking shorter than its depth already holds every movie there is
+    return depth >= needed or len(ranked) < depth
+
+
+def _score(movie_title_input, needed, approximate):
+    """
+    Serves exact requests from the neighbour table when it covers the first `needed` movies;
+    everything else is scored by _score_live in the scoring pool, at least RESULTS_DEPTH deep.
+    If the pool is busy or times out, whatever the table still has for the movie is returned
+    instead, or ScoringBusy is raised. Returns (depth, recommendations, complete); fallback
+    results are not complete and not cached.
+    """
+    with metrics.timer('title_match'):
+        row = find_movie_row(movie_title_input)
+    movie_id = get_title_index().records[row]['movie_id']
+    if not approximate:
+        with metrics.timer('neighbour_lookup'):
+            precomputed = _precomputed_top_k(movie_id, needed)
+        if precomputed is not None:
+            with metrics.timer('poster_lookup'):
+                return len(precomputed), [_recommendation(movie) for movie in precomputed], True
+    depth = max(needed, RESULTS_DEPTH)
+    try:
+        return depth, scoring_pool.run(_score_live, movie_title_input, depth, approximate), True
+    except ScoringBusy:
+        fallback = _precomputed_top_k(movie_id, needed, partial=True)
+        if fallback is None:
+            raise
+        metrics.count('recom_fallback')
+        return len(fallback), [_recommendation(movie) for movie in fallback], False
+
+
+def _score_live(movie_title_input, k, approximate):
+    """Scores recommendations against the in-process indexes; runs in a scoring pool process."""
+    get_index = get_lsh_index if approximate else get_jaccard_index
+    index, (row,) = _resolve_seeds([('title', movie_title_input)], get_index)
+    if row is None:
+        raise ValueError(f"Movie titled '{movie_title_input}' not found in the database.")
+    with metrics.timer('scoring'):
+        top = index.top_k(row, k)
+    with metrics.timer('poster_lookup'):
+        return [_recommendation(index.records[other]) for other, _ in top]
+
+
+def load_popular_titles(limit=50, path=POPULAR_TITLES_PATH):
+    """Returns the most requested titles recorded by save_popular_titles(), most popular first."""
+    try:
+        with open(path, encoding='utf-8') as f:
+            counts = json.load(f)
+    except (OSError, ValueError):
+        return []
+    return [title for title, _ in Counter(counts).most_common(limit)]
+
+
+@atexit.register
+def save_popular_titles(path=POPULAR_TITLES_PATH, keep=1000):
+    """Merges this worker's title request counts into the popular titles file."""
+    if not _title_requests:
+        return
+    with catalog_lock(path=path + '.lock'):
+        try:
+            with open(path, encoding='utf-8') as f:
+                counts = Counter(json.load(f))
+        except (OSError, ValueError):
+            counts = Counter()
+        counts.update(_title_requests)
+        tmp_path = path + '.tmp'
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            json.dump(dict(counts.most_common(keep)), f)
+        os.replace(tmp_path, path)
+    _title_requests.clear()
+
+
+def warm_recommendation_cache(titles=None, limit=50, k=10):
+    """Pre-fills the results cache for `titles` (default: the most requested ones). Returns how many were cached."""
+    if titles is None:
+        titles = load_popular_titles(limit)
+    # Warm-up calls should not count as user requests
+    requests_before = Counter(_title_requests)
+    warmed = 0
+    for title in titles:
+        try:
+            recom(title, k=k)
+        except ValueError:
             continue
-        title = row.get('title', '')
-        image_url = get_image_url(mid)
-        year = row.get('year', '')
-        director = row.get('director', '')
-        trailer_url = get_trailer_search_url(title, year)
-        final_list.append({
-            "movie_id": mid,
-            "title": title,
-            "image_url": image_url,
-            "year": year,
-            "director": director,
-            "trailer_url": trailer_url
-        })
-
-    return final_list
+        warmed += 1
+    _title_requests.clear()
+    _title_requests.update(requests_before)
+    return warmed
+
+
+def recom_many(titles, k=10):
+    """
+    Batch version of recom() scored with sparse matrix products. Returns a dict mapping each
+    input title to its list of k recommendations; titles not found in the catalog map to [].
+    """
+    index, rows = _resolve_seeds([('title', title) for title in titles], get_sparse_index)
+    found = {title: row for title, row in zip(titles, rows) if row is not None}
+
+    results = {title: [] for title in titles}
+    rows = np.array(list(found.values()), dtype=np.int64)
+    for title, top in zip(found, index.top_k(rows, k)):
+        results[title] = [_recommendation(index.records[other]) for other, _ in top]
+    return results
+
+
+def profile_recommendations(movie_ids, k=10):
+    """
+    "For you" recommendations: the k movies closest to the merged word sets of movie_ids
+    (e.g. a user's watchlist), excluding those movies. Unknown ids are ignored; returns []
+    when none of them are in the catalog.
+    """
+    index = get_sparse_index()
+    rows = [index.row_by_id[m] for m in dict.fromkeys(str(m).strip() for m in movie_ids) if m in index.row_by_id]
+    if not rows:
+        return []
+    with metrics.timer('profile_scoring'):
+        scores = index.profile_scores(rows)
+        top = _top_k_rows(scores, k)
+    return [_recommendation(index.records[other]) for other in top]
+
+
+def iter_recommendations(queries, k=10, batch_size=64):
+    """
+    Streaming batch version of recom(). `queries` holds ('title', text) or ('movie_id', id)
+    pairs; seeds are resolved and scored batch_size at a time with sparse products, and one
+    dict per query is yielded in input order as soon as its batch is done:
+    {'query', 'movie_id', 'title', 'recommendations'} or {'query', 'error'}.
+    """
+    queries = iter(queries)
+    while True:
+        batch = list(itertools.islice(queries, batch_size))
+        if not batch:
+            return
+        # Each batch picks up catalog changes made while the stream runs
+        index, rows = _resolve_seeds(batch, get_sparse_index)
+
+        found = np.array([row for row in rows if row is not None], dtype=np.int64)
+        with metrics.timer('batch_scoring'):
+            tops = iter(list(index.top_k(found, k, batch_size=batch_size)))
+        for (kind, value), row in zip(batch, rows):
+            if row is None:
+                what = 'ID' if kind == 'movie_id' else 'titled'
+                yield {'query': value, 'error': f"Movie {what} '{value}' not found in the database."}
+                continue
+            seed = index.records[row]
+            yield {
+                'query': value,
+                'movie_id': seed['movie_id'],
+                'title': seed['title'],
+                'recommendations': [_recommendation(index.records[other]) for other, _ in next(tops)]
+            }
+
+
+def _genres(movie):
+    return {g.strip().lower() for g in str(movie.get('genres', '')).split(',') if g.strip()}
+
+
+def _decade(movie):
+    year = str(movie.get('year', '')).strip()
+    return int(year) // 10 * 10 if year.isdigit() else None
+
+
+def _bucket_keys(movie):
+    decade = _decade(movie)
+    for genre in _genres(movie) | {None}:
+        yield (genre, None)
+        if decade is not None:
+            yield (genre, decade)
+
+
+class CardDeck:
+    """
+    Ready-to-render home page cards for the whole catalog, plus row buckets per genre,
+    decade and (genre, decade), so sampling k cards is O(k) whatever the filters.
+    Uploaded movies are appended to the buckets; deleted ones stay and are skipped until
+    they reach CARD_DECK_COMPACT_FRACTION of the rows, when the buckets are rebuilt.
+    """
+
+    def __init__(self, records, version=None, alive=None):
+        self.version = version
+        self.epoch = None
+        alive = np.ones(len(records), dtype=bool) if alive is None else alive
+        self.alive = GrowableArray(alive)
+        self.cards = [None] * len(alive)
+        buckets = defaultdict(list)
+        for row in np.flatnonzero(alive).tolist():
+            movie = records[row]
+            self.cards[row] = _recommendation(movie)
+            for key in _bucket_keys(movie):
+                buckets[key].append(row)
+        self.buckets = {key: np.array(rows, dtype=np.int32) for key, rows in buckets.items()}
+        self.added = defaultdict(list)
+        # Rows deleted since the last build or compaction that are still in the buckets
+        self.removed = 0
+
+    def __len__(self):
+        return int(self.alive.view().sum())
+
+    def apply(self, changes):
+        """Applies catalog row changes [(row, record or None), ...] (see Catalog.changes_since)."""
+        for row, record in changes:
+            if record is None:
+                if self.alive[row]:
+                    self.alive[row] = False
+                    self.removed += 1
+                continue
+            self.cards.append(_recommendation(record))
+            self.alive.append(True)
+            for key in _bucket_keys(record):
+                self.added[key].append(row)
+        if self.removed > CARD_DECK_COMPACT_FRACTION * len(self.cards):
+            self._compact()
+
+    def _compact(self):
+        alive = self.alive.view()
+        buckets = {}
+        for key in set(self.buckets) | set(self.added):
+            rows = np.concatenate([self.buckets.get(key, np.zeros(0, dtype=np.int32)),
+                                   np.array(self.added.get(key, ()), dtype=np.int32)])
+            buckets[key] = rows[alive[rows]]
+        # sample() reads buckets before added, so replacing added first never shows a row twice
+        self.added = defaultdict(list)
+        self.buckets = buckets
+        self.removed = 0
+
+    def sample(self, k=10, genre=None, decade=None, rng=None):
+        if genre:
+            genre = genre.strip().lower()
+        key = (genre or None, decade)
+        rows, added = self.buckets.get(key, ()), self.added.get(key, ())
+        alive = self.alive.view()
+        cards = []
+        for i in _random_positions(len(rows) + len(added), k, rng or random.Random()):
+            row = rows[i] if i < len(rows) else added[i - len(rows)]
+            if alive[row]:
+                cards.append(dict(self.cards[row]))
+                if len(cards) == k:
+                    break
+        return cards
+
+
+def _random_positions(total, k, rng):
+    """
+    Distinct positions in range(total) in random order, drawn lazily: a caller that skips
+    deleted rows redraws only for those, so k live picks cost about k draws.
+    """
+    if total <= 2 * k:
+        yield from rng.sample(range(total), total)
+        return
+    seen = set()
+    for _ in range(4 * k):
+        i = rng.randrange(total)
+        if i not in seen:
+            seen.add(i)
+            yield i
+    # A bucket that is mostly deleted rows: go through the rest in random order
+    rest = [i for i in range(total) if i not in seen]
+    rng.shuffle(rest)
+    yield from rest
+
+
+_card_deck = None
+
+
+def get_card_deck():
+    """Returns the home page cards for the current catalog, applying uploads and deletes to them in place."""
+    global _card_deck
+    with _index_lock:
+        _card_deck = refresh_index(
+            _card_deck, lambda snapshot: CardDeck(snapshot.records, alive=snapshot.alive), 'card_deck_build')
+        return _card_deck
+
+
+def movie_display(k=10, genre=None, decade=None):
+    """
+    Returns a list of k randomly selected movies with their image URLs, years, directors,
+    and trailer search URLs, for display purposes (e.g., homepage). Optionally restricted
+    to a genre and/or a decade (e.g. 1990).
+    """
+    deck = get_card_deck()
+    with metrics.timer('card_sample'):
+        return deck.sample(k, genre=genre, decade=decade)
@@ -1,12 +1,14 @@
-import pandas as pd
+import json
 import os
-import csv
 import random
-from csv import writer
-from flask import render_template, url_for, flash, redirect, request
+import time
+from functools import wraps
+from flask import (
+    render_template, url_for, flash, redirect, request, jsonify, g, abort, Response,
+    before_render_template, template_rendered
+)
 from flask_login import login_user, current_user, logout_user, login_required
-from PIL import Image
-from fuzzywuzzy import fuzz
+from sqlalchemy.exc import IntegrityError
 import secrets
 from Main import app, db, bcrypt
 from Main.form import (
@@ -14,14 +16,63 @@ from Main.form import (
     Contact, DeleteMovie, UpdateAccount
 )
 from Main.models import User, UserWatchlist  
-from Main.recomm import recom, movie_display
-
-# CSV file paths
-BASE_DIR = os.path.dirname(os.path.abspath(__file__))
-MOVIES_CSV = os.path.join(BASE_DIR, 'movies.csv')
-IMAGES_CSV = os.path.join(BASE_DIR, 'movie_images.csv')
+from Main.recomm import recom, movie_display, iter_recommendations
+from Main.catalog import get_catalog
+from Main.store import store, CatalogChanged
+from Main.bulkimport import batch_format, read_batch, import_movies, MAX_IMPORT_ROWS
+from Main.search import ranked_search, get_title_index, normalize_title, MAX_RESULTS
+from Main.paging import page_request, decode_cursor, paginate
+from Main.pool import ScoringBusy
+from Main.pagecache import conditional_page, cached_fragment, skip_validation, time_bucket
+from Main.metrics import metrics, profile_request, finish_profile, set_profile_rate
+from Main.foryou import worker as for_you_worker, for_you_ids
 
 MAX_WATCHLIST_ITEMS = 5
+# When set, /metrics requires "Authorization: Bearer <token>"
+METRICS_TOKEN = os.environ.get('METRICS_TOKEN')
+# Services without a login session call the JSON API with "Authorization: Bearer <API_TOKEN>"
+API_TOKEN = os.environ.get('API_TOKEN')
+MAX_API_QUERIES = 5000
+MAX_API_K = 100
+RECOMMENDATIONS_PAGE_SIZE = 10
+# The home page's random cards are re-drawn this often (seconds); 0 draws them on every hit
+HOME_ROTATE_SECONDS = int(os.environ.get('HOME_ROTATE_SECONDS', 60))
+
+def api_login_required(view):
+    @wraps(view)
+    def wrapped(*args, **kwargs):
+        if current_user.is_authenticated or app.config.get('LOGIN_DISABLED'):
+            return view(*args, **kwargs)
+        if API_TOKEN and request.headers.get('Authorization') == f'Bearer {API_TOKEN}':
+            return view(*args, **kwargs)
+        return jsonify({'error': 'Authentication required.'}), 401
+    return wrapped
+
+@app.before_request
+def start_request_timer():
+    g.request_start = time.perf_counter()
+    g.profiler = profile_request()
+
+@app.after_request
+def record_request_metrics(response):
+    profiler = g.pop('profiler', None)
+    if profiler is not None:
+        finish_profile(profiler)
+    start = g.pop('request_start', None)
+    if start is not None:
+        metrics.observe_request(request.endpoint or 'unmatched', request.method,
+                                response.status_code, time.perf_counter() - start)
+    return response
+
+@before_render_template.connect_via(app)
+def start_render_timer(sender, template, context, **extra):
+    g.render_start = time.perf_counter()
+
+@template_rendered.connect_via(app)
+def record_render_time(sender, template, context, **extra):
+    start = g.pop('render_start', None)
+    if start is not None:
+        metrics.observe('render_template', time.perf_counter() - start)
 
 def get_trailer_search_url(title, year):
     # YouTube search URL for trailer
@@ -29,12 +80,7 @@ def get_trailer_search_url(title, year):
     return f"https://www.youtube.com/results?search_query={query}"
 
 def get_movie_details_by_id(movie_id):
-    with open(MOVIES_CSV, newline='', encoding='utf-8') as f:
-        reader = csv.DictReader(f)
-        for row in reader:
-            if row['movie_id'].strip() == str(movie_id).strip():
-                return row
-    return None
+    return get_catalog().get(movie_id)
 
 @app.route('/movie/<movie_id>')
 def movie_info(movie_id):
@@ -43,45 +89,43 @@ def movie_info(movie_id):
         flash("Movie not found.", "warning")
         return redirect(request.referrer or url_for('home'))
 
-    image_url = None
-    with open(IMAGES_CSV, newline='', encoding='utf-8') as f:
-        reader = csv.DictReader(f)
-        for row in reader:
-            if row['movie_id'].strip() == str(movie_id).strip():
-                image_url = row.get('image_url', None)
-                break
-    movie['image_url'] = image_url or url_for('static', filename='default_movie.jpg')
+    def render_body():
+        movie['image_url'] = movie.get('image_url') or url_for('static', filename='default_movie.jpg')
+
+        movie['trailer_url'] = get_trailer_search_url(movie.get('title', ''), movie.get('year', ''))
 
-    movie['trailer_url'] = get_trailer_search_url(movie.get('title', ''), movie.get('year', ''))
+        return render_template('movieinfo_body.html', movie=movie)
 
-    return render_template('movieinfo.html', movie=movie)
+    key = ('movie', movie['movie_id'])
+    return conditional_page(key, lambda: render_template(
+        'movieinfo.html', movie=movie, body=cached_fragment(key, render_body)))
 
 @app.route('/add_to_watchlist/<movie_id>', methods=['POST'])
 @login_required
 def add_to_watchlist(movie_id):
-    count = UserWatchlist.query.filter_by(user_id=current_user.id).count()
-    if count >= MAX_WATCHLIST_ITEMS:
-        flash("You can only add up to 5 movies to your watchlist. Please remove some first.", "warning")
+    try:
+        added = UserWatchlist.add_if_room(current_user.id, movie_id, MAX_WATCHLIST_ITEMS)
+        db.session.commit()
+    except IntegrityError:
+        db.session.rollback()
+        flash("This movie is already in your watchlist.", "info")
         return redirect(request.referrer or url_for('account'))
 
-    exists = UserWatchlist.query.filter_by(user_id=current_user.id, movie_id=movie_id).first()
-    if exists:
-        flash("This movie is already in your watchlist.", "info")
+    if not added:
+        flash("You can only add up to 5 movies to your watchlist. Please remove some first.", "warning")
         return redirect(request.referrer or url_for('account'))
 
-    new_entry = UserWatchlist(user_id=current_user.id, movie_id=movie_id)
-    db.session.add(new_entry)
-    db.session.commit()
+    for_you_worker.schedule(current_user.id)
     flash("Movie added to your watchlist!", "success")
     return redirect(request.referrer or url_for('account'))
 
 @app.route('/remove_from_watchlist/<movie_id>', methods=['POST'])
 @login_required
 def remove_from_watchlist(movie_id):
-    entry = UserWatchlist.query.filter_by(user_id=current_user.id, movie_id=movie_id).first()
-    if entry:
-        db.session.delete(entry)
-        db.session.commit()
+    removed = UserWatchlist.query.filter_by(user_id=current_user.id, movie_id=movie_id).delete()
+    db.session.commit()
+    if removed:
+        for_you_worker.schedule(current_user.id)
         flash("Movie removed from your watchlist.", "success")
     else:
         flash("Movie not found in your watchlist.", "danger")
@@ -90,8 +134,20 @@ def remove_from_watchlist(movie_id):
 @app.route("/")
 @app.route("/home")
 def home():
-    movies_list = movie_display()  # This helps movie_display to include trailer_url in recomm.py
-    return render_template('home.html', content=movies_list)
+    genre = request.args.get('genre', '').strip() or None
+    decade = request.args.get('decade', type=int)
+    if not HOME_ROTATE_SECONDS:
+        movies_list = movie_display(genre=genre, decade=decade)  # This helps movie_display to include trailer_url in recomm.py
+        return render_template('home.html', content=movies_list)
+
+    window = time_bucket(HOME_ROTATE_SECONDS)
+    key = ('home', genre and genre.lower(), decade, window.timestamp())
+
+    def render_cards():
+        return render_template('home_cards.html', content=movie_display(genre=genre, decade=decade))
+
+    return conditional_page(key, lambda: render_template(
+        'home.html', cards=cached_fragment(key, render_cards)), last_modified=window)
 
 @app.route("/about")
 def about():
@@ -138,60 +194,136 @@ def logout():
 @login_required
 def recommender():
     form = MovieForm()
+    movie, offset, page_size = None, 0, RECOMMENDATIONS_PAGE_SIZE
     if form.validate_on_submit():
         movie = form.moviename.data
+    elif request.args.get('cursor'):
+        # "Show more" link for the next page of an earlier submission
+        try:
+            movie, offset, page_size = decode_cursor(request.args['cursor'], 'recommendations')
+        except ValueError:
+            abort(400)
+        form.moviename.data = movie
+    if movie:
         try:
-            final_list = recom(movie)  # This helps recom to include trailer_url for each movie
+            page = recommendation_page(movie, offset, page_size)
             flash('Here are the following recommendations for you', 'success')
-            return render_template('recommender.html', title='Recommender', form=form, final=final_list)
+            return render_template('recommender.html', title='Recommender', form=form, final=page['results'],
+                                   next_cursor=page['next_cursor'])
         except ValueError as e:
             flash(str(e), 'danger')
+        except ScoringBusy as e:
+            flash(str(e), 'warning')
     return render_template('recommender.html', title='Recommender', form=form)
 
-def upload_to_csv(file_name, row):
-    file_exists = os.path.isfile(file_name)
-    write_header = False
-    if not file_exists or os.stat(file_name).st_size == 0:
-        write_header = True
-
-    with open(file_name, 'a', newline='', encoding='utf-8') as f:
-        csv_writer = writer(f)
-        if write_header:
-            if file_name == MOVIES_CSV:
-                csv_writer.writerow(['movie_id', 'title', 'genres', 'overview', 'cast', 'director', 'year'])
-            elif file_name == IMAGES_CSV:
-                csv_writer.writerow(['movie_id', 'image_url'])
-        csv_writer.writerow(row)
+def recommendation_page(title, offset, page_size):
+    # recom includes trailer_url for each movie
+    movies = recom(title, k=page_size, offset=offset)
+    return paginate('recommendations', title, movies, offset, page_size, has_more=len(movies) == page_size)
+
+@app.route("/api/recommendations")
+@api_login_required
+def api_recommendations():
+    # ?title=...&page=1&page_size=10, or ?cursor=<next_cursor of the previous page>
+    try:
+        title, offset, page_size = page_request(request.args, 'recommendations', request.args.get('title', '').strip(),
+                                                RECOMMENDATIONS_PAGE_SIZE)
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+    if not title:
+        return jsonify({'error': 'Provide a title.'}), 400
+    try:
+        return jsonify(recommendation_page(title, offset, page_size))
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 404
+    except ScoringBusy as e:
+        return jsonify({'error': str(e)}), 503
+
+@app.route("/api/titles")
+@login_required
+def title_suggestions():
+    # Typeahead for MovieForm.moviename, best match first
+    query = request.args.get('q', '').strip()
+    index = get_title_index()
+    suggestions = []
+    for row in index.suggest(query):
+        movie = index.records[row]
+        suggestions.append({
+            'movie_id': movie['movie_id'],
+            'title': movie['title'],
+            'year': movie['year']
+        })
+    return jsonify(suggestions)
+
+@app.route("/api/recommend", methods=['POST'])
+@api_login_required
+def api_recommend():
+    # {"titles": [...], "movie_ids": [...], "k": 10} -> one JSON line per title/id, in order
+    payload = request.get_json(silent=True)
+    if not isinstance(payload, dict):
+        return jsonify({'error': 'Expected a JSON object.'}), 400
+    titles = payload.get('titles') or []
+    movie_ids = payload.get('movie_ids') or []
+    k = payload.get('k', 10)
+    if not isinstance(titles, list) or not isinstance(movie_ids, list):
+        return jsonify({'error': 'titles and movie_ids must be lists.'}), 400
+    if not titles and not movie_ids:
+        return jsonify({'error': 'Provide at least one title or movie_id.'}), 400
+    if len(titles) + len(movie_ids) > MAX_API_QUERIES:
+        return jsonify({'error': f'At most {MAX_API_QUERIES} titles and movie_ids per request.'}), 400
+    if not isinstance(k, int) or isinstance(k, bool) or not 1 <= k <= MAX_API_K:
+        return jsonify({'error': f'k must be an integer between 1 and {MAX_API_K}.'}), 400
+
+    queries = [('title', str(t)) for t in titles] + [('movie_id', str(m)) for m in movie_ids]
+    lines = (json.dumps(result) + '\n' for result in iter_recommendations(queries, k))
+    return Response(lines, mimetype='application/x-ndjson')
+
+@app.route("/api/movies/import", methods=['POST'])
+@api_login_required
+def api_import_movies():
+    # A CSV (header row) or JSON Lines batch, as the request body or an uploaded "file";
+    # valid rows are written together, invalid ones come back with their errors
+    upload = request.files.get('file')
+    if upload:
+        text = upload.read().decode('utf-8-sig', errors='replace')
+        filename, mimetype = upload.filename, upload.mimetype
+    else:
+        text = request.get_data(as_text=True)
+        filename, mimetype = None, request.mimetype
+    if not text.strip():
+        return jsonify({'error': 'Provide a CSV or JSON Lines batch of movies.'}), 400
+
+    lines = text.splitlines(keepends=True)
+    rows, errors = read_batch(lines, batch_format(filename, mimetype, lines[0]))
+    if len(rows) + len(errors) > MAX_IMPORT_ROWS:
+        return jsonify({'error': f'At most {MAX_IMPORT_ROWS} movies per request.'}), 400
+    try:
+        return jsonify(import_movies(rows, errors))
+    except CatalogChanged:
+        return jsonify({'error': 'The catalog kept changing during the import; please retry.'}), 409
 
 @app.route("/uploadmovie", methods=['GET', 'POST'])
 @login_required
 def uploadmovie():
     form = UploadMovie()
-    df = pd.read_csv(MOVIES_CSV, on_bad_lines='skip', low_memory=False) if os.path.exists(MOVIES_CSV) else pd.DataFrame()
 
     if form.validate_on_submit():
         new_title = form.title.data.strip().lower()
 
-        if not df.empty and 'title' in df.columns:
-            existing_titles = df['title'].str.strip().str.lower().tolist()
-            if new_title in existing_titles:
-                flash('Movie with this title already exists!', 'warning')
-                return redirect(url_for('uploadmovie'))
-
-        new_id = form.movie_id.data.strip()
-        movie_row = [
-            new_id,
-            form.title.data.strip(),
-            form.genres.data.strip(),
-            form.overview.data.strip(),
-            form.cast.data.strip(),
-            form.director.data.strip(),
-            form.year.data
-        ]
-        upload_to_csv(MOVIES_CSV, movie_row)
-
-        image_row = [new_id, form.image_url.data.strip()]
-        upload_to_csv(IMAGES_CSV, image_row)
+        if normalize_title(new_title) in get_title_index().exact:
+            flash('Movie with this title already exists!', 'warning')
+            return redirect(url_for('uploadmovie'))
+
+        store.upsert({
+            'movie_id': form.movie_id.data.strip(),
+            'title': form.title.data.strip(),
+            'genres': form.genres.data.strip(),
+            'overview': form.overview.data.strip(),
+            'cast': form.cast.data.strip(),
+            'director': form.director.data.strip(),
+            'year': form.year.data,
+            'image_url': form.image_url.data.strip()
+        })
 
         flash('Movie Uploaded Successfully!', 'success')
         return redirect(url_for('home'))
@@ -207,26 +339,6 @@ def contact():
         return redirect(url_for('contact'))
     return render_template('contact.html', title='Contact', current=cur, form=form)
 
-def delete_row_by_id(file_name, movie_id):
-    lines = []
-    found = False
-    movie_id = str(movie_id).strip()
-
-    with open(file_name, 'r', newline='', encoding='utf-8') as readFile:
-        reader = csv.reader(readFile)
-        header = next(reader)
-        lines.append(header)
-        for row in reader:
-            if row and str(row[0]).strip() == movie_id:
-                found = True
-            else:
-                lines.append(row)
-
-    if found:
-        with open(file_name, 'w', newline='', encoding='utf-8') as writeFile:
-            csv.writer(writeFile).writerows(lines)
-    return found
-
 @app.route("/deletemovie", methods=['GET', 'POST'])
 @login_required
 def deletemovie():
@@ -234,20 +346,12 @@ def deletemovie():
     if form.validate_on_submit():
         movie_id = str(form.movie_id.data).strip()
 
-        df = pd.read_csv(MOVIES_CSV, on_bad_lines='skip', low_memory=False)
-        df['movie_id'] = df['movie_id'].astype(str).str.strip()
-
-        if movie_id not in df['movie_id'].values:
+        if get_movie_details_by_id(movie_id) is None:
             flash('Movie with that ID was not found.', 'warning')
             return redirect(url_for('home'))
 
-        deleted_movie = delete_row_by_id(MOVIES_CSV, movie_id)
-        deleted_image = delete_row_by_id(IMAGES_CSV, movie_id)
-
-        if deleted_movie:
-            flash('Movie Deleted Successfully', 'success')
-        else:
-            flash('Movie with that ID was not found.', 'warning')
+        store.delete(movie_id)
+        flash('Movie Deleted Successfully', 'success')
         return redirect(url_for('home'))
     return render_template('deletemovie.html', title='Delete Movie', form=form)
 
@@ -258,6 +362,7 @@ def save_picture(form_picture):
     picture_fn = random_hex + f_ext
     picture_path = os.path.join(app.root_path, 'static/profile_pics', picture_fn)
 
+    from PIL import Image
     output_size = (125, 125)
     i = Image.open(form_picture)
     i.thumbnail(output_size)
@@ -292,99 +397,122 @@ def account():
 
     watchlist_entries = UserWatchlist.query.filter_by(user_id=current_user.id).all()
     watchlist_movies = []
-    for entry in watchlist_entries:
-        details = get_movie_details_by_id(entry.movie_id)
-        if details:
-            details['trailer_url'] = get_trailer_search_url(details.get('title', ''), details.get('year', ''))
-            watchlist_movies.append(details)
+    details_by_id = get_catalog().get_many(entry.movie_id for entry in watchlist_entries)
+    for details in details_by_id.values():
+        details['trailer_url'] = get_trailer_search_url(details.get('title', ''), details.get('year', ''))
+        watchlist_movies.append(details)
+
+    # Precomputed in the background after watchlist changes; no scoring happens here
+    picks = for_you_ids(current_user.id, [entry.movie_id for entry in watchlist_entries])
+    for_you_movies = list(get_catalog().get_many(picks).values())
 
-    return render_template('account.html', title='Account', image_file=image_file, form=form, timestamp=timestamp, watchlist=watchlist_movies)
+    return render_template('account.html', title='Account', image_file=image_file, form=form, timestamp=timestamp, watchlist=watchlist_movies, for_you=for_you_movies)
 
 @app.route("/search")
 @login_required
 def search():
-    query = request.args.get('q', '').strip()
-    results = []
+    try:
+        query, offset, page_size = page_request(request.args, 'search', request.args.get('q', '').strip(), MAX_RESULTS)
+    except ValueError:
+        abort(400)
 
     if len(query) < 3:
         return render_template('search_results.html', results=[], query=query)
 
-    if query:
-        with open(MOVIES_CSV, newline='', encoding='utf-8') as f:
-            reader = csv.DictReader(f)
-            for row in reader:
-                title = row['title'].lower()
-                genres = row['genres'].lower()
-                overview = row['overview'].lower()
-                cast = row['cast'].lower()
-                director = row['director'].lower()
-                q = query.lower()
-
-                # Calculate fuzzy scores
-                title_score = fuzz.partial_ratio(q, title)
-                genres_score = fuzz.partial_ratio(q, genres)
-                overview_score = fuzz.partial_ratio(q, overview)
-                cast_score = fuzz.partial_ratio(q, cast)
-                director_score = fuzz.partial_ratio(q, director)
-
-                # Skiping if score is too low
-                if max(title_score, genres_score, overview_score, cast_score, director_score) < 80:
-                    continue
-
-                # Given more weight to title
-                total_score = title_score * 10 + genres_score * 3 + overview_score + cast_score * 2 + director_score * 2
-
-                image_url = None
-                with open(IMAGES_CSV, newline='', encoding='utf-8') as f_img:
-                    reader_img = csv.DictReader(f_img)
-                    for img_row in reader_img:
-                        if img_row['movie_id'].strip() == row['movie_id'].strip():
-                            image_url = img_row.get('image_url', None)
-                            break
-                if not image_url:
-                    image_url = url_for('static', filename='default_movie.jpg')
-
-                trailer_url = get_trailer_search_url(row['title'], row['year'])
-
-                results.append({
-                    'movie_id': row['movie_id'],
-                    'title': row['title'],
-                    'genres': row['genres'],
-                    'overview': row['overview'],
-                    'cast': row['cast'],
-                    'director': row['director'],
-                    'year': row['year'],
-                    'image_url': image_url,
-                    'score': total_score,
-                    'trailer_url': trailer_url
-                })
-
-        # Sort results descending by score
-        results.sort(key=lambda x: x['score'], reverse=True)
-
-        # Limiting to top 20 results
-        results = results[:20]
-
-    return render_template('search_results.html', results=results, query=query)
+    key = ('search', query, offset, page_size)
+    return conditional_page(key, lambda: render_template(
+        'search_results.html', query=query, body=search_results_body(key, query, offset, page_size)))
+
+def search_results_body(key, query, offset, page_size):
+    def render_body():
+        page = search_results(query, offset, page_size)
+        return render_template('search_results_body.html', results=page['results'], query=query,
+                               page=page['page'], next_cursor=page['next_cursor'])
+
+    try:
+        return cached_fragment(key, render_body)
+    except ScoringBusy as e:
+        flash(str(e), 'warning')
+        skip_validation()
+        return render_template('search_results_body.html', results=[], query=query)
+
+@app.route("/api/search")
+@api_login_required
+def api_search():
+    # ?q=...&page=1&page_size=20, or ?cursor=<next_cursor of the previous page>
+    try:
+        query, offset, page_size = page_request(request.args, 'search', request.args.get('q', '').strip(), MAX_RESULTS)
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+    if len(query) < 3:
+        return jsonify({'error': 'q must be at least 3 characters.'}), 400
+    try:
+        return jsonify(search_results(query, offset, page_size))
+    except ScoringBusy as e:
+        return jsonify({'error': str(e)}), 503
+
+def search_results(query, offset=0, page_size=MAX_RESULTS):
+    # One page of the cached ranking (see ranked_search) plus the cursor of the next one
+    ranked = ranked_search(query)
+    results = []
+    for movie, total_score in ranked[offset:offset + page_size]:
+        image_url = movie['image_url'] or url_for('static', filename='default_movie.jpg')
+
+        trailer_url = get_trailer_search_url(movie['title'], movie['year'])
+
+        results.append({
+            'movie_id': movie['movie_id'],
+            'title': movie['title'],
+            'genres': movie['genres'],
+            'overview': movie['overview'],
+            'cast': movie['cast'],
+            'director': movie['director'],
+            'year': movie['year'],
+            'image_url': image_url,
+            'score': total_score,
+            'trailer_url': trailer_url
+        })
+
+    return paginate('search', query, results, offset, page_size, has_more=offset + page_size < len(ranked))
+
 @app.route('/surprise')
 @login_required
 def surprise():
-    with open(MOVIES_CSV, newline='', encoding='utf-8') as f:
-        reader = list(csv.DictReader(f))
-        movie = random.choice(reader)
-
-    image_url = None
-    with open(IMAGES_CSV, newline='', encoding='utf-8') as f_img:
-        reader_img = csv.DictReader(f_img)
-        for img_row in reader_img:
-            if img_row['movie_id'].strip() == movie['movie_id'].strip():
-                image_url = img_row.get('image_url', None)
-                break
-    if not image_url:
-        image_url = url_for('static', filename='default_movie.jpg')
+    movie = dict(random.choice(get_catalog().records))
+
+    image_url = movie.get('image_url') or url_for('static', filename='default_movie.jpg')
 
     trailer_url = get_trailer_search_url(movie.get('title', ''), movie.get('year', ''))
     
     movie['trailer_url'] = trailer_url
 
     return render_template('movieinfo.html', movie=movie, image_url=image_url)
+
+def metrics_authorized():
+    """/metrics needs "Authorization: Bearer <METRICS_TOKEN>" when a token is set; /metrics/profile always does."""
+    return not METRICS_TOKEN or request.headers.get('Authorization') == f'Bearer {METRICS_TOKEN}'
+
+@app.route("/metrics")
+def prometheus_metrics():
+    if not metrics_authorized():
+        abort(401)
+    return Response(metrics.render(), mimetype='text/plain; version=0.0.4')
+
+@app.route("/metrics/profile", methods=['GET', 'POST'])
+@login_required
+def metrics_profile():
+    # Profiling slows every worker down, so without a token the endpoint does not exist
+    if not METRICS_TOKEN:
+        abort(404)
+    if not metrics_authorized():
+        abort(401)
+    # POST rate=0.01 profiles 1% of the requests of every worker; rate=0 switches profiling off.
+    # The report (and reset) only covers the worker that serves the call.
+    if request.method == 'POST':
+        rate = request.form.get('rate', type=float)
+        if rate is None:
+            abort(400)
+        if request.form.get('reset'):
+            metrics.reset_profile()
+        return jsonify({'pid': os.getpid(), 'profile_rate': set_profile_rate(rate), 'scope': 'all workers'})
+    return Response(metrics.profile_report(), mimetype='text/plain')
@@ -0,0 +1,437 @@
+import bisect
+import heapq
+import os
+import threading
+from collections import defaultdict
+import numpy as np
+from Main.cache import LRUCache
+from Main.catalog import get_catalog, refresh_index
+from Main.metrics import metrics
+from Main.paging import RESULTS_DEPTH
+from Main.pool import scoring_pool
+from Main.tokens import Vocabulary, TokenSets, GrowableArray, Postings
+
+
+SEARCH_FIELDS = ['title', 'genres', 'overview', 'cast', 'director']
+# Weight of each field's fuzz.partial_ratio in the total score; title counts most
+FIELD_WEIGHTS = {'title': 10, 'genres': 3, 'overview': 1, 'cast': 2, 'director': 2}
+FIELD_WEIGHT_VECTOR = np.array([FIELD_WEIGHTS[field] for field in SEARCH_FIELDS], dtype=np.float64)
+MIN_FIELD_SCORE = 80
+# fuzzywuzzy rounds partial_ratio to an int, so it can be this much above rapidfuzz's raw score
+# (plus a hair, in case rapidfuzz's float comes out an ulp below fuzzywuzzy's)
+ROUNDING_SLACK = 0.5 + 1e-6
+PREFILTER_CUTOFF = MIN_FIELD_SCORE - ROUNDING_SLACK
+# Fields too long to match against every text for each query of a catalog with more than
+# LAZY_SEARCH_ROWS live rows. They count as full matches until a row's bound is the best
+# left, and only then are they matched, row by row; a query that needs that for more than
+# MAX_LAZY_ROWS rows matches every text at once instead, as smaller catalogs always do.
+LAZY_FIELDS = ('overview', 'cast')
+LAZY_COLUMNS = [SEARCH_FIELDS.index(field) for field in LAZY_FIELDS]
+SCANNED_COLUMNS = [i for i, field in enumerate(SEARCH_FIELDS) if field not in LAZY_FIELDS]
+LAZY_SEARCH_ROWS = 20000
+MAX_LAZY_ROWS = 10000
+# rapidfuzz only guarantees the best window when the shorter string has up to this many characters
+EXACT_WINDOW_LEN = 64
+MAX_RESULTS = 20
+# Prefixes up to this length match too many titles to scan, so their best matches are precomputed
+SHORT_PREFIX_LEN = 3
+MAX_SUGGESTIONS = 10
+# Best matches kept per short prefix; the spare ones cover movies deleted since the build
+SHORT_PREFIX_KEEP = 2 * MAX_SUGGESTIONS
+
+# Ranked results per (query, catalog version), so later pages of a search are not rescored
+SEARCH_CACHE_SIZE = int(os.environ.get('SEARCH_CACHE_SIZE', 256))
+SEARCH_CACHE_TTL = float(os.environ.get('SEARCH_CACHE_TTL', 300))
+
+search_cache = LRUCache(SEARCH_CACHE_SIZE, SEARCH_CACHE_TTL)
+metrics.register_cache('search', search_cache)
+# Serializes building and updating this module's indexes; readers never take it
+_index_lock = threading.Lock()
+
+
+def trigrams(text):
+    return {text[i:i + 3] for i in range(len(text) - 2)}
+
+
+class SearchIndex:
+    """
+    The distinct lowercased field texts of the catalog and, per row, the id of each of its
+    field texts. Queries are matched with rapidfuzz's partial_ratio, which takes the best
+    of all windows, including every one fuzzywuzzy tries, so its score bounds fuzzywuzzy's.
+    search() scans the short fields' texts in one vectorized call, counts the LAZY_FIELDS
+    as full matches, and scores rows with fuzzywuzzy best bound first until no remaining
+    row can enter the top `limit`; a row's lazy fields are only matched once its bound is
+    the best left. apply() adds and masks rows in place.
+    """
+
+    def __init__(self, records, version=None, alive=None):
+        self.version = version
+        self.epoch = None
+        self.records = records
+        alive = np.ones(len(records), dtype=bool) if alive is None else alive
+        self.alive = GrowableArray(alive)
+        self.fields = [tuple(records[row][field].lower() for field in SEARCH_FIELDS) for row in range(len(alive))]
+        self.vocabulary = Vocabulary(stable=False)
+        text_ids = np.array([self.vocabulary.add(fields) for fields in self.fields], dtype=np.int32)
+        text_ids = text_ids.reshape(-1, len(SEARCH_FIELDS))
+        self.text_ids = [GrowableArray(text_ids[:, i].copy()) for i in range(len(SEARCH_FIELDS))]
+        # Text of each id; genres and directors repeat a lot, so there are far fewer than fields
+        self.texts = list(self.vocabulary.ids)
+        # Ids of the texts of the fields matched against every query
+        self.scanned = set(np.unique(text_ids[:, SCANNED_COLUMNS]).tolist())
+        self.scanned_ids = GrowableArray(sorted(self.scanned), dtype=np.int64)
+        self.n = len(alive)
+
+    def __len__(self):
+        return self.n
+
+    def apply(self, changes):
+        """Applies catalog row changes [(row, record or None), ...] (see Catalog.changes_since)."""
+        for row, record in changes:
+            if record is None:
+                self.alive[row] = False
+                continue
+            fields = tuple(record[field].lower() for field in SEARCH_FIELDS)
+            self.fields.append(fields)
+            for field, text, text_id, ids in zip(SEARCH_FIELDS, fields, self.vocabulary.add(fields), self.text_ids):
+                # New texts get the next ids, in order
+                if text_id == len(self.texts):
+                    self.texts.append(text)
+                if field not in LAZY_FIELDS and text_id not in self.scanned:
+                    self.scanned.add(text_id)
+                    self.scanned_ids.append(text_id)
+                ids.append(text_id)
+            self.alive.append(True)
+            self.n = row + 1
+
+    def _field_bounds(self, q, ids, cutoff=0):
+        """
+        The highest fuzzywuzzy partial_ratio q can get against each of the texts with ids, or 0
+        where rapidfuzz's score is below cutoff; a text is taken as a full match only when it
+        and q are both longer than EXACT_WINDOW_LEN.
+        """
+        from rapidfuzz import fuzz, process
+        texts = [self.texts[i] for i in ids]
+        scores = process.cdist([q], texts, scorer=fuzz.partial_ratio, score_cutoff=cutoff, dtype=np.float64)[0]
+        if len(q) > EXACT_WINDOW_LEN:
+            scores[np.fromiter(map(len, texts), dtype=np.int64, count=len(texts)) > EXACT_WINDOW_LEN] = 100
+        # fuzzywuzzy rounds to an int, so it can come out up to half a point above rapidfuzz
+        return np.where(scores > 0, np.minimum(scores + ROUNDING_SLACK, 100), 0)
+
+    def candidates(self, query):
+        """
+        (rows, bounds): the live rows with a field that can reach MIN_FIELD_SCORE, in catalog
+        order, and the highest total score() each can have, from every field of every text.
+        """
+        q = query.lower()
+        n = self.n
+        num_texts = len(self.texts)
+        bounds = self._field_bounds(q, range(num_texts), cutoff=PREFILTER_CUTOFF)
+        passing = bounds > 0
+        text_ids = np.stack([ids.view()[:n] for ids in self.text_ids], axis=1)
+        rows = np.flatnonzero(passing[text_ids].any(axis=1) & self.alive.view()[:n])
+        text_ids = text_ids[rows]
+        # The other fields of those rows still add to their totals, so they are matched without the cutoff
+        failing = np.unique(text_ids[~passing[text_ids]])
+        if len(failing):
+            bounds[failing] = self._field_bounds(q, failing.tolist())
+        return rows, bounds[text_ids] @ FIELD_WEIGHT_VECTOR
+
+    def score(self, query, row):
+        """Weighted partial_ratio score of row, or None if no field reaches MIN_FIELD_SCORE."""
+        from fuzzywuzzy import fuzz
+        q = query.lower()
+        scores = [fuzz.partial_ratio(q, text) for text in self.fields[row]]
+        if max(scores) < MIN_FIELD_SCORE:
+            return None
+        return sum(FIELD_WEIGHTS[field] * score for field, score in zip(SEARCH_FIELDS, scores))
+
+    def search(self, query, limit=MAX_RESULTS):
+        """Returns [(row, score), ...] best first, ties in catalog order."""
+        if limit <= 0:
+            return []
+        n = self.n
+        rows = np.flatnonzero(self.alive.view()[:n])
+        if len(rows) > LAZY_SEARCH_ROWS:
+            results = self._lazy_search(query, n, rows, limit)
+            if results is not None:
+                return results
+            # Too many rows had to match their long fields one by one
+            metrics.count('search_full_scan')
+        with metrics.timer('search_candidates'):
+            rows, bounds = self.candidates(query)
+        with metrics.timer('search_scoring'):
+            return self._best(query, rows, bounds, limit)
+
+    def _lazy_search(self, query, n, rows, limit):
+        """search() over the live rows among the first n, matching only the short fields up front, or None."""
+        q = query.lower()
+        with metrics.timer('search_candidates'):
+            text_ids = np.stack([ids.view()[:n] for ids in self.text_ids], axis=1)[rows]
+            scanned_ids = self.scanned_ids.view()
+            bounds = np.zeros(len(self.texts))
+            bounds[scanned_ids] = self._field_bounds(q, scanned_ids.tolist())
+            scanned_bounds = bounds[text_ids[:, SCANNED_COLUMNS]]
+            scanned_total = scanned_bounds @ FIELD_WEIGHT_VECTOR[SCANNED_COLUMNS]
+            lazy = (scanned_total, scanned_bounds.max(axis=1), text_ids[:, LAZY_COLUMNS])
+        with metrics.timer('search_scoring'):
+            return self._best(query, rows, scanned_total + 100 * FIELD_WEIGHT_VECTOR[LAZY_COLUMNS].sum(), limit, lazy)
+
+    def _best(self, query, rows, bounds, limit, lazy=None):
+        """
+        The best `limit` rows as [(row, score), ...], scoring them with fuzzywuzzy best bound
+        first (ties in catalog order): once a bound cannot beat the weakest result kept,
+        neither can any bound after it. With lazy = (total and best field bound of the
+        scanned fields, LAZY_FIELDS text ids) per row, bounds count the lazy fields as full
+        matches: such a row first has them matched and goes back in line with its tighter
+        bound. Returns None when more than MAX_LAZY_ROWS rows needed that.
+        """
+        from rapidfuzz import fuzz
+        q = query.lower()
+        order = np.lexsort((rows, -bounds)).tolist()
+        rows, bounds = rows.tolist(), bounds.tolist()
+        if lazy is not None:
+            scanned_total, scanned_max, lazy_ids = lazy[0].tolist(), lazy[1].tolist(), lazy[2]
+            lazy_weights = FIELD_WEIGHT_VECTOR[LAZY_COLUMNS].tolist()
+        lazy_bounds, lazy_rows = {}, 0
+        # Max-heaps of (-bound, row) for rows with their lazy fields matched, and of (score, -row)
+        # for the results, whose first entry is the weakest one kept
+        matched, kept = [], []
+        position = 0
+        while position < len(order) or matched:
+            if position < len(order):
+                i = order[position]
+                bound, row = bounds[i], rows[i]
+            if matched and (position == len(order) or (-matched[0][0], -matched[0][1]) > (bound, -row)):
+                neg_bound, row = heapq.heappop(matched)
+                bound, is_lazy = -neg_bound, False
+            else:
+                position += 1
+                is_lazy = lazy is not None
+            if len(kept) == limit and (bound, -row) < kept[0]:
+                break
+            if is_lazy:
+                lazy_rows += 1
+                if lazy_rows > MAX_LAZY_ROWS:
+                    return None
+                bound, best = scanned_total[i], scanned_max[i]
+                for weight, text_id in zip(lazy_weights, lazy_ids[i].tolist()):
+                    field_bound = lazy_bounds.get(text_id)
+                    if field_bound is None:
+                        text = self.texts[text_id]
+                        if len(q) > EXACT_WINDOW_LEN and len(text) > EXACT_WINDOW_LEN:
+                            field_bound = 100
+                        else:
+                            field_bound = min(fuzz.partial_ratio(q, text) + ROUNDING_SLACK, 100)
+                        lazy_bounds[text_id] = field_bound
+                    bound += weight * field_bound
+                    best = max(best, field_bound)
+                if best >= MIN_FIELD_SCORE:
+                    heapq.heappush(matched, (-bound, row))
+                continue
+            total_score = self.score(query, row)
+            if total_score is None:
+                continue
+            if len(kept) < limit:
+                heapq.heappush(kept, (total_score, -row))
+            elif (total_score, -row) > kept[0]:
+                heapq.heapreplace(kept, (total_score, -row))
+        return [(-row, total_score) for total_score, row in sorted(kept, reverse=True)]
+
+
+def normalize_title(title):
+    return ' '.join(str(title).lower().split())
+
+
+def _rank_key(movie_id, row):
+    # IMDb top-1000 ids follow the chart order, so a lower numeric id is the more popular title
+    movie_id = str(movie_id)
+    return (0, int(movie_id), '', row) if movie_id.isdigit() else (1, 0, movie_id, row)
+
+
+class TitleIndex:
+    """
+    Normalized title lookup for the recommender. Matches are ranked exact first, then
+    prefix, then substring; ties go to the lower (more popular) movie_id. Titles uploaded
+    after the build go to a small sorted list next to the main one, and deleted rows are
+    skipped at lookup (see apply()).
+    """
+
+    def __init__(self, records, version=None, alive=None):
+        self.version = version
+        self.epoch = None
+        self.records = records
+        alive = np.ones(len(records), dtype=bool) if alive is None else alive
+        self.alive = GrowableArray(alive)
+        n = len(alive)
+        self.titles = [normalize_title(records[row]['title']) for row in range(n)]
+        self.ranks = [_rank_key(records[row]['movie_id'], row) for row in range(n)]
+        live = np.flatnonzero(alive).tolist()
+
+        self.exact = {}
+        for row in sorted(live, key=self.ranks.__getitem__):
+            self.exact.setdefault(self.titles[row], row)
+
+        # Titles sorted alphabetically, so each prefix is one contiguous bisect range
+        self.sorted_rows = sorted(live, key=lambda row: (self.titles[row], self.ranks[row]))
+        self.sorted_titles = [self.titles[row] for row in self.sorted_rows]
+        # (title, rank, row) for rows added since, in the same order
+        self.added = []
+
+        short = defaultdict(list)
+        for row in live:
+            title = self.titles[row]
+            for length in range(1, min(SHORT_PREFIX_LEN, len(title)) + 1):
+                short[title[:length]].append(row)
+        self.vocabulary = Vocabulary(stable=False)
+        grams = TokenSets.build((trigrams(title) for title in self.titles), self.vocabulary)
+        self.postings = Postings(grams.invert(len(self.vocabulary)))
+        self.short_prefixes = {
+            prefix: heapq.nsmallest(SHORT_PREFIX_KEEP, rows, key=self.ranks.__getitem__)
+            for prefix, rows in short.items()
+        }
+        self.n = n
+
+    def __len__(self):
+        return self.n
+
+    def apply(self, changes):
+        """Applies catalog row changes [(row, record or None), ...] (see Catalog.changes_since)."""
+        for row, record in changes:
+            if record is None:
+                self._remove(row)
+            else:
+                self._add(row, record)
+
+    def _add(self, row, record):
+        title = normalize_title(record['title'])
+        rank = _rank_key(record['movie_id'], row)
+        self.titles.append(title)
+        self.ranks.append(rank)
+        self.postings.add(row, self.vocabulary.add(trigrams(title)))
+        self.alive.append(True)
+        self.n = row + 1
+        bisect.insort(self.added, (title, rank, row))
+        current = self.exact.get(title)
+        if current is None or rank < self.ranks[current]:
+            self.exact[title] = row
+        for length in range(1, min(SHORT_PREFIX_LEN, len(title)) + 1):
+            rows = self.short_prefixes.setdefault(title[:length], [])
+            bisect.insort(rows, row, key=self.ranks.__getitem__)
+            del rows[SHORT_PREFIX_KEEP:]
+
+    def _remove(self, row):
+        self.alive[row] = False
+        title = self.titles[row]
+        if self.exact.get(title) != row:
+            return
+        # Next best live row with the same title, if any
+        lo = bisect.bisect_left(self.sorted_titles, title)
+        hi = bisect.bisect_right(self.sorted_titles, title, lo)
+        same = self.sorted_rows[lo:hi] + [other for _, _, other in self._added_range(title, title + '\0')]
+        live = [other for other in same if self.alive[other]]
+        if live:
+            self.exact[title] = min(live, key=self.ranks.__getitem__)
+        else:
+            del self.exact[title]
+
+    def _added_range(self, lo_title, hi_title):
+        lo = bisect.bisect_left(self.added, (lo_title,))
+        hi = bisect.bisect_left(self.added, (hi_title,), lo)
+        return self.added[lo:hi]
+
+    def _prefix_rows(self, text, limit):
+        alive = self.alive.view()
+        if len(text) <= SHORT_PREFIX_LEN:
+            kept = self.short_prefixes.get(text, [])
+            rows = [row for row in kept if alive[row]]
+            # A list shorter than SHORT_PREFIX_KEEP holds every title with the prefix
+            if len(rows) >= limit or len(kept) < SHORT_PREFIX_KEEP:
+                return rows[:limit]
+        lo = bisect.bisect_left(self.sorted_titles, text)
+        hi = bisect.bisect_left(self.sorted_titles, text + '\uffff', lo)
+        rows = self.sorted_rows[lo:hi] + [row for _, _, row in self._added_range(text, text + '\uffff')]
+        return heapq.nsmallest(limit, (row for row in rows if alive[row]), key=self.ranks.__getitem__)
+
+    def _substring_rows(self, text, limit):
+        n = self.n
+        alive = self.alive.view()[:n]
+        grams = trigrams(text)
+        if grams:
+            ids = self.vocabulary.lookup(grams)
+            if len(ids) < len(grams):
+                return []
+            # Live rows listed under every one of the query's trigrams
+            rows = np.flatnonzero((self.postings.count_hits(ids, n) == len(ids)) & alive).tolist()
+        else:
+            rows = np.flatnonzero(alive).tolist()
+        matches = (row for row in rows if text in self.titles[row])
+        return heapq.nsmallest(limit, matches, key=self.ranks.__getitem__)
+
+    def suggest(self, text, limit=MAX_SUGGESTIONS):
+        """Returns up to `limit` rows matching text, best match first."""
+        text = normalize_title(text)
+        if not text:
+            return []
+        rows = []
+        if text in self.exact:
+            rows.append(self.exact[text])
+        for matcher in (self._prefix_rows, self._substring_rows):
+            if len(rows) >= limit:
+                break
+            for row in matcher(text, limit + len(rows)):
+                if row not in rows:
+                    rows.append(row)
+        return rows[:limit]
+
+    def resolve(self, text):
+        """Returns the row of the best matching title, or None."""
+        rows = self.suggest(text, limit=1)
+        return rows[0] if rows else None
+
+
+_search_index = None
+_title_index = None
+
+
+def get_search_index():
+    """Returns the search index for the current catalog, applying uploads and deletes to it in place."""
+    global _search_index
+    with _index_lock:
+        _search_index = refresh_index(
+            _search_index, lambda snapshot: SearchIndex(snapshot.records, alive=snapshot.alive),
+            'search_index_build')
+        return _search_index
+
+
+def get_title_index():
+    """Returns the title index for the current catalog, applying uploads and deletes to it in place."""
+    global _title_index
+    with _index_lock:
+        _title_index = refresh_index(
+            _title_index, lambda snapshot: TitleIndex(snapshot.records, alive=snapshot.alive),
+            'title_index_build')
+        return _title_index
+
+
+def search_movies(query, limit=MAX_RESULTS):
+    """
+    Returns [(movie record copy, score), ...] best first. Records rather than rows are
+    returned, so the result stays valid when computed in a scoring pool process.
+    """
+    index = get_search_index()
+    return [(dict(index.records[row]), score) for row, score in index.search(query, limit)]
+
+
+def ranked_search(query):
+    """
+    The best RESULTS_DEPTH [(movie record, score), ...] for query. Scored in the scoring pool
+    on first use, then served from search_cache until the catalog changes, so each further
+    page is a slice. Raises ScoringBusy when the pool is overloaded.
+    """
+    key = (query.lower(), get_catalog().version)
+    ranked = search_cache.get(key)
+    if ranked is None:
+        ranked = scoring_pool.run(search_movies, query, RESULTS_DEPTH)
+        search_cache.set(key, ranked)
+    return ranked
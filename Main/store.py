@@ -0,0 +1,143 @@
+import csv
+import json
+import os
+import threading
+from Main.catalog import (
+    Catalog, GenerationCounter, catalog_lock, MOVIES_CSV, IMAGES_CSV, CATALOG_BIN, CATALOG_LOG,
+    CATALOG_LOCK, CATALOG_GENERATION, MOVIE_COLUMNS, compaction_paths
+)
+from Main.columnar import write_columnar
+
+
+# Compact the log into the CSVs once it grows past this many bytes
+COMPACT_LOG_BYTES = int(os.environ.get('CATALOG_COMPACT_LOG_BYTES', 256 * 1024))
+
+
+class CatalogChanged(Exception):
+    """A conditional write found the catalog changed since the generation it was checked at."""
+
+
+def _fsync_dir(path):
+    if not hasattr(os, 'O_DIRECTORY'):
+        return
+    fd = os.open(os.path.dirname(path) or '.', os.O_RDONLY | os.O_DIRECTORY)
+    try:
+        os.fsync(fd)
+    finally:
+        os.close(fd)
+
+
+def _write_csv_atomic(path, header, rows):
+    tmp_path = path + '.tmp'
+    with open(tmp_path, 'w', newline='', encoding='utf-8') as f:
+        csv_writer = csv.writer(f)
+        csv_writer.writerow(header)
+        csv_writer.writerows(rows)
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(tmp_path, path)
+
+
+class CatalogStore:
+    """
+    Write path for the movie catalog. Uploads and deletes are single fsync'd lines appended
+    to catalog.log under an exclusive file lock, so concurrent workers never interleave or
+    lose rows and a delete no longer rewrites the CSVs. compact() folds the log back into
+    movies.csv / movie_images.csv (and catalog.bin when one is deployed) with atomic
+    replaces; Catalog readers apply the log on top of whichever base they loaded, and
+    follow a compaction of it without reloading (see Catalog._follow_compaction()). Every
+    append and compaction bumps the shared generation before the lock is released, which
+    is how workers learn that there is something new to read.
+    """
+
+    def __init__(self, movies_path=MOVIES_CSV, images_path=IMAGES_CSV, binary_path=CATALOG_BIN,
+                 log_path=CATALOG_LOG, lock_path=CATALOG_LOCK, generation_path=CATALOG_GENERATION,
+                 compact_log_bytes=COMPACT_LOG_BYTES):
+        self.movies_path = movies_path
+        self.images_path = images_path
+        self.binary_path = binary_path
+        self.log_path = log_path
+        self.lock_path = lock_path
+        self.generation_path = generation_path
+        self.generation = GenerationCounter(generation_path)
+        self.compact_log_bytes = compact_log_bytes
+        self._compacting = threading.Lock()
+
+    def _append(self, operations, generation=None):
+        lines = ''.join(json.dumps(op) + '\n' for op in operations).encode('utf-8')
+        with catalog_lock(path=self.lock_path):
+            if generation is not None and self.generation.read() != generation:
+                raise CatalogChanged()
+            with open(self.log_path, 'a+b') as f:
+                # Readers resume from the end of the last complete line, so finish a torn one
+                if f.seek(0, os.SEEK_END):
+                    f.seek(-1, os.SEEK_END)
+                    if f.read(1) != b'\n':
+                        lines = b'\n' + lines
+                f.write(lines)
+                f.flush()
+                os.fsync(f.fileno())
+                log_size = f.tell()
+            self.generation.bump()
+        if self.compact_log_bytes and log_size >= self.compact_log_bytes:
+            self.compact_in_background()
+
+    def upsert(self, movie):
+        """Adds or replaces a movie; `movie` holds MOVIE_COLUMNS plus image_url."""
+        self.upsert_many([movie])
+
+    def upsert_many(self, movies, generation=None):
+        """
+        Adds or replaces several movies with one locked, fsync'd append. With a generation
+        (Catalog.generation), raises CatalogChanged instead when anything was written since,
+        so checks made against that catalog state still hold when the movies land.
+        """
+        operations = []
+        for movie in movies:
+            record = {col: str(movie.get(col, '') or '').strip() for col in MOVIE_COLUMNS + ['image_url']}
+            operations.append({'op': 'upsert', 'movie': record})
+        if operations:
+            self._append(operations, generation)
+
+    def delete(self, movie_id):
+        """Records a tombstone for movie_id; O(1) regardless of catalog size."""
+        self._append([{'op': 'delete', 'movie_id': str(movie_id).strip()}])
+
+    def compact(self):
+        """Rewrites the base files with the log applied and empties the log. Returns the movie count."""
+        with self._compacting:
+            with catalog_lock(path=self.lock_path):
+                if not os.path.exists(self.log_path) or os.path.getsize(self.log_path) == 0:
+                    return None
+                # The exclusive lock is already held, so the snapshot loads without the shared one
+                snapshot = Catalog(self.movies_path, self.images_path, self.binary_path,
+                                   log_path=self.log_path, lock_path=None,
+                                   generation_path=self.generation_path).refresh()
+                records = list(snapshot.records)
+
+                _write_csv_atomic(self.movies_path, MOVIE_COLUMNS,
+                                  ([r[col] for col in MOVIE_COLUMNS] for r in records))
+                _write_csv_atomic(self.images_path, ['movie_id', 'title', 'image_url'],
+                                  ([r['movie_id'], r['title'], r['image_url']] for r in records))
+                if self.binary_path and os.path.exists(self.binary_path):
+                    write_columnar(records, self.binary_path)
+                # Replaying the log twice is harmless, so it is moved aside only after the new base
+                # is in place; readers finish the lines they had not read from there
+                folded_log, marker_path = compaction_paths(self.log_path)
+                os.replace(self.log_path, folded_log)
+                with open(marker_path + '.tmp', 'w', encoding='utf-8') as f:
+                    json.dump({'read': snapshot.loaded_base_stamp, 'written': snapshot.base_file_stamp()}, f)
+                    f.flush()
+                    os.fsync(f.fileno())
+                os.replace(marker_path + '.tmp', marker_path)
+                _fsync_dir(self.movies_path)
+                self.generation.bump()
+                return len(records)
+
+    def compact_in_background(self):
+        if self._compacting.locked():
+            return
+        threading.Thread(target=self.compact, daemon=True).start()
+
+
+store = CatalogStore()
@@ -0,0 +1,187 @@
+from array import array
+import numpy as np
+
+
+class Vocabulary:
+    """
+    Interns string tokens to dense int32 ids. With stable=True a row's new tokens are added
+    in sorted order, so ids depend only on the catalog and match in every worker (MinHash
+    signatures rely on this); otherwise they follow set iteration order, which is cheaper.
+    """
+
+    def __init__(self, stable=True):
+        self.ids = {}
+        self.stable = stable
+
+    def __len__(self):
+        return len(self.ids)
+
+    def add(self, tokens):
+        """Returns the ids of tokens (in no particular order), interning the new ones."""
+        ids = self.ids
+        tokens = sorted(tokens) if self.stable else list(tokens)
+        found = list(map(ids.get, tokens))
+        if None in found:
+            for i, token in enumerate(tokens):
+                if found[i] is None:
+                    found[i] = ids.setdefault(token, len(ids))
+        return found
+
+    def lookup(self, tokens):
+        """Returns the sorted int32 ids of the tokens already in the vocabulary; unknown ones are skipped."""
+        ids = self.ids
+        return np.array(sorted({ids[t] for t in tokens if t in ids}), dtype=np.int32)
+
+
+class TokenSets:
+    """
+    Many sorted int32 id sets in one contiguous array: set i is values[offsets[i]:offsets[i + 1]].
+    Used for each movie's token ids and, inverted, for each token's posting list of rows.
+    """
+
+    def __init__(self, values, offsets):
+        self.values = values
+        self.offsets = offsets
+        self.sizes = np.diff(offsets)
+
+    @classmethod
+    def build(cls, token_sets, vocabulary):
+        """Encodes an iterable of string token sets with vocabulary (which grows as needed)."""
+        values, offsets = array('i'), [0]
+        for tokens in token_sets:
+            values.extend(vocabulary.add(tokens))
+            offsets.append(len(values))
+        values = np.frombuffer(values, dtype=np.int32).astype(np.int64)
+        offsets = np.array(offsets, dtype=np.int64)
+        # Sort every set at once: key = row * vocabulary size + id
+        rows = np.repeat(np.arange(len(offsets) - 1, dtype=np.int64), np.diff(offsets))
+        keys = rows * max(len(vocabulary), 1) + values
+        keys.sort()
+        return cls((keys - rows * max(len(vocabulary), 1)).astype(np.int32), offsets)
+
+    def __len__(self):
+        return len(self.offsets) - 1
+
+    def __getitem__(self, i):
+        return self.values[self.offsets[i]:self.offsets[i + 1]]
+
+    @property
+    def nbytes(self):
+        return self.values.nbytes + self.offsets.nbytes
+
+    def invert(self, num_ids):
+        """Returns the id -> rows TokenSets (posting lists); rows come out ascending."""
+        n = max(len(self), 1)
+        rows = np.repeat(np.arange(len(self), dtype=np.int64), self.sizes)
+        # Sorting id * rows + row groups rows by id, ascending within each id
+        keys = self.values.astype(np.int64) * n + rows
+        keys.sort()
+        rows = (keys % n).astype(np.int32)
+        counts = np.bincount(self.values, minlength=num_ids)
+        offsets = np.zeros(num_ids + 1, dtype=np.int64)
+        np.cumsum(counts, out=offsets[1:])
+        return TokenSets(rows, offsets)
+
+    def gather(self, ids):
+        """Concatenation of the sets for ids (e.g. all posting lists of a query's tokens)."""
+        if len(ids) == 0:
+            return np.zeros(0, dtype=self.values.dtype)
+        return np.concatenate([self[i] for i in ids])
+
+    def count_hits(self, ids, length):
+        """For posting lists: how many of ids each of `length` rows appears under, as an int64 array."""
+        return np.bincount(self.gather(ids), minlength=length)
+
+
+class GrowableArray:
+    """1-d numpy array with amortized O(1) append; view() is the filled part."""
+
+    def __init__(self, values, dtype=None):
+        self._data = np.asarray(values, dtype=dtype)
+        self._size = len(self._data)
+
+    def __len__(self):
+        return self._size
+
+    def __getitem__(self, i):
+        return self.view()[i]
+
+    def __setitem__(self, i, value):
+        self.view()[i] = value
+
+    def append(self, value):
+        if self._size == len(self._data):
+            grown = np.empty(max(16, 2 * self._size), dtype=self._data.dtype)
+            grown[:self._size] = self._data
+            self._data = grown
+        self._data[self._size] = value
+        self._size += 1
+
+    def view(self):
+        return self._data[:self._size]
+
+
+class GrowingTokenSets:
+    """A TokenSets plus sets appended after it was built, e.g. for movies uploaded since."""
+
+    def __init__(self, base):
+        self.base = base
+        self.extra = []
+        self.sizes = GrowableArray(base.sizes)
+
+    def __len__(self):
+        return len(self.base) + len(self.extra)
+
+    def __getitem__(self, i):
+        return self.base[i] if i < len(self.base) else self.extra[i - len(self.base)]
+
+    @property
+    def nbytes(self):
+        return self.base.nbytes + sum(ids.nbytes for ids in self.extra)
+
+    def append(self, ids):
+        """Adds the next set; ids must be a sorted, duplicate-free int32 array."""
+        self.extra.append(ids)
+        self.sizes.append(len(ids))
+
+    def compacted(self, n=None):
+        """The first n sets (default: all) as one contiguous TokenSets."""
+        n = len(self) if n is None else n
+        n_base = min(n, len(self.base))
+        extra = self.extra[:n - n_base]
+        if not extra:
+            return TokenSets(self.base.values[:self.base.offsets[n_base]], self.base.offsets[:n_base + 1])
+        values = np.concatenate([self.base.values[:self.base.offsets[n_base]]] + extra)
+        ends = self.base.offsets[n_base] + np.cumsum([len(ids) for ids in extra])
+        return TokenSets(values, np.concatenate([self.base.offsets[:n_base + 1], ends]))
+
+
+class Postings:
+    """
+    Posting lists built in one go (an inverted TokenSets) plus the rows added since, kept in
+    a list per token id. Deleted rows stay listed; indexes mask them when scoring.
+    """
+
+    def __init__(self, base):
+        self.base = base
+        self.extra = {}
+
+    def add(self, row, ids):
+        for i in ids:
+            self.extra.setdefault(int(i), []).append(row)
+
+    def count_hits(self, ids, length):
+        """How many of ids each of the first `length` rows appears under, as an int64 array."""
+        ids = np.asarray(ids, dtype=np.int64)
+        # Tokens interned after the build have no base list
+        hits = self.base.count_hits(ids[ids < len(self.base)], length)
+        if self.extra:
+            rows = [row for i in ids.tolist() for row in self.extra.get(i, ())]
+            if rows:
+                hits += np.bincount(np.array(rows, dtype=np.int64), minlength=length)[:length]
+        return hits[:length]
+
+
+def intersection_size(a, b):
+    """|a ∩ b| for two sorted, duplicate-free id arrays."""
+    return len(np.intersect1d(a, b, assume_unique=True))
@@ -0,0 +1,58 @@
+import os
+import time
+from Main.metrics import metrics
+
+
+# Set to 0 to leave every index to be built on first use, as in development
+WARM_INDEXES = os.environ.get('WARM_INDEXES', '1').lower() in ('1', 'true')
+
+
+def _steps():
+    from Main.catalog import get_catalog
+    from Main.recomm import get_jaccard_index, get_sparse_index, get_neighbour_table, get_card_deck
+    from Main.search import get_search_index, get_title_index
+    return {
+        'catalog': get_catalog,
+        'title_index': get_title_index,
+        'search_index': get_search_index,
+        'jaccard_index': get_jaccard_index,
+        'sparse_index': get_sparse_index,
+        'neighbour_table': get_neighbour_table,
+        'card_deck': get_card_deck,
+    }
+
+
+# What scoring pool processes need for _score_live and search_movies
+SCORING_STEPS = ('catalog', 'title_index', 'search_index', 'jaccard_index')
+
+
+def warm_indexes(names=None):
+    """
+    Loads the catalog and builds (or maps) the indexes in `names` (default: all of them), so
+    no request pays for them. Returns [(name, seconds), ...], also recorded as warmup_* stages.
+    """
+    steps = _steps()
+    timings = []
+    for name in names or steps:
+        start = time.perf_counter()
+        steps[name]()
+        seconds = time.perf_counter() - start
+        metrics.observe('warmup_' + name, seconds)
+        timings.append((name, seconds))
+    return timings
+
+
+def warm_up(log):
+    """
+    Startup warm-up for gunicorn (see gunicorn.conf.py): run in the master with --preload, so
+    the workers it forks share everything built here copy-on-write, otherwise in each worker
+    before it accepts requests. Logs how long the app import and each step took.
+    """
+    from Main import IMPORT_SECONDS
+    log.info("Imported the app in %.2fs", IMPORT_SECONDS)
+    if not WARM_INDEXES:
+        return
+    start = time.perf_counter()
+    timings = warm_indexes()
+    log.info("Warmed indexes in %.2fs (%s)", time.perf_counter() - start,
+             ', '.join(f'{name} {seconds:.2f}s' for name, seconds in timings))
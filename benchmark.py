@@ -0,0 +1,261 @@
+import argparse
+import json
+import os
+import random
+import subprocess
+import sys
+import tempfile
+import time
+from collections import Counter
+import numpy as np
+import pandas as pd
+
+# Offline benchmark for the recommender, search, home page and catalog write paths on
+# synthetic catalogs. Each size runs in its own process so peak RSS is per catalog size.
+#
+#   python benchmark.py --sizes 1000,10000 --output bench.json
+#   python benchmark.py --sizes 1000,10000 --baseline benchmark_baseline.json   # exit 1 on regression
+
+SOURCE_CSV = 'imdb_top_1000.csv'
+DEFAULT_SIZES = '1000,10000,100000,1000000'
+
+
+def _pool(values):
+    counts = Counter(v for v in values if v)
+    items = list(counts)
+    weights = np.array([counts[v] for v in items], dtype=np.float64)
+    return items, weights / weights.sum()
+
+
+def load_distributions(path=SOURCE_CSV):
+    """Empirical word/genre/name distributions of the IMDb source, cleaned like cleaning.py does."""
+    df = pd.read_csv(path).dropna(subset=['Series_Title', 'Poster_Link', 'Overview', 'Genre', 'Director'])
+    stars = df[['Star1', 'Star2', 'Star3', 'Star4']].fillna('').values.ravel()
+    return {
+        'title': _pool(w for t in df['Series_Title'] for w in str(t).split()),
+        'title_len': _pool(len(str(t).split()) for t in df['Series_Title']),
+        'overview': _pool(w for o in df['Overview'] for w in str(o).lower().split()),
+        'overview_len': _pool(len(str(o).split()) for o in df['Overview']),
+        'genre': _pool(g for gs in df['Genre'] for g in str(gs).lower().replace(' ', '').split(',')),
+        'star': _pool(stars),
+        'director': _pool(df['Director'].str.strip().str.lower()),
+        'year': _pool(df['Released_Year'].astype(str).str.strip()),
+        'poster': _pool(df['Poster_Link']),
+    }
+
+
+def generate_catalog(size, directory, seed=0):
+    """Writes movies.csv and movie_images.csv with `size` synthetic movies into directory."""
+    dist = load_distributions()
+    rng = np.random.default_rng(seed)
+
+    def draw(name, n):
+        items, p = dist[name]
+        return [items[i] for i in rng.choice(len(items), size=n, p=p)]
+
+    title_lens = draw('title_len', size)
+    overview_lens = draw('overview_len', size)
+    title_words = iter(draw('title', sum(title_lens)))
+    overview_words = iter(draw('overview', sum(overview_lens)))
+    genre_counts = rng.integers(1, 4, size=size)
+    genres = iter(draw('genre', int(genre_counts.sum())))
+    stars = iter(draw('star', size * 4))
+    directors = draw('director', size)
+    years = draw('year', size)
+    posters = draw('poster', size)
+
+    movies, images = [], []
+    for i in range(size):
+        movie_id = str(i + 1)
+        title = ' '.join(next(title_words) for _ in range(title_lens[i]))
+        movies.append({
+            'movie_id': movie_id,
+            'title': title,
+            'genres': ','.join(sorted({next(genres) for _ in range(genre_counts[i])})),
+            'overview': ' '.join(next(overview_words) for _ in range(overview_lens[i])),
+            'cast': ', '.join(next(stars) for _ in range(4)),
+            'director': directors[i],
+            'year': years[i],
+        })
+        images.append({'movie_id': movie_id, 'title': title, 'image_url': posters[i]})
+
+    pd.DataFrame(movies).to_csv(os.path.join(directory, 'movies.csv'), index=False)
+    pd.DataFrame(images).to_csv(os.path.join(directory, 'movie_images.csv'), index=False)
+    return dist
+
+
+def _percentiles(samples):
+    ms = np.array(samples) * 1000
+    return {
+        'n': len(samples),
+        'mean_ms': float(ms.mean()),
+        'p50_ms': float(np.percentile(ms, 50)),
+        'p95_ms': float(np.percentile(ms, 95)),
+        'p99_ms': float(np.percentile(ms, 99)),
+    }
+
+
+def _timed(fn):
+    start = time.perf_counter()
+    fn()
+    return time.perf_counter() - start
+
+
+def run_size(size, iterations, data_dir):
+    """Benchmarks one catalog size inside this process. MOVIE_DATA_DIR must already point at data_dir."""
+    import resource
+    import_seconds = _timed(lambda: __import__('Main'))
+    from Main import app
+    from Main.catalog import get_catalog
+    from Main.pool import scoring_pool
+    from Main.recomm import get_jaccard_index, recom, recommendation_cache, movie_display, get_card_deck
+    from Main.routes import get_movie_details_by_id
+    from Main.search import get_search_index, get_title_index
+    from Main.store import CatalogStore
+
+    rng = random.Random(0)
+    app.config['LOGIN_DISABLED'] = True
+    client = app.test_client()
+
+    build = {
+        'app_import_s': import_seconds,
+        'catalog_load_s': _timed(get_catalog),
+        'jaccard_index_s': _timed(get_jaccard_index),
+        'search_index_s': _timed(get_search_index),
+        'title_index_s': _timed(get_title_index),
+        'card_deck_s': _timed(get_card_deck),
+    }
+
+    # Timed calls go to a started pool, as in a gunicorn worker after post_worker_init
+    scoring_pool.start()
+    deadline = time.monotonic() + 600
+    while not scoring_pool.inline and not scoring_pool.ready and time.monotonic() < deadline:
+        time.sleep(0.05)
+
+    catalog = get_catalog()
+    seeds = [catalog.records[rng.randrange(len(catalog))] for _ in range(iterations)]
+    queries = [rng.choice(seed['title'].split() or ['the']) for seed in seeds]
+    queries = [q if len(q) >= 3 else seed['title'][:10] for q, seed in zip(queries, seeds)]
+
+    def time_each(fn, args):
+        samples = []
+        for arg in args:
+            samples.append(_timed(lambda: fn(arg)))
+        return _percentiles(samples)
+
+    def recom_uncached(title):
+        recommendation_cache.clear()
+        recom(title)
+
+    def search_route(query):
+        response = client.get('/search', query_string={'q': query})
+        assert response.status_code == 200, response.status_code
+
+    paths = {
+        'recom': time_each(recom_uncached, [s['title'] for s in seeds]),
+        'search': time_each(search_route, queries),
+        'movie_display': time_each(lambda _: movie_display(), range(iterations)),
+        'get_movie_details_by_id': time_each(get_movie_details_by_id, [s['movie_id'] for s in seeds]),
+    }
+
+    def refresh_after_write():
+        get_catalog()
+        get_jaccard_index()
+        get_search_index()
+        get_title_index()
+
+    # Writes go through a private store so compaction never kicks in mid-measurement. Each
+    # upload is followed by the catalog and index refresh a worker does on its next request.
+    store = CatalogStore(compact_log_bytes=0)
+    new_movies = [dict(seed, movie_id=f'bench-{i}') for i, seed in enumerate(seeds)]
+    uploads, refreshes = [], []
+    for movie in new_movies:
+        uploads.append(_timed(lambda: store.upsert(movie)))
+        refreshes.append(_timed(refresh_after_write))
+    paths['upload'] = _percentiles(uploads)
+    paths['refresh_after_write'] = _percentiles(refreshes)
+    paths['delete'] = time_each(store.delete, [m['movie_id'] for m in new_movies])
+    build['compact_s'] = _timed(store.compact)
+
+    return {
+        'size': size,
+        'build': build,
+        'paths': paths,
+        'peak_rss_mb': resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024,
+    }
+
+
+def compare(results, baseline, threshold):
+    """Returns the regressions: p95 latencies more than `threshold` (fraction) above the baseline."""
+    regressions = []
+    for size, result in results.items():
+        base = baseline.get(size)
+        if not base:
+            continue
+        for path, stats in result['paths'].items():
+            base_stats = base['paths'].get(path)
+            if base_stats and stats['p95_ms'] > base_stats['p95_ms'] * (1 + threshold):
+                regressions.append(f"{size} {path}: p95 {stats['p95_ms']:.2f} ms vs baseline {base_stats['p95_ms']:.2f} ms")
+        if result['peak_rss_mb'] > base['peak_rss_mb'] * (1 + threshold):
+            regressions.append(f"{size} peak RSS: {result['peak_rss_mb']:.0f} MB vs baseline {base['peak_rss_mb']:.0f} MB")
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark recommender, search and catalog paths on synthetic catalogs.")
+    parser.add_argument('--sizes', default=DEFAULT_SIZES, help="Comma separated catalog sizes.")
+    parser.add_argument('--iterations', type=int, default=100, help="Timed calls per path and size.")
+    parser.add_argument('--output', help="Write results as JSON to this file.")
+    parser.add_argument('--baseline', help="Compare against a stored results file and exit 1 on regression.")
+    parser.add_argument('--threshold', type=float, default=0.25, help="Allowed slowdown over the baseline (0.25 = 25%%).")
+    parser.add_argument('--worker', type=int, help=argparse.SUPPRESS)
+    parser.add_argument('--data-dir', help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.worker:
+        print(json.dumps(run_size(args.worker, args.iterations, args.data_dir)))
+        return
+
+    results = {}
+    for size in (int(s) for s in args.sizes.split(',')):
+        with tempfile.TemporaryDirectory() as data_dir:
+            print(f"Generating {size} movies ...", file=sys.stderr)
+            generate_catalog(size, data_dir)
+            env = dict(os.environ, MOVIE_DATA_DIR=data_dir, DATABASE_URL='sqlite://')
+            # Only stdout (the JSON result) is captured; the worker's stderr, including the
+            # traceback when it fails, goes straight to ours
+            worker = subprocess.run(
+                [sys.executable, os.path.abspath(__file__), '--worker', str(size),
+                 '--iterations', str(args.iterations), '--data-dir', data_dir],
+                env=env, stdout=subprocess.PIPE, text=True,
+                cwd=os.path.dirname(os.path.abspath(__file__))
+            )
+            if worker.returncode:
+                sys.exit(f"Benchmark worker for {size} movies failed with exit status {worker.returncode}.")
+            results[str(size)] = json.loads(worker.stdout.strip().splitlines()[-1])
+
+        result = results[str(size)]
+        print(f"\n{size} movies  (peak RSS {result['peak_rss_mb']:.0f} MB)")
+        for name, seconds in result['build'].items():
+            print(f"  {name:<26}{seconds * 1000:>10.1f} ms")
+        print(f"  {'path':<26}{'p50 ms':>10}{'p95 ms':>10}{'p99 ms':>10}")
+        for path, stats in result['paths'].items():
+            print(f"  {path:<26}{stats['p50_ms']:>10.3f}{stats['p95_ms']:>10.3f}{stats['p99_ms']:>10.3f}")
+
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(results, f, indent=2)
+
+    if args.baseline:
+        with open(args.baseline) as f:
+            regressions = compare(results, json.load(f), args.threshold)
+        if regressions:
+            print("\nPerformance regressions:", file=sys.stderr)
+            for line in regressions:
+                print(f"  {line}", file=sys.stderr)
+            sys.exit(1)
+        print("\nNo regressions against the baseline.")
+
+
+if __name__ == '__main__':
+    main()
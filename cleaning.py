@@ -1,46 +1,235 @@
+import argparse
+import csv
+import json
+import os
+import sys
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
 import pandas as pd
 
-try:
-    print("Loading CSV...")
-    df = pd.read_csv("imdb_top_1000.csv") 
+# Turns an IMDb-style dump into movies.csv and movie_images.csv, then derives catalog.bin
+# and the recommendation neighbour table from them. The source is read in chunks that are
+# normalized in parallel and appended in order, with a checkpoint after every chunk, so
+# memory stays bounded and an interrupted run picks up where it stopped when re-run.
+#
+#   python cleaning.py
+#   python cleaning.py --source dump.csv --output-dir Main --chunksize 200000 --jobs 8
 
-    print("Dropping rows with missing essential data...")
-    df = df.dropna(subset=['Series_Title', 'Poster_Link', 'Overview', 'Genre', 'Director'])
+SOURCE_CSV = 'imdb_top_1000.csv'
+DEFAULT_CHUNKSIZE = 100000
+REQUIRED_COLUMNS = ['Series_Title', 'Poster_Link', 'Overview', 'Genre', 'Director']
+CAST_COLUMNS = ['Star1', 'Star2', 'Star3', 'Star4']
+MOVIES_COLUMNS = ['movie_id', 'title', 'genres', 'overview', 'cast', 'director', 'year']
+IMAGES_COLUMNS = ['movie_id', 'title', 'image_url']
+STATE_FILE = '.cleaning_state.json'
 
-    print("Combining cast columns...")
-    df['cast'] = df[['Star1', 'Star2', 'Star3', 'Star4']].fillna('').agg(', '.join, axis=1)
 
-    print("Cleaning columns...")
-    df['title'] = df['Series_Title'].str.strip()
-    df['genres'] = df['Genre'].str.lower().str.replace(' ', '')
-    df['overview'] = df['Overview'].str.strip().str.lower()
-    df['director'] = df['Director'].str.strip().str.lower()
-    df['year'] = df['Released_Year'].astype(str).str.strip() 
+def normalize_chunk(df):
+    """
+    Drops rows missing essential data and normalizes the rest: cast merged from the star
+    columns, lower-cased genres (without spaces), overview and director, stripped title and
+    year. Returns (movies, images) frames without movie_id, which is assigned in order later.
+    """
+    df = df.dropna(subset=REQUIRED_COLUMNS)
+    stars = df[CAST_COLUMNS].fillna('')
+    movies = pd.DataFrame({
+        'title': df['Series_Title'].str.strip(),
+        'genres': df['Genre'].str.lower().str.replace(' ', ''),
+        'overview': df['Overview'].str.strip().str.lower(),
+        'cast': stars['Star1'] + ', ' + stars['Star2'] + ', ' + stars['Star3'] + ', ' + stars['Star4'],
+        'director': df['Director'].str.strip().str.lower(),
+        'year': df['Released_Year'].astype(str).str.strip(),
+    })
+    images = pd.DataFrame({'title': df['Series_Title'], 'image_url': df['Poster_Link']})
+    return movies, images
 
 
-    print("Assigning numeric movie_id...")
-    df = df.reset_index(drop=True)
-    df['movie_id'] = df.index + 1
+class Checkpoint:
+    """
+    Progress of one ingestion, stored next to the outputs: chunks done, the next movie_id and
+    the size of both partial CSVs after the last complete chunk. Written atomically after the
+    chunk's rows are fsynced, so on resume anything past the recorded sizes is cut off.
+    """
 
-    print("First 5 movie_ids:")
-    print(df['movie_id'].head())
+    def __init__(self, path, source, chunksize):
+        self.path = path
+        st = os.stat(source)
+        self.key = {'source': os.path.abspath(source), 'size': st.st_size, 'mtime_ns': st.st_mtime_ns,
+                    'chunksize': chunksize}
+        self.chunks = 0
+        self.next_id = 1
+        self.sizes = {}
+        self.ingested = False
 
-    print("Saving movies.csv ...")
-    movies_cols = ['movie_id', 'title', 'genres', 'overview', 'cast', 'director', 'year']
-    df[movies_cols].to_csv("movies.csv", index=False)
+    def load(self):
+        """Restores the saved progress if it belongs to the same source and chunk size."""
+        try:
+            with open(self.path) as f:
+                state = json.load(f)
+        except (OSError, ValueError):
+            return False
+        if state.get('key') != self.key:
+            return False
+        self.chunks, self.next_id = state['chunks'], state['next_id']
+        self.sizes, self.ingested = state['sizes'], state['ingested']
+        return True
 
-    # Prepare poster dataset with movie_id
-    posters_df = df[['movie_id', 'Series_Title', 'Poster_Link']].rename(columns={
-        'Series_Title': 'title',
-        'Poster_Link': 'image_url'
-    })
+    def save(self):
+        tmp_path = self.path + '.tmp'
+        with open(tmp_path, 'w') as f:
+            json.dump({'key': self.key, 'chunks': self.chunks, 'next_id': self.next_id,
+                       'sizes': self.sizes, 'ingested': self.ingested}, f)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp_path, self.path)
+
+    def clear(self):
+        if os.path.exists(self.path):
+            os.remove(self.path)
+
+
+class PartialOutputs:
+    """movies.csv and movie_images.csv being written as <name>.partial, renamed when complete."""
+
+    def __init__(self, output_dir):
+        self.paths = {
+            'movies': os.path.join(output_dir, 'movies.csv'),
+            'images': os.path.join(output_dir, 'movie_images.csv'),
+        }
+        self.columns = {'movies': MOVIES_COLUMNS, 'images': IMAGES_COLUMNS}
+
+    def start(self):
+        for name, path in self.paths.items():
+            with open(path + '.partial', 'w', newline='', encoding='utf-8') as f:
+                pd.DataFrame(columns=self.columns[name]).to_csv(f, index=False)
+        return self.sizes()
+
+    def truncate(self, sizes):
+        for name, path in self.paths.items():
+            with open(path + '.partial', 'r+b') as f:
+                f.truncate(sizes[name])
+
+    def append(self, frames):
+        for name, frame in frames.items():
+            with open(self.paths[name] + '.partial', 'a', newline='', encoding='utf-8') as f:
+                frame[self.columns[name]].to_csv(f, index=False, header=False)
+                f.flush()
+                os.fsync(f.fileno())
+        return self.sizes()
+
+    def sizes(self):
+        return {name: os.path.getsize(path + '.partial') for name, path in self.paths.items()}
+
+    def finish(self):
+        for path in self.paths.values():
+            os.replace(path + '.partial', path)
+
+
+def ingest(source, output_dir, chunksize=DEFAULT_CHUNKSIZE, jobs=None, restart=False):
+    """
+    Writes movies.csv and movie_images.csv for `source`. movie_ids are numbered 1, 2, ...
+    in source order over the rows that are kept, so they never collide across chunks.
+    At most 2 * jobs chunks are read ahead of the writer. Returns the number of movies.
+    """
+    jobs = jobs or os.cpu_count() or 1
+    checkpoint = Checkpoint(os.path.join(output_dir, STATE_FILE), source, chunksize)
+    outputs = PartialOutputs(output_dir)
+    if not restart and checkpoint.load():
+        if checkpoint.ingested:
+            return checkpoint.next_id - 1
+        print(f"Resuming after {checkpoint.chunks} chunks ({checkpoint.next_id - 1} movies) ...")
+        outputs.truncate(checkpoint.sizes)
+    else:
+        checkpoint.sizes = outputs.start()
+        checkpoint.save()
 
-    print("Saving movie_images.csv ...")
-    posters_df.to_csv("movie_images.csv", index=False)
+    def write(result, chunk_number):
+        movies, images = result
+        ids = range(checkpoint.next_id, checkpoint.next_id + len(movies))
+        movies.insert(0, 'movie_id', ids)
+        images.insert(0, 'movie_id', ids)
+        checkpoint.sizes = outputs.append({'movies': movies, 'images': images})
+        checkpoint.next_id += len(movies)
+        checkpoint.chunks = chunk_number + 1
+        checkpoint.save()
+        print(f"  chunk {chunk_number + 1}: {checkpoint.next_id - 1} movies so far")
 
+    # Text columns only, so every chunk parses the same way whatever values it happens to hold
+    reader = pd.read_csv(source, dtype=str, chunksize=chunksize)
+    chunks = ((number, chunk) for number, chunk in enumerate(reader) if number >= checkpoint.chunks)
+    if jobs <= 1:
+        for number, chunk in chunks:
+            write(normalize_chunk(chunk), number)
+    else:
+        with ProcessPoolExecutor(jobs) as pool:
+            pending = deque()
+            for number, chunk in chunks:
+                pending.append((pool.submit(normalize_chunk, chunk), number))
+                if len(pending) >= 2 * jobs:
+                    future, done_number = pending.popleft()
+                    write(future.result(), done_number)
+            while pending:
+                future, done_number = pending.popleft()
+                write(future.result(), done_number)
+
+    outputs.finish()
+    checkpoint.ingested = True
+    checkpoint.save()
+    return checkpoint.next_id - 1
+
+
+def iter_records(movies_path, images_path):
+    """Streams catalog records (movie columns plus image_url) from the two CSVs ingest() wrote."""
+    with open(movies_path, newline='', encoding='utf-8') as movies_file, \
+            open(images_path, newline='', encoding='utf-8') as images_file:
+        for movie, image in zip(csv.DictReader(movies_file), csv.DictReader(images_file)):
+            if movie['movie_id'] != image['movie_id']:
+                raise ValueError(f"{images_path} is out of step with {movies_path} at movie_id {movie['movie_id']}.")
+            record = {column: movie[column] for column in MOVIES_COLUMNS}
+            record['movie_id'] = record['movie_id'].strip()
+            record['image_url'] = image['image_url'].strip()
+            yield record
+
+
+def build_derived(output_dir):
+    """Writes catalog.bin from the CSVs and the neighbour table from catalog.bin (mapped, not loaded)."""
+    from Main.columnar import ColumnarCatalog, write_columnar
+    from Main.recomm import build_neighbour_table, NEIGHBOURS_K
+    catalog_bin = os.path.join(output_dir, 'catalog.bin')
+
+    print("Saving columnar catalog.bin ...")
+    write_columnar(iter_records(os.path.join(output_dir, 'movies.csv'),
+                                os.path.join(output_dir, 'movie_images.csv')), catalog_bin)
+
+    print("Building recommendation neighbour table ...")
+    records = ColumnarCatalog(catalog_bin).records
+    count = build_neighbour_table(records, os.path.join(output_dir, 'neighbours'), k=NEIGHBOURS_K)
+    print(f"Stored top-{NEIGHBOURS_K} neighbours for {count} movies in neighbours.*.npy")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Clean a movie dump into the catalog files the app reads.")
+    parser.add_argument('--source', default=SOURCE_CSV, help="IMDb-style CSV to import.")
+    parser.add_argument('--output-dir', default='.', help="Where to write movies.csv, movie_images.csv and derived files.")
+    parser.add_argument('--chunksize', type=int, default=DEFAULT_CHUNKSIZE, help="Source rows per chunk.")
+    parser.add_argument('--jobs', type=int, help="Processes normalizing chunks (default: all cores).")
+    parser.add_argument('--restart', action='store_true', help="Ignore the checkpoint of an interrupted run.")
+    parser.add_argument('--skip-derived', action='store_true', help="Only write the CSVs.")
+    args = parser.parse_args()
+
+    if not os.path.exists(args.source):
+        print(f"File not found: Please ensure '{args.source}' exists.")
+        sys.exit(1)
+
+    print(f"Cleaning {args.source} in chunks of {args.chunksize} rows ...")
+    count = ingest(args.source, args.output_dir, args.chunksize, args.jobs, args.restart)
+    print(f"Saved {count} movies to movies.csv and movie_images.csv")
+
+    if not args.skip_derived:
+        build_derived(args.output_dir)
+    Checkpoint(os.path.join(args.output_dir, STATE_FILE), args.source, args.chunksize).clear()
     print("✅ Cleaning and movie_id addition completed successfully!")
 
-except FileNotFoundError:
-    print("File not found: Please ensure 'imdb_top_1000.csv' is in the same folder as this script.")
-except Exception as e:
-    print(f"An error occurred: {e}")
+
+if __name__ == '__main__':
+    main()
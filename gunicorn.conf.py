@@ -0,0 +1,24 @@
+# Read by gunicorn from the working directory (the Procfile runs it from here).
+# Indexes are built before any request is accepted; set WARM_INDEXES=0 to skip that.
+
+
+def on_starting(server):
+    # A profiling rate set through /metrics/profile only lasts until the server restarts
+    from Main.metrics import reset_profile_rate
+    reset_profile_rate()
+
+
+def when_ready(server):
+    # With --preload the app was imported in this, the master, process: warm it up once
+    # here and every worker forked from it starts with the indexes already in memory
+    if server.cfg.preload_app:
+        from Main.warmup import warm_up
+        warm_up(server.log)
+
+
+def post_worker_init(worker):
+    from Main.pool import scoring_pool
+    from Main.warmup import warm_up
+    if not worker.cfg.preload_app:
+        warm_up(worker.log)
+    scoring_pool.start()
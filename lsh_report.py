@@ -0,0 +1,74 @@
+import argparse
+import json
+import random
+import time
+import numpy as np
+from Main.recomm import get_jaccard_index, get_sparse_index, MinHashLSHIndex
+
+# Compares recom(..., approximate=True) against the exact Jaccard ranking for a sample
+# of seed movies, so LSH_NUM_PERM / LSH_BANDS can be tuned with real recall and latency.
+
+parser = argparse.ArgumentParser(description="Recall/latency report for the MinHash/LSH recommender.")
+parser.add_argument('--configs', default='64x16,64x32,128x32,128x64,256x128',
+                    help="Comma separated NUM_PERMxBANDS pairs to try.")
+parser.add_argument('--seeds', type=int, default=200, help="Number of seed movies to sample.")
+parser.add_argument('--k', type=int, default=10)
+parser.add_argument('--json', dest='json_path', help="Also write the results to this JSON file.")
+args = parser.parse_args()
+
+exact_index = get_jaccard_index()
+sparse_index = get_sparse_index()
+rng = random.Random(0)
+seeds = rng.sample(range(len(exact_index)), min(args.seeds, len(exact_index)))
+
+print(f"Catalog: {len(exact_index)} movies, {len(seeds)} seeds, k={args.k}")
+
+exact_times = []
+exact_top = {}
+for row in seeds:
+    start = time.perf_counter()
+    exact_top[row] = [other for other, _ in exact_index.top_k(row, args.k)]
+    exact_times.append(time.perf_counter() - start)
+
+report = [{
+    'mode': 'exact',
+    'p50_ms': np.percentile(exact_times, 50) * 1000,
+    'p95_ms': np.percentile(exact_times, 95) * 1000,
+    'recall': 1.0,
+}]
+
+for config in args.configs.split(','):
+    num_perm, bands = (int(x) for x in config.lower().split('x'))
+    start = time.perf_counter()
+    lsh = MinHashLSHIndex(sparse_index, exact_index, num_perm=num_perm, bands=bands)
+    build_s = time.perf_counter() - start
+
+    times, recalls, candidates = [], [], []
+    for row in seeds:
+        start = time.perf_counter()
+        approx = [other for other, _ in lsh.top_k(row, args.k)]
+        times.append(time.perf_counter() - start)
+        candidates.append(len(lsh.candidates(row)))
+        expected = exact_top[row]
+        if expected:
+            recalls.append(len(set(approx) & set(expected)) / len(expected))
+
+    report.append({
+        'mode': f'lsh {num_perm}x{bands}',
+        'num_perm': num_perm,
+        'bands': bands,
+        'build_s': build_s,
+        'p50_ms': np.percentile(times, 50) * 1000,
+        'p95_ms': np.percentile(times, 95) * 1000,
+        'mean_candidates': float(np.mean(candidates)),
+        'recall': float(np.mean(recalls)) if recalls else 0.0,
+    })
+
+print(f"{'mode':<16}{'build s':>9}{'p50 ms':>9}{'p95 ms':>9}{'cands':>9}{'recall@' + str(args.k):>11}")
+for entry in report:
+    print(f"{entry['mode']:<16}{entry.get('build_s', 0):>9.2f}{entry['p50_ms']:>9.2f}{entry['p95_ms']:>9.2f}"
+          f"{entry.get('mean_candidates', len(exact_index)):>9.0f}{entry['recall']:>11.3f}")
+
+if args.json_path:
+    with open(args.json_path, 'w') as f:
+        json.dump(report, f, indent=2, default=float)
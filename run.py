@@ -1,8 +1,9 @@
 import os
 from Main import app
+from Main.metrics import reset_profile_rate
 
 if __name__ == "__main__":
-    
+    reset_profile_rate()
     port = int(os.environ.get("PORT", 5000))
     debug = os.environ.get("DEBUG", "True").lower() == "true"
     app.run(debug=debug, host="0.0.0.0", port=port)
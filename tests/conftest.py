@@ -0,0 +1,56 @@
+import os
+import shutil
+import sys
+import tempfile
+
+import pytest
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# The app reads its configuration at import time, so point it at a scratch copy of the
+# catalog and an in-memory database before anything imports Main.
+DATA_DIR = tempfile.mkdtemp(prefix='movie-tests-')
+for name in ('movies.csv', 'movie_images.csv'):
+    shutil.copy(os.path.join(ROOT, name), DATA_DIR)
+os.environ['MOVIE_DATA_DIR'] = DATA_DIR
+os.environ['DATABASE_URL'] = 'sqlite://'
+os.environ['SCORING_POOL_WORKERS'] = '0'
+sys.path.insert(0, ROOT)
+
+from Main import app as flask_app, db  # noqa: E402
+
+
+@pytest.fixture
+def app():
+    flask_app.config.update(TESTING=True, WTF_CSRF_ENABLED=False)
+    with flask_app.app_context():
+        db.create_all()
+        yield flask_app
+        db.session.remove()
+        db.drop_all()
+
+
+@pytest.fixture
+def client(app):
+    return app.test_client()
+
+
+@pytest.fixture
+def user(app):
+    from Main.models import User
+    user = User(username='tester', email='tester@example.com', password='not-a-hash')
+    db.session.add(user)
+    db.session.commit()
+    return user
+
+
+@pytest.fixture
+def logged_in(client, user):
+    with client.session_transaction() as session:
+        session['_user_id'] = str(user.id)
+        session['_fresh'] = True
+    return client
+
+
+def pytest_sessionfinish(session, exitstatus):
+    shutil.rmtree(DATA_DIR, ignore_errors=True)
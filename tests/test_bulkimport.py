@@ -0,0 +1,40 @@
+import Main.bulkimport as bulkimport
+from Main.store import store
+
+
+def _row(movie_id, title):
+    return {'movie_id': movie_id, 'title': title, 'genres': 'Drama', 'overview': 'An overview.',
+            'cast': 'Someone', 'director': 'Someone Else', 'year': '2001',
+            'image_url': 'https://example.com/poster.jpg'}
+
+
+def test_concurrent_imports_cannot_both_add_a_title(monkeypatch):
+    validate_batch = bulkimport.validate_batch
+    calls = []
+
+    def validate_then_race(rows):
+        result = validate_batch(rows)
+        if not calls:
+            # Another import with the same title commits between this validation and the write
+            store.upsert_many([_row('race-other', 'Zzyzx Race Title')])
+        calls.append(rows)
+        return result
+
+    monkeypatch.setattr(bulkimport, 'validate_batch', validate_then_race)
+    try:
+        report = bulkimport.import_movies([(1, _row('race-mine', 'Zzyzx Race Title'))])
+    finally:
+        store.delete('race-other')
+        store.delete('race-mine')
+    assert len(calls) == 2
+    assert report['imported'] == 0
+    assert report['errors'] == [{'row': 1, 'movie_id': 'race-mine', 'errors': ['title already exists']}]
+
+
+def test_import_writes_valid_rows():
+    try:
+        report = bulkimport.import_movies([(1, _row('import-one', 'Zzyzx Import One')), (2, _row('', 'No Id'))])
+        assert report['imported'] == 1
+        assert bulkimport.get_catalog().get('import-one')['title'] == 'Zzyzx Import One'
+    finally:
+        store.delete('import-one')
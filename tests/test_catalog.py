@@ -0,0 +1,62 @@
+import os
+import shutil
+
+import pytest
+
+from Main.catalog import Catalog
+from Main.store import CatalogStore
+from conftest import ROOT
+
+
+@pytest.fixture
+def paths(tmp_path):
+    for name in ('movies.csv', 'movie_images.csv'):
+        shutil.copy(os.path.join(ROOT, name), tmp_path)
+    return dict(movies_path=str(tmp_path / 'movies.csv'), images_path=str(tmp_path / 'movie_images.csv'),
+                binary_path=str(tmp_path / 'catalog.bin'), log_path=str(tmp_path / 'catalog.log'),
+                lock_path=str(tmp_path / 'catalog.lock'), generation_path=str(tmp_path / 'catalog.gen'))
+
+
+def _movie(movie_id, title):
+    return {'movie_id': movie_id, 'title': title, 'genres': 'Drama', 'overview': '', 'cast': '',
+            'director': '', 'year': '2001', 'image_url': ''}
+
+
+def _ids(catalog):
+    return [record['movie_id'] for record in catalog.records]
+
+
+def test_compaction_keeps_the_epoch_of_workers_that_follow_it(paths):
+    store = CatalogStore(compact_log_bytes=0, **paths)
+    catalog = Catalog(**paths).refresh()
+    store.upsert(_movie('new-1', 'First Upload'))
+    catalog.refresh()
+    epoch, version = catalog.epoch, catalog.version
+    first_row = len(catalog.rows) - 1
+
+    # Written after this worker's last refresh, so it is read from the folded log
+    store.upsert(_movie('new-2', 'Second Upload'))
+    store.delete(catalog.records[0]['movie_id'])
+    store.compact()
+    store.upsert(_movie('new-3', 'Third Upload'))
+    catalog.refresh()
+
+    assert catalog.epoch == epoch
+    changes, _ = catalog.changes_since(epoch, version)
+    assert [record['movie_id'] if record else None for _, record in changes] == ['new-2', None, 'new-3']
+    assert catalog.rows[first_row]['movie_id'] == 'new-1'
+    assert _ids(catalog) == _ids(Catalog(**paths).refresh())
+
+
+def test_workers_two_compactions_behind_reload(paths):
+    store = CatalogStore(compact_log_bytes=0, **paths)
+    catalog = Catalog(**paths).refresh()
+    epoch = catalog.epoch
+    store.upsert(_movie('new-1', 'First Upload'))
+    store.compact()
+    # A worker that missed the first compaction cannot follow the second
+    store.upsert(_movie('new-2', 'Second Upload'))
+    store.compact()
+    catalog.refresh()
+    assert catalog.epoch == epoch + 1
+    assert _ids(catalog) == _ids(Catalog(**paths).refresh())
@@ -0,0 +1,73 @@
+import pytest
+
+import Main.routes as routes
+from Main.metrics import Metrics, metrics
+
+
+@pytest.fixture
+def token(monkeypatch):
+    monkeypatch.setattr(routes, 'METRICS_TOKEN', 'secret')
+    return {'Authorization': 'Bearer secret'}
+
+
+@pytest.fixture
+def profile_rate():
+    rate = metrics.profile_rate
+    yield
+    metrics.profile_rate = rate
+
+
+def test_metrics_requires_token(client, token):
+    assert client.get('/metrics').status_code == 401
+    assert client.get('/metrics', headers=token).status_code == 200
+
+
+def test_profile_requires_token_even_when_logged_in(logged_in, token, profile_rate):
+    assert logged_in.post('/metrics/profile', data={'rate': '0.5'}).status_code == 401
+    assert logged_in.get('/metrics/profile').status_code == 401
+    response = logged_in.post('/metrics/profile', data={'rate': '0.5'}, headers=token)
+    assert response.status_code == 200
+    assert response.get_json()['profile_rate'] == 0.5
+
+
+def test_profile_endpoint_is_off_without_a_token(logged_in, profile_rate):
+    rate = metrics.profile_rate
+    assert logged_in.post('/metrics/profile', data={'rate': '1'}).status_code == 404
+    assert logged_in.get('/metrics/profile').status_code == 404
+    assert metrics.profile_rate == rate
+
+
+def test_restart_restores_the_configured_rate(profile_rate, monkeypatch):
+    import importlib
+    # Main re-exports the metrics object under the module's name
+    module = importlib.import_module('Main.metrics')
+    monkeypatch.setattr(module, 'PROFILE_RATE', 0.01)
+    module.set_profile_rate(1)
+    module.reset_profile_rate()
+    assert metrics.profile_rate == 0.01
+
+
+def test_profile_rate_reaches_other_workers(logged_in, token, profile_rate, tmp_path):
+    path = str(tmp_path / 'profile.rate')
+    this_worker, other_worker = Metrics(0, path), Metrics(0, path)
+    assert other_worker.profile_rate == 0
+    this_worker.profile_rate = 0.25
+    assert other_worker.profile_rate == 0.25
+
+    response = logged_in.post('/metrics/profile', data={'rate': '2'}, headers=token)
+    assert response.get_json() == {'pid': response.get_json()['pid'], 'profile_rate': 1.0, 'scope': 'all workers'}
+    assert Metrics(0, metrics._profile_rate.path).profile_rate == 1.0
+
+
+def test_metrics_export_named_cache_stats(client):
+    from Main.recomm import recommendation_cache
+    before = recommendation_cache.hits
+    recommendation_cache.set('probe', [])
+    recommendation_cache.get('probe')
+    body = client.get('/metrics').get_data(as_text=True)
+    for cache in ('recommendation', 'search', 'fragment'):
+        for name in ('movie_cache_entries', 'movie_cache_max_entries', 'movie_cache_hits_total',
+                     'movie_cache_misses_total', 'movie_cache_evictions_total', 'movie_cache_expirations_total'):
+            assert f'{name}{{cache="{cache}",' in body
+    hits = [line for line in body.splitlines() if line.startswith('movie_cache_hits_total{cache="recommendation"')]
+    assert int(hits[0].rsplit(' ', 1)[1]) == before + 1
@@ -0,0 +1,86 @@
+import numpy as np
+import pytest
+
+from Main.catalog import get_catalog
+from Main.recomm import JaccardIndex, SparseJaccardIndex
+
+
+@pytest.fixture(scope='module')
+def records():
+    snapshot = get_catalog().snapshot().records
+    records = [dict(snapshot[row]) for row in range(len(snapshot))]
+    # The same movie_id on two rows, once with an identical word set and once with another title
+    records.append(dict(records[3]))
+    records.append(dict(records[7], title='Another Title'))
+    return records
+
+
+def test_sparse_scores_match_postings_index(records):
+    index = JaccardIndex(records)
+    sparse_index = SparseJaccardIndex(index)
+    rows = [0, 3, 7, len(records) - 2, len(records) - 1]
+    batch = sparse_index.scores(rows)
+    for i, row in enumerate(rows):
+        assert np.array_equal(batch[i], index.scores(row))
+
+
+def test_sparse_scores_exclude_every_row_of_the_seed_movie(records):
+    sparse_index = SparseJaccardIndex(JaccardIndex(records))
+    duplicate = len(records) - 2
+    scores = sparse_index.scores([3])[0]
+    assert scores[3] == scores[duplicate] == -1
+    assert (scores == -1).sum() == 2
+    profile = sparse_index.profile_scores([3])
+    assert profile[3] == profile[duplicate] == -1
+
+
+def test_top_k_batches_are_capped_by_cells(records, monkeypatch):
+    import Main.recomm as recomm
+    sparse_index = SparseJaccardIndex(JaccardIndex(records))
+    expected = list(sparse_index.top_k(np.arange(50), 5))
+    batches = []
+    scores = sparse_index.scores
+    monkeypatch.setattr(sparse_index, 'scores', lambda rows: batches.append(len(rows)) or scores(rows))
+    monkeypatch.setattr(recomm, 'NEIGHBOURS_BATCH_CELLS', 16 * len(sparse_index))
+    assert list(sparse_index.top_k(np.arange(50), 5, batch_size=64)) == expected
+    assert batches == [16, 16, 16, 2]
+
+
+def test_card_deck_skips_deleted_rows_and_compacts(records):
+    import random
+    from Main.recomm import CardDeck
+    deck = CardDeck(records)
+    # Delete a fifth of the rows: sampling redraws around them without a rebuild
+    deleted = list(range(0, len(records), 5))
+    deck.apply([(row, None) for row in deleted])
+    assert deck.removed == len(deleted)
+    live_ids = {records[row]['movie_id'] for row in range(len(records)) if row % 5}
+    cards = deck.sample(10, rng=random.Random(1))
+    assert len(cards) == 10 and all(card['movie_id'] in live_ids for card in cards)
+
+    # Past a quarter of the rows the buckets are rebuilt without the deleted ones
+    deck.apply([(row, None) for row in range(1, len(records), 5)])
+    assert deck.removed == 0
+    assert all(deck.alive[row] for rows in deck.buckets.values() for row in rows)
+    assert len(deck.sample(10, rng=random.Random(2))) == 10
+
+    added = dict(records[1], movie_id='new-card', genres='documentary', year='1950')
+    deck.apply([(len(records), added)])
+    cards = deck.sample(10, genre='documentary', decade=1950, rng=random.Random(3))
+    assert [card['movie_id'] for card in cards] == ['new-card']
+
+
+def test_stream_scores_movies_uploaded_between_batches():
+    from Main.recomm import iter_recommendations
+    from Main.store import store
+    seed = dict(get_catalog().records[0])
+    stream = iter_recommendations([('title', seed['title']), ('title', 'Zzyzx Stream Upload')], k=3, batch_size=1)
+    assert next(stream)['movie_id'] == seed['movie_id']
+    # The scoring index of the first batch predates this row; the second batch must not use it
+    store.upsert(dict(seed, movie_id='stream-upload', title='Zzyzx Stream Upload'))
+    try:
+        result = next(stream)
+    finally:
+        store.delete('stream-upload')
+    assert result['movie_id'] == 'stream-upload'
+    assert seed['movie_id'] in [movie['movie_id'] for movie in result['recommendations']]
@@ -0,0 +1,52 @@
+import heapq
+
+import pytest
+
+from Main.catalog import get_catalog
+from Main.search import SearchIndex
+
+
+# Queries that used to lose matches to the trigram bound, plus short, common and long ones
+QUERIES = [
+    'comedy romance', 'godfather', 'nolan', 'leonardo dicaprio', 'hayao miyazaki anime',
+    'christopher nolan films', 'a', 'ab', 'the', 'star wars', 'drama', 'tom hanks space',
+    'a heist in new york city that goes wrong, told backwards by the one man who got away',
+]
+
+
+@pytest.fixture(scope='module')
+def index():
+    return SearchIndex(get_catalog().snapshot().records)
+
+
+def brute_force(index, query):
+    results = [(row, score) for row in range(len(index)) if (score := index.score(query, row)) is not None]
+    return heapq.nsmallest(len(results), results, key=lambda x: (-x[1], x[0]))
+
+
+@pytest.mark.parametrize('query', QUERIES)
+def test_search_matches_brute_force(index, query):
+    expected = brute_force(index, query)
+    assert index.search(query, limit=len(index)) == expected
+    assert index.search(query) == expected[:20]
+
+
+@pytest.mark.parametrize('max_lazy_rows', [10000, 0])
+@pytest.mark.parametrize('query', ['godfather', 'the', 'tom hanks space', 'zzqx', 'nolan'])
+def test_lazy_search_matches_brute_force(index, query, max_lazy_rows, monkeypatch):
+    import Main.search
+    # Small catalogs are always scanned in full; 0 lazy rows tests the fallback to that
+    monkeypatch.setattr(Main.search, 'LAZY_SEARCH_ROWS', 0)
+    monkeypatch.setattr(Main.search, 'MAX_LAZY_ROWS', max_lazy_rows)
+    expected = brute_force(index, query)
+    assert index.search(query, limit=len(index)) == expected
+    assert index.search(query) == expected[:20]
+
+
+def test_apply_matches_fresh_build(index):
+    records = get_catalog().snapshot().records
+    base = SearchIndex([records[row] for row in range(900)])
+    base.apply([(row, records[row]) for row in range(900, len(records))] + [(5, None)])
+    for query in ('godfather', 'nolan', 'drama'):
+        expected = [(row, score) for row, score in index.search(query, limit=len(index)) if row != 5]
+        assert base.search(query, limit=len(index)) == expected
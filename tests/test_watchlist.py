@@ -0,0 +1,67 @@
+import threading
+
+import pytest
+from flask import Flask
+from sqlalchemy.exc import IntegrityError
+
+from Main import db
+from Main.models import User, UserWatchlist
+from Main.routes import MAX_WATCHLIST_ITEMS
+
+
+def test_add_if_room_stops_at_the_limit(app, user):
+    for i in range(3):
+        assert UserWatchlist.add_if_room(user.id, f'movie-{i}', 3)
+    assert not UserWatchlist.add_if_room(user.id, 'movie-3', 3)
+    db.session.commit()
+    assert UserWatchlist.query.filter_by(user_id=user.id).count() == 3
+
+
+def test_add_if_room_rejects_duplicates(app, user):
+    assert UserWatchlist.add_if_room(user.id, 'movie-0', 3)
+    with pytest.raises(IntegrityError):
+        UserWatchlist.add_if_room(user.id, 'movie-0', 3)
+    db.session.rollback()
+
+
+def test_add_to_watchlist_route(logged_in, user, monkeypatch):
+    from Main import routes
+    monkeypatch.setattr(routes.for_you_worker, 'schedule', lambda user_id: None)
+    for i in range(MAX_WATCHLIST_ITEMS + 2):
+        assert logged_in.post(f'/add_to_watchlist/movie-{i}').status_code == 302
+    assert logged_in.post('/add_to_watchlist/movie-0').status_code == 302
+    assert UserWatchlist.query.filter_by(user_id=user.id).count() == MAX_WATCHLIST_ITEMS
+
+
+def test_concurrent_adds_never_pass_the_limit(tmp_path):
+    # A file database, so every thread gets its own connection as separate workers would
+    other = Flask('watchlist-sqlite')
+    other.config['SQLALCHEMY_DATABASE_URI'] = f'sqlite:///{tmp_path / "watchlist.db"}'
+    db.init_app(other)
+    with other.app_context():
+        db.create_all()
+        user = User(username='racer', email='racer@example.com', password='not-a-hash')
+        db.session.add(user)
+        db.session.commit()
+        user_id = user.id
+
+    start = threading.Barrier(12)
+    added = []
+
+    def add(i):
+        with other.app_context():
+            start.wait()
+            added.append(UserWatchlist.add_if_room(user_id, f'movie-{i}', MAX_WATCHLIST_ITEMS))
+            db.session.commit()
+
+    threads = [threading.Thread(target=add, args=(i,)) for i in range(12)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    assert added.count(True) == MAX_WATCHLIST_ITEMS
+    with other.app_context():
+        assert UserWatchlist.query.filter_by(user_id=user_id).count() == MAX_WATCHLIST_ITEMS
+        db.session.remove()
+        db.engines[None].dispose()